@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Conversation, Message
+from .signals import refresh_summaries
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
@@ -11,3 +12,13 @@ class MessageAdmin(admin.ModelAdmin):
     list_display = ("id", "conversation", "role", "status", "created_at")
     list_filter = ("role", "status")
     search_fields = ("content",)
+
+    # حذف پیام سیگنال ندارد (apps/chat/signals.py)؛ خلاصهٔ گفتگو این‌جا بازسازی می‌شود
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_summaries([obj.conversation_id])
+
+    def delete_queryset(self, request, queryset):
+        conversation_ids = set(queryset.values_list("conversation_id", flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_summaries(conversation_ids)
@@ -0,0 +1,95 @@
+import base64
+import hashlib
+import json
+from typing import Any, List, Optional, Sequence
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(BasePagination):
+    """
+    صفحه‌بندی keyset (cursor) روی ترتیب نزولی `ordering`؛ cursor مقادیر کلید آخرین ردیف صفحه است.
+    بدون OFFSET و COUNT: هزینهٔ هر صفحه (با index مناسب) مستقل از تعداد کل ردیف‌هاست.
+    فیلد آخر ordering باید یکتا باشد (معمولاً id) تا ردیف‌های هم‌مقدار جا نیفتند.
+    """
+    ordering: Sequence[str] = ("id",)
+    page_size = 30
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, obj) -> str:
+        values = [str(getattr(obj, field)) for field in self.ordering]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+    def decode_cursor(self, queryset, raw: str) -> List[Any]:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+            meta = queryset.model._meta
+            return [meta.get_field(field).to_python(value) for field, value in zip(self.ordering, values, strict=True)]
+        except Exception:
+            raise NotFound("Invalid cursor")
+
+    def _after(self, values: List[Any]) -> Q:
+        """ردیف‌های بعد از cursor در ترتیب نزولی: (a < va) یا (a = va و b < vb) یا ..."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            step = Q(**{f"{field}__lt": values[i]})
+            for prev, value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{prev: value})
+            condition |= step
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None) -> Optional[list]:
+        size = self.get_page_size(request)
+        queryset = queryset.order_by(*(f"-{field}" for field in self.ordering))
+        raw = request.query_params.get(self.cursor_query_param)
+        if raw:
+            queryset = queryset.filter(self._after(self.decode_cursor(queryset, raw)))
+        # یک ردیف اضافه فقط برای فهمیدن has_more
+        rows = list(queryset[: size + 1])
+        self.has_more = len(rows) > size
+        page = rows[:size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_more else None
+        return page
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({"results": data, "next_cursor": self.next_cursor, "has_more": self.has_more})
+
+
+class ConversationPagination(KeysetPagination):
+    """سایدبار: جدیدترین فعالیت اول؛ با index (owner, -updated_at, -id)"""
+    ordering = ("updated_at", "id")
+
+
+class MessagePagination(KeysetPagination):
+    """
+    تاریخچهٔ پیام‌ها: اول جدیدترین صفحه، با next_cursor صفحه‌های قدیمی‌تر (اسکرول به بالا).
+    هر صفحه به ترتیب زمانی (قدیمی → جدید) برگردانده می‌شود تا کلاینت مستقیم رندر کند.
+    """
+    ordering = ("id",)
+    page_size = 50
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None) -> Optional[list]:
+        page = super().paginate_queryset(queryset, request, view)
+        page.reverse()
+        return page
+
+    def get_etag(self, page) -> str:
+        """ETag صفحه از نسخهٔ ردیف‌ها؛ پیام در حال استریم با تغییر status/updated_at/content آن را عوض می‌کند"""
+        digest = hashlib.sha256()
+        for msg in page:
+            digest.update(f"{msg.pk}:{msg.status}:{msg.updated_at.isoformat()}:{len(msg.content)};".encode())
+        digest.update(f"{self.has_more}".encode())
+        return '"%s"' % digest.hexdigest()[:32]
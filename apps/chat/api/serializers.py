@@ -8,7 +8,10 @@ class MessageCreateSerializer(serializers.Serializer):
 class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
-        fields = ("id", "title", "created_at", "updated_at")
+        fields = (
+            "id", "title", "created_at", "updated_at",
+            "message_count", "last_message_at", "last_preview", "last_model",
+        )
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
@@ -2,6 +2,7 @@ from django.urls import path , include
 from .views import (
     MessageCreateView, 
     MessageCreateStreamView,
+    MessageCancelView,
     ConversationListView, 
     ConversationMessagesView,
     auth_status,
@@ -16,6 +17,7 @@ urlpatterns = [
     # ✨ FIX: URL from 'messages/stream' to 'messages/stream/' (added trailing slash)
     # این آدرس اکنون با درخواست فرانت‌اند (`/api/v1/messages/stream/`) مطابقت دارد
     path("messages/stream/", MessageCreateStreamView.as_view(), name="message-stream"),
+    path("messages/<int:message_id>/cancel/", MessageCancelView.as_view(), name="message-cancel"),
     
     # ✨ FIX: URL from 'conversations/<int:conversation_id>/messages' to 'conversations/<int:conversation_id>/messages/'
     path("conversations/<int:conversation_id>/messages/", ConversationMessagesView.as_view(), name="conversation-messages"),
@@ -1,10 +1,12 @@
 from typing import List
 import logging
+import time
 
 from django.conf import settings
 from django.db.models import Q
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -14,6 +16,7 @@ from rest_framework import status
 from rest_framework.authentication import SessionAuthentication
 
 from apps.chat.models import Conversation, Message
+from .pagination import ConversationPagination, MessagePagination
 from .serializers import (
     MessageCreateSerializer,
     MessageSerializer,
@@ -24,7 +27,13 @@ from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from apps.gateway.service import get_provider
 from apps.queueapp.tasks import run_generation_task
+from apps.queueapp.generation_stream import enqueue_generation
 from apps.chat.services import _make_quick_title  # ✨ 1. ایمپورت تابع ساخت عنوان سریع
+from apps.chat.cancellation import request_cancel
+from apps.models.services.quotas import (
+    QuotaExceeded, estimate_tokens, hold_for_message, reserve_tokens, settle_for_message, settle_tokens,
+)
+from apps.models.services.usage import record_usage
 
 log = logging.getLogger(__name__)
 
@@ -56,6 +65,9 @@ def _accessible_conversations(request):
     """
     sess_ids = _session_ids(request)
     if request.user.is_authenticated:
+        if not sess_ids:
+            # حالت معمول: فقط owner تا index (owner, -updated_at, -id) مستقیم استفاده شود (بدون OR)
+            return Conversation.objects.filter(owner=request.user)
         return Conversation.objects.filter(
             Q(owner=request.user) | Q(owner__isnull=True, id__in=sess_ids)
         )
@@ -63,21 +75,20 @@ def _accessible_conversations(request):
         return Conversation.objects.filter(owner__isnull=True, id__in=sess_ids)
 
 
-def _ensure_access_or_404(request, conv: Conversation) -> None:
+def _can_access(user, sess_ids: List[int], conv_id: int, owner_id) -> bool:
     """
-    کنترل دسترسی برای یک گفتگو (در مسیرهایی که conv قبلاً گرفته شده).
+    قاعدهٔ دسترسی به یک گفتگو (مشترک بین viewها و WebSocket):
     - کاربر لاگین: یا owner خودش باشد، یا conv بی‌مالک و در سشن باشد.
-    - مهمان: conv باید در سشن باشد.
+    - مهمان: conv باید بی‌مالک و در سشن باشد.
     """
-    user = request.user if request.user.is_authenticated else None
-    sess_ids = _session_ids(request)
+    if user is not None and user.is_authenticated:
+        return owner_id == user.id or (owner_id is None and conv_id in sess_ids)
+    return owner_id is None and conv_id in sess_ids
 
-    if user:
-        allowed = (conv.owner_id == user.id) or (conv.owner_id is None and conv.id in sess_ids)
-    else:
-        allowed = (conv.owner_id is None) and (conv.id in sess_ids)
 
-    if not allowed:
+def _ensure_access_or_404(request, conv: Conversation) -> None:
+    """کنترل دسترسی برای یک گفتگو (در مسیرهایی که conv قبلاً گرفته شده)."""
+    if not _can_access(request.user, _session_ids(request), conv.id, conv.owner_id):
         raise Http404
 
 
@@ -101,42 +112,72 @@ class MessageCreateView(APIView):
                 status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             )
 
+        conv = None
         if data.get("conversation_id"):
             conv = get_object_or_404(Conversation, id=data["conversation_id"])
             _ensure_access_or_404(request, conv)
-            if request.user.is_authenticated and conv.owner_id is None:
-                conv.owner = request.user
-                conv.save(update_fields=["owner"])
-        else:
-            # ✨ 2. ساخت عنوان سریع بلافاصله
-            quick_title = _make_quick_title(data["content"])
-            conv = Conversation.objects.create(
-                owner=request.user if request.user.is_authenticated else None,
-                title=quick_title,  # ✨ 3. استفاده از عنوان سریع به جای عنوان خالی
-            )
-            if not request.user.is_authenticated:
-                _add_session_conv(request, conv.id)
 
-        user_msg = Message.objects.create(
-            conversation=conv,
-            role=Message.Role.USER,
-            content=data["content"],
-            status=Message.Status.WORKING,
-            provider=(data.get("provider") or "").strip() or None,
-            model_name=(data.get("model") or "").strip() or None,
-        )
+        # رزرو فقط بعد از بررسی دسترسی؛ هر خطا تا شروع تولید رزرو را آزاد می‌کند
+        try:
+            reservation = reserve_tokens(request.user, (data.get("model") or "").strip() or None, estimate_tokens(data["content"]))
+        except QuotaExceeded as e:
+            return Response(
+                {"detail": str(e), "quota": e.kind},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
 
-        provider = get_provider(user_msg.provider)
-        events = provider.generate(
-            messages=[{"role": "user", "content": data["content"]}],
-            model=user_msg.model_name,
-            stream=True,
-        )
+        try:
+            if conv is not None:
+                if request.user.is_authenticated and conv.owner_id is None:
+                    conv.owner = request.user
+                    conv.save(update_fields=["owner"])
+            else:
+                # ✨ 2. ساخت عنوان سریع بلافاصله
+                quick_title = _make_quick_title(data["content"])
+                conv = Conversation.objects.create(
+                    owner=request.user if request.user.is_authenticated else None,
+                    title=quick_title,  # ✨ 3. استفاده از عنوان سریع به جای عنوان خالی
+                )
+                if not request.user.is_authenticated:
+                    _add_session_conv(request, conv.id)
+
+            user_msg = Message.objects.create(
+                conversation=conv,
+                role=Message.Role.USER,
+                content=data["content"],
+                status=Message.Status.WORKING,
+                provider=(data.get("provider") or "").strip() or None,
+                model_name=(data.get("model") or "").strip() or None,
+            )
 
+            provider = get_provider(user_msg.provider)
+        except Exception:
+            settle_tokens(reservation, 0)
+            raise
+        model_used = user_msg.model_name or getattr(provider, "default_model", None)
+        usage = {
+            "user_id": request.user.pk if request.user.is_authenticated else None,
+            "session_key": None if request.user.is_authenticated else request.session.session_key,
+        }
+        start_ts = time.perf_counter()
         response_text = ""
-        for ev in events:
-            if ev.get("type") == "token":
-                response_text += ev.get("delta", "")
+        try:
+            events = provider.generate(
+                messages=[{"role": "user", "content": data["content"]}],
+                model=user_msg.model_name,
+                stream=True,
+            )
+            for ev in events:
+                if ev.get("type") == "token":
+                    response_text += ev.get("delta", "")
+        except Exception as e:
+            record_usage(model_used, tokens=len(data["content"]) + len(response_text),
+                         latency_ms=int((time.perf_counter() - start_ts) * 1000), success=False, error=str(e), **usage)
+            raise
+        finally:
+            settle_tokens(reservation, len(data["content"]) + len(response_text))
+        record_usage(model_used, tokens=len(data["content"]) + len(response_text),
+                     latency_ms=int((time.perf_counter() - start_ts) * 1000), **usage)
 
         Message.objects.create(
             conversation=conv,
@@ -144,7 +185,7 @@ class MessageCreateView(APIView):
             content=response_text,
             status=Message.Status.DONE,
             provider=getattr(provider, "name", "unknown"),
-            model_name=user_msg.model_name or getattr(provider, "default_model", None),
+            model_name=model_used,
         )
         user_msg.status = Message.Status.DONE
         user_msg.save(update_fields=["status"])
@@ -175,38 +216,66 @@ class MessageCreateStreamView(APIView):
                 status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             )
 
-        new_conv_created = False
+        model_name = (data.get("model") or "").strip() or None
+        conv = None
         if data.get("conversation_id"):
             conv = get_object_or_404(Conversation, id=data["conversation_id"])
             _ensure_access_or_404(request, conv)
-            if request.user.is_authenticated and conv.owner_id is None:
-                conv.owner = request.user
-                conv.save(update_fields=["owner"])
-        else:
-            owner = request.user if request.user.is_authenticated else None
-            
-            # ✨ 2. ساخت عنوان سریع بلافاصله
-            quick_title = _make_quick_title(data["content"])
-            
-            # ✨ 3. ایجاد گفتگو با عنوان سریع برای جلوگیری از Race Condition
-            conv = Conversation.objects.create(owner=owner, title=quick_title)
-            
-            new_conv_created = True
-            log.debug(f"✅ New conversation created with ID: {conv.id}, Title: '{conv.title}' for owner: {owner}")
-            if not request.user.is_authenticated:
-                _add_session_conv(request, conv.id)
-
-        user_msg = Message.objects.create(
-            conversation=conv,
-            role=Message.Role.USER,
-            content=data["content"],
-            status=Message.Status.QUEUED,
-            provider=(data.get("provider") or "").strip() or None,
-            model_name=(data.get("model") or "").strip() or None,
-        )
-        log.debug(f"✅ New message created with ID: {user_msg.id} in conversation: {conv.id}")
-        
-        run_generation_task.delay(user_msg.id)
+
+        # رزرو فقط بعد از بررسی دسترسی؛ تا تحویل به worker هر خطا رزرو را آزاد می‌کند
+        try:
+            reservation = reserve_tokens(request.user, model_name, estimate_tokens(data["content"]))
+        except QuotaExceeded as e:
+            return Response(
+                {"detail": str(e), "quota": e.kind},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+
+        new_conv_created = False
+        user_msg = None
+        try:
+            if conv is not None:
+                if request.user.is_authenticated and conv.owner_id is None:
+                    conv.owner = request.user
+                    conv.save(update_fields=["owner"])
+            else:
+                owner = request.user if request.user.is_authenticated else None
+
+                # ✨ 2. ساخت عنوان سریع بلافاصله
+                quick_title = _make_quick_title(data["content"])
+
+                # ✨ 3. ایجاد گفتگو با عنوان سریع برای جلوگیری از Race Condition
+                conv = Conversation.objects.create(owner=owner, title=quick_title)
+
+                new_conv_created = True
+                log.debug(f"✅ New conversation created with ID: {conv.id}, Title: '{conv.title}' for owner: {owner}")
+                if not request.user.is_authenticated:
+                    _add_session_conv(request, conv.id)
+
+            user_msg = Message.objects.create(
+                conversation=conv,
+                role=Message.Role.USER,
+                content=data["content"],
+                status=Message.Status.QUEUED,
+                provider=(data.get("provider") or "").strip() or None,
+                model_name=model_name,
+            )
+            log.debug(f"✅ New message created with ID: {user_msg.id} in conversation: {conv.id}")
+            # رزرو پیش از صف‌کردن نگه داشته می‌شود تا worker سریع‌تر از view آن را از دست ندهد
+            hold_for_message(user_msg.id, reservation)
+
+            if getattr(settings, "CHAT_GENERATION_BACKEND", "celery") == "redis_stream":
+                enqueue_generation(user_msg.id)
+            else:
+                run_generation_task.delay(user_msg.id)
+        except Exception:
+            if user_msg is None:
+                settle_tokens(reservation, 0)
+            else:
+                # پیام هرگز به worker نرسید: رزرو نگه‌داشته آزاد و پیام FAILED می‌شود (نه QUEUED ابدی)
+                settle_for_message(user_msg.id, 0)
+                Message.objects.filter(id=user_msg.id, status=Message.Status.QUEUED).update(status=Message.Status.FAILED)
+            raise
 
         response_data = {
             "conversation_id": conv.id,
@@ -220,6 +289,27 @@ class MessageCreateStreamView(APIView):
         return Response(response_data, status=status.HTTP_201_CREATED)
 
 
+class MessageCancelView(APIView):
+    """
+    لغو تولید پاسخ برای یک پیام در صف/در حال استریم.
+    فقط پرچم لغو ثبت می‌شود؛ worker بین چانک‌ها آن را می‌بیند، stream upstream را می‌بندد و
+    پاسخ ناقص را با وضعیت cancelled ذخیره می‌کند.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = [SessionAuthentication]
+
+    def post(self, request, message_id: int):
+        msg = get_object_or_404(Message.objects.select_related("conversation"), id=message_id, role=Message.Role.USER)
+        _ensure_access_or_404(request, msg.conversation)
+
+        active = (Message.Status.QUEUED, Message.Status.WORKING, Message.Status.STREAMING)
+        if msg.status not in active:
+            return Response({"message_id": msg.id, "status": msg.status}, status=status.HTTP_409_CONFLICT)
+
+        request_cancel(msg.id)
+        return Response({"message_id": msg.id, "status": "cancelling"}, status=status.HTTP_202_ACCEPTED)
+
+
 # ---------------------------
 # Conversations list
 # ---------------------------
@@ -228,24 +318,21 @@ class ConversationListView(ListAPIView):
     permission_classes = [AllowAny]
     authentication_classes = [SessionAuthentication]
     serializer_class = ConversationSerializer
+    pagination_class = ConversationPagination
 
     def get_queryset(self):
-        return _accessible_conversations(self.request).order_by("-updated_at")
+        # ترتیب (-updated_at, -id) را paginator اعمال می‌کند
+        return _accessible_conversations(self.request).only(*ConversationSerializer.Meta.fields)
 
     def list(self, request, *args, **kwargs):
-        qs = self.get_queryset()
-        ids = list(qs.values_list("id", flat=True))
+        response = super().list(request, *args, **kwargs)
         log.info("CONV_LIST", extra={
             "user_id": getattr(request.user, "id", None),
-            "sess_ids": request.session.get("guest_conversations", []),
-            "returned_ids": ids,
+            "sess_ids_count": len(_session_ids(request)),
+            "returned_ids": [c["id"] for c in response.data["results"]],
+            "has_more": response.data["has_more"],
         })
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(qs, many=True)
-        return Response(serializer.data)
+        return response
 
 # ---------------------------
 # Messages of one conversation
@@ -255,26 +342,33 @@ class ConversationMessagesView(ListAPIView):
     permission_classes = [AllowAny]
     authentication_classes = [SessionAuthentication]
     serializer_class = MessageSerializer
+    pagination_class = MessagePagination
 
     def get_queryset(self):
         conversation_id = self.kwargs["conversation_id"]
-        conv = get_object_or_404(_accessible_conversations(self.request), pk=conversation_id)
-        return Message.objects.filter(conversation=conv).order_by("id")
+        if not _accessible_conversations(self.request).filter(pk=conversation_id).exists():
+            raise Http404
+        # ترتیب (-id) را paginator اعمال می‌کند؛ index (conversation, id)
+        return Message.objects.filter(conversation_id=conversation_id)
 
     def list(self, request, *args, **kwargs):
-        qs = self.get_queryset()
-        count = qs.count()
+        page = self.paginate_queryset(self.get_queryset())
+        etag = self.paginator.get_etag(page)
+        # باز کردن دوبارهٔ گفتگو: If-None-Match برابر → 304 بدون سریالایز و بدنه
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Cookie"])
         log.info("CONV_MSGS", extra={
             "user_id": getattr(request.user, "id", None),
             "pk": self.kwargs.get("conversation_id"),
-            "count": count,
+            "returned": len(page),
+            "has_more": self.paginator.has_more,
+            "status": response.status_code,
         })
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(qs, many=True)
-        return Response(serializer.data)
+        return response
 
 # ---------------------------
 # Authentication Status
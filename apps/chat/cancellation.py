@@ -0,0 +1,86 @@
+# apps/chat/cancellation.py
+"""
+لغو تولید پاسخ بین پروسه‌ها.
+
+consumer وب‌سوکت یا API لغو، یک پرچم کوتاه‌عمر در Redis می‌گذارند و worker سلری بین چانک‌های
+upstream آن را (با فاصلهٔ حداقل CHAT_CANCEL_CHECK_SECONDS) بررسی می‌کند. بدون Redis از cache
+جنگو استفاده می‌شود که فقط داخل همان پروسه معتبر است (کافی برای dev با CELERY_TASK_ALWAYS_EAGER).
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.queueapp.redis_client import get_redis
+
+log = logging.getLogger(__name__)
+
+_KEY = "chat:cancel:{}"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_CANCEL_TTL_SECONDS", 3600))
+
+
+def request_cancel(message_id: int) -> None:
+    key = _KEY.format(message_id)
+    client = get_redis()
+    try:
+        if client is not None:
+            client.set(key, b"1", ex=_ttl())
+        else:
+            cache.set(key, True, _ttl())
+    except Exception as e:
+        log.warning("Could not set cancel flag for message %s: %s", message_id, e)
+
+
+def is_cancelled(message_id: int) -> bool:
+    key = _KEY.format(message_id)
+    client = get_redis()
+    try:
+        if client is not None:
+            return bool(client.exists(key))
+        return bool(cache.get(key))
+    except Exception as e:
+        # خطای Redis نباید تولید پاسخ را متوقف کند
+        log.warning("Could not read cancel flag for message %s: %s", message_id, e)
+        return False
+
+
+def clear_cancel(message_id: int) -> None:
+    key = _KEY.format(message_id)
+    client = get_redis()
+    try:
+        if client is not None:
+            client.delete(key)
+        else:
+            cache.delete(key)
+    except Exception:
+        pass
+
+
+class CancelWatcher:
+    """بررسی پرچم لغو را محدود می‌کند تا به ازای هر توکن یک رفت‌وبرگشت Redis نداشته باشیم."""
+
+    def __init__(self, message_id: int, interval: float = None):
+        self.message_id = message_id
+        self.interval = float(interval if interval is not None else getattr(settings, "CHAT_CANCEL_CHECK_SECONDS", 0.5))
+        self._next_check = 0.0
+        self.cancelled = False
+
+    def check(self) -> bool:
+        if self.cancelled:
+            return True
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.interval
+            self.cancelled = is_cancelled(self.message_id)
+        return self.cancelled
+
+    async def acheck(self) -> bool:
+        """نسخهٔ event loop: فقط وقتی نوبت بررسی رسیده، کلاینت همگام Redis روی thread اجرا می‌شود."""
+        if self.cancelled or time.monotonic() < self._next_check:
+            return self.cancelled
+        return await asyncio.to_thread(self.check)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Conversation
+from apps.chat.signals import refresh_summaries
+
+
+class Command(BaseCommand):
+    help = 'بازسازی خلاصهٔ گفتگوها (message_count، last_message_at، last_preview، last_model) به‌صورت تکه‌ای'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='تعداد گفتگو در هر تراکنش')
+
+    def handle(self, *args, **options):
+        last_id = 0
+        done = 0
+        while True:
+            ids = list(
+                Conversation.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['chunk']]
+            )
+            if not ids:
+                break
+            done += refresh_summaries(ids)
+            last_id = ids[-1]
+            self.stdout.write(f"{done} conversations...")
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {done} conversation summaries"))
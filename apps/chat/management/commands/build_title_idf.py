@@ -0,0 +1,42 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.chat.models import Message
+from apps.chat.titler import _is_boundary, _key, _TOKEN_RE, ZWNJ, normalize
+
+
+class Command(BaseCommand):
+    help = 'ساخت جدول فراوانی سندی (idf) عنوان‌ساز استخراجی از پیام‌های کاربران'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.SMART_TITLE_IDF_PATH)
+        parser.add_argument('--min-df', type=int, default=2, help='کلمه‌های کم‌تکرارتر ذخیره نمی‌شوند (idf بیشینه می‌گیرند)')
+        parser.add_argument('--limit', type=int, default=200_000, help='حداکثر تعداد پیام (جدیدترین‌ها)')
+
+    def handle(self, *args, **options):
+        df = {}
+        docs = 0
+        contents = (
+            Message.objects.filter(role=Message.Role.USER)
+            .order_by('-id')
+            .values_list('content', flat=True)[:options['limit']]
+        )
+        for content in contents.iterator(chunk_size=2000):
+            docs += 1
+            words = {
+                _key(token.strip(ZWNJ)) for token in _TOKEN_RE.findall(normalize(content or ""))
+                if not _is_boundary(token)
+            }
+            for word in words:
+                df[word] = df.get(word, 0) + 1
+
+        kept = {word: n for word, n in df.items() if n >= options['min_df']}
+        os.makedirs(os.path.dirname(options['output']) or ".", exist_ok=True)
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({"docs": docs, "df": kept}, f, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['output']}: docs={docs} words={len(kept)} (dropped {len(df) - len(kept)} below min-df)"
+        ))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_alter_message_conversation"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("working", "Working"),
+                    ("streaming", "Streaming"),
+                    ("done", "Done"),
+                    ("failed", "Failed"),
+                    ("cancelled", "Cancelled"),
+                ],
+                default="done",
+                max_length=16,
+            ),
+        ),
+    ]
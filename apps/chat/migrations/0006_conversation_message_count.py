@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_message_count(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    Message = apps.get_model("chat", "Message")
+    counts = (
+        Message.objects.filter(conversation=OuterRef("pk"), role__in=["user", "assistant"])
+        .order_by()
+        .values("conversation")
+        .annotate(n=Count("id"))
+        .values("n")
+    )
+    Conversation.objects.update(message_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_message_status_cancelled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_message_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_message_updated_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(fields=["owner", "-updated_at", "-id"], name="chat_conv_owner_recent_idx"),
+        ),
+    ]
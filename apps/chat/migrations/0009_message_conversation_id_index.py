@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_conversation_owner_recent_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["conversation", "id"], name="chat_msg_conv_id_idx"),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_message_conversation_id_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_model",
+            field=models.CharField(blank=True, default="", editable=False, max_length=128),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="last_preview",
+            field=models.CharField(blank=True, default="", editable=False, max_length=160),
+        ),
+    ]
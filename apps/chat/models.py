@@ -12,11 +12,22 @@ class Conversation(models.Model):
         help_text="مالک گفتگو (در صورت ورود). برای مهمان‌ها خالی می‌ماند."
     )
     title = models.CharField(max_length=255, blank=True, default="")
+    # تعداد پیام‌های user/assistant؛ با apps/chat/signals.py به‌روز می‌شود تا
+    # زمان‌بندی عنوان هوشمند بدون COUNT روی messages تصمیم بگیرد.
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    # خلاصهٔ سایدبار: آخرین پیام user/assistant (همان سیگنال‌ها؛ `manage.py backfill_conversation_summaries`)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_preview = models.CharField(max_length=160, blank=True, default="", editable=False)
+    last_model = models.CharField(max_length=128, blank=True, default="", editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("-updated_at",)
+        indexes = [
+            # سایدبار: صفحه‌بندی keyset روی (updated_at, id) گفتگوهای هر کاربر
+            models.Index(fields=["owner", "-updated_at", "-id"], name="chat_conv_owner_recent_idx"),
+        ]
 
     def __str__(self):
         return self.title or f"Conversation #{self.pk}"
@@ -33,6 +44,7 @@ class Message(models.Model):
         STREAMING = "streaming", "Streaming"
         DONE = "done", "Done"
         FAILED = "failed", "Failed"
+        CANCELLED = "cancelled", "Cancelled"
 
     conversation = models.ForeignKey(
         Conversation,
@@ -51,9 +63,15 @@ class Message(models.Model):
     latency_ms = models.IntegerField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # ضربان تولید: claim/پایان و heartbeat worker استریم آن را جلو می‌برند (_requeue_stale)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("id",)
+        indexes = [
+            # تاریخچه: صفحه‌بندی keyset روی id پیام‌های هر گفتگو (جدیدترین اول)
+            models.Index(fields=["conversation", "id"], name="chat_msg_conv_id_idx"),
+        ]
 
     def __str__(self):
         return f"{self.role}: {self.content[:30]}"
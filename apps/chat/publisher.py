@@ -0,0 +1,145 @@
+# apps/chat/publisher.py
+"""
+انتشار دسته‌ای رویدادهای استریم از workerهای سلری به channel layer.
+
+قبلاً هر توکن یک async_to_sync(group_send) جدا بود: یک wrapper و event loop موقت و یک رفت‌وبرگشت
+Redis به ازای هر توکن. StreamPublisher در هر پروسهٔ worker یک event loop پس‌زمینه و یک channel layer
+(و در نتیجه یک connection pool در channels_redis) نگه می‌دارد و رویدادهای هر group را بافر می‌کند:
+
+- توکن‌های پشت‌سرهم در یک رویداد token ادغام می‌شوند (delta‌ها به هم چسبیده، seq اولین توکن).
+- flush وقتی بافر به STREAM_PUBLISH_MAX_BATCH برسد یا STREAM_PUBLISH_MAX_DELAY_MS از اولین رویداد
+  بافرشده بگذرد؛ پس تأخیر اضافهٔ هر توکن حداکثر همین مقدار است.
+- رویدادهای غیر توکن (started/done/error) بلافاصله و به ترتیب ارسال می‌شوند.
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from apps.observability.metrics import STREAM_PUBLISH_BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+
+def _coalesce(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for event in events:
+        prev = out[-1] if out else None
+        if event.get("type") == "token" and prev is not None and prev.get("type") == "token":
+            prev["delta"] = prev.get("delta", "") + event.get("delta", "")
+            continue
+        out.append(dict(event))
+    return out
+
+
+class StreamPublisher:
+    """
+    بدون loop: event loop پس‌زمینهٔ خودش را روی یک thread می‌سازد (workerهای همگام سلری) و از publish
+    استفاده می‌شود. با loop: روی event loop فراخوان زندگی می‌کند (worker asyncio) و از apublish.
+    """
+
+    def __init__(self, max_delay: float = None, max_batch: int = None, loop: asyncio.AbstractEventLoop = None):
+        self.max_delay = (
+            max_delay if max_delay is not None
+            else getattr(settings, "STREAM_PUBLISH_MAX_DELAY_MS", 50) / 1000
+        )
+        self.max_batch = max_batch or getattr(settings, "STREAM_PUBLISH_MAX_BATCH", 32)
+        self._buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._layer = None
+        self._thread = None
+        if loop is not None:
+            self._loop = loop
+        else:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="stream-publisher", daemon=True)
+            self._thread.start()
+
+    # ---------- API (thread-safe, از thread تسک صدا زده می‌شود) ----------
+    def publish(self, group: str, event: Dict[str, Any], flush: bool = False, timeout: float = 5.0) -> None:
+        """
+        رویداد را بافر می‌کند. با flush=True تا تحویل همهٔ رویدادهای بافرشدهٔ این group صبر می‌کند
+        (برای done/error تا تسک قبل از ارسال پایان استریم برنگردد).
+        """
+        if not flush:
+            self._loop.call_soon_threadsafe(self._enqueue, group, event)
+            return
+        future = asyncio.run_coroutine_threadsafe(self._enqueue_and_flush(group, event), self._loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            log.warning("Stream publish flush failed (group=%s): %s", group, e)
+
+    async def apublish(self, group: str, event: Dict[str, Any], flush: bool = False) -> None:
+        """همان publish برای فراخوان‌هایی که روی همین event loop اجرا می‌شوند."""
+        if flush:
+            await self._enqueue_and_flush(group, event)
+        else:
+            self._enqueue(group, event)
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=2)
+
+    # ---------- داخل event loop پس‌زمینه ----------
+    def _enqueue(self, group: str, event: Dict[str, Any]) -> None:
+        buffer = self._buffers.setdefault(group, [])
+        buffer.append(event)
+        if event.get("type") != "token" or len(buffer) >= self.max_batch:
+            self._schedule_flush(group)
+        elif group not in self._timers:
+            self._timers[group] = self._loop.call_later(self.max_delay, self._schedule_flush, group)
+
+    async def _enqueue_and_flush(self, group: str, event: Dict[str, Any]) -> None:
+        self._buffers.setdefault(group, []).append(event)
+        await self._flush(group)
+
+    def _schedule_flush(self, group: str) -> None:
+        self._loop.create_task(self._flush(group))
+
+    async def _flush(self, group: str) -> None:
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        # قفل هر group ترتیب رویدادها را بین flushهای هم‌زمان حفظ می‌کند
+        lock = self._locks.setdefault(group, asyncio.Lock())
+        async with lock:
+            events = self._buffers.pop(group, None)
+            if not events:
+                return
+            if self._layer is None:
+                self._layer = get_channel_layer()
+            batch = _coalesce(events)
+            STREAM_PUBLISH_BATCH_SIZE.observe(len(events))
+            for event in batch:
+                try:
+                    await self._layer.group_send(group, {"type": "stream.message", "event": event})
+                except Exception as e:
+                    log.warning("Stream publish failed (group=%s): %s", group, e)
+        # بعد از done/error رویداد دیگری برای این group نمی‌آید
+        if batch[-1].get("type") in ("done", "error") and group not in self._buffers:
+            self._locks.pop(group, None)
+
+
+_publisher: Optional[StreamPublisher] = None
+_publisher_pid: Optional[int] = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> StreamPublisher:
+    """یک publisher برای هر پروسه؛ بعد از fork (prefork سلری) دوباره ساخته می‌شود."""
+    global _publisher, _publisher_pid
+    pid = os.getpid()
+    if _publisher is None or _publisher_pid != pid:
+        with _publisher_lock:
+            if _publisher is None or _publisher_pid != pid:
+                _publisher = StreamPublisher()
+                _publisher_pid = pid
+    return _publisher
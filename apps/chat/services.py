@@ -2,16 +2,30 @@ from typing import List, Dict, Any
 import time
 import logging  # ✨ اضافه شده برای لاگ‌گیری بهتر
 import re
+from datetime import timedelta
 
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce, Length
+from django.utils import timezone
 from apps.chat.models import Message, Conversation  # ✨ Conversation اضافه شد برای به‌روزرسانی عنوان
 from apps.gateway.service import get_provider
+from apps.gateway.deadlines import (
+    DeadlineTracker, StreamTimeout, aiter_sync, aiter_with_deadlines, get_deadlines, iter_with_deadlines,
+)
+from apps.chat.cancellation import CancelWatcher, clear_cancel
+from apps.chat.publisher import StreamPublisher, get_publisher
+from apps.models.services.quotas import settle_for_message
+from apps.models.services.usage import record_usage
+from apps.observability.metrics import (
+    STREAMS_IN_FLIGHT, STREAM_TTFT_SECONDS, STREAM_DURATION_SECONDS, STREAM_TIMEOUTS_TOTAL,
+)
 # from django.utils.text import Truncator # ✨ این خط دیگر لازم نیست و حذف می‌شود
 
 # ✨ تسک جدید Celery را از فایل tasks.py در همین اپلیکیشن وارد می‌کنیم
-from .tasks import generate_and_save_smart_title_task 
+from .tasks import request_smart_title
 
 log = logging.getLogger(__name__) # ✨ یک نمونه لاگر ایجاد می‌کنیم
 
@@ -20,9 +34,9 @@ def _group_name(message_id: int) -> str:
     return f"msg_{message_id}"
 
 
-def _group_send(group: str, payload: Dict[str, Any]) -> None:
-    ch = get_channel_layer()
-    async_to_sync(ch.group_send)(group, {"type": "stream.message", "event": payload})
+def _group_send(group: str, payload: Dict[str, Any], flush: bool = False) -> None:
+    # بافر و ادغام در publisher پس‌زمینهٔ همین پروسه؛ flush=True تا تحویل صبر می‌کند
+    get_publisher().publish(group, payload, flush=flush)
 
 
 def _make_quick_title(text: str, max_len: int = 60) -> str:
@@ -45,16 +59,62 @@ def _make_quick_title(text: str, max_len: int = 60) -> str:
     return first[: max_len - 1].rstrip() + "…"
 
 
-@transaction.atomic
-def run_generation(message_id: int) -> None:
+def _claim_message(message_id: int) -> Message | None:
     """
-    پیام کاربر را برمی‌دارد، وضعیت را به STREAMING می‌برد،
-    توکن‌ها را تولید می‌کند و رویدادها را به group می‌فرستد.
+    فاز claim: انتقال خوش‌بینانهٔ QUEUED → STREAMING با یک UPDATE شرطی (autocommit، بدون قفل).
+    اگر worker دیگری زودتر برداشته باشد (یا پیام لغو/تمام شده باشد) None برمی‌گردد.
     """
-    msg = Message.objects.select_for_update().select_related("conversation").get(id=message_id)
-    group = _group_name(message_id)
-    start_ts = time.perf_counter()
+    claimed = Message.objects.filter(id=message_id, status=Message.Status.QUEUED).update(
+        status=Message.Status.STREAMING,
+        tokens_input=Coalesce(F("tokens_input"), Length("content")),
+        updated_at=timezone.now(),
+    )
+    if not claimed:
+        return None
+    return Message.objects.select_related("conversation").get(id=message_id)
+
+
+def _finish_message(message_id: int, status: str) -> bool:
+    """انتقال STREAMING → status؛ فقط مالک claim موفق می‌شود."""
+    return bool(
+        Message.objects.filter(id=message_id, status=Message.Status.STREAMING).update(status=status, updated_at=timezone.now())
+    )
+
+
+def _heartbeat(message_id: int) -> None:
+    """ضربان DB پیام در حال تولید (updated_at)؛ fail_stale_generations پیام بی‌ضربان را رها‌شده می‌داند."""
+    Message.objects.filter(id=message_id, status=Message.Status.STREAMING).update(updated_at=timezone.now())
+
+
+def fail_stale_generations(limit: int = 100) -> int:
+    """
+    پیام‌های STREAMING که ضربانشان از GENERATION_STALE_AFTER قدیمی‌تر است (worker سلری وسط استریم
+    مرده) FAILED می‌شوند و رویداد error می‌گیرند. تحویل دوبارهٔ تسک (acks_late) دیگر claim نمی‌شود و
+    بدون این جاروب پیام برای همیشه STREAMING می‌ماند و گفتگو «مشغول» دیده می‌شد.
+    انتقال با همان UPDATE شرطی _finish_message است تا با پایان هم‌زمان worker زنده رقابت نکند.
+    """
+    cutoff = timezone.now() - timedelta(seconds=int(getattr(settings, "GENERATION_STALE_AFTER", 300)))
+    stale = list(
+        Message.objects.filter(status=Message.Status.STREAMING, updated_at__lt=cutoff)
+        .values_list("id", "tokens_input")[:limit]
+    )
+    failed = 0
+    for message_id, tokens_input in stale:
+        if not Message.objects.filter(id=message_id, status=Message.Status.STREAMING, updated_at__lt=cutoff).update(
+            status=Message.Status.FAILED, updated_at=timezone.now()
+        ):
+            continue
+        failed += 1
+        settle_for_message(message_id, tokens_input or 0)
+        _group_send(_group_name(message_id), {
+            "type": "error", "error": "worker_lost", "detail": "Generation worker stopped responding",
+        }, flush=True)
+    if failed:
+        log.warning("Marked %s stale streaming messages as failed.", failed)
+    return failed
+
 
+def _set_quick_title(msg: Message) -> None:
     # ✨ اگر این اولین پیام گفتگوست یا هنوز عنوانی ندارد،
     # یک «عنوان سریع» بلافاصله از متن کاربر ست می‌کنیم (فقط اگر هنوز خالی است)
     if not (msg.conversation.title or "").strip():
@@ -62,69 +122,219 @@ def run_generation(message_id: int) -> None:
         if quick_title:
             # فقط اگر همچنان خالی باشد (شرط در DB) آپدیت کن تا از رقابت جلوگیری شود
             Conversation.objects.filter(id=msg.conversation_id, title__in=["", None]).update(title=quick_title)
-            log.info(f"Set quick conversation title for {msg.conversation_id!r}: {quick_title!r}")
+            log.debug("Set quick conversation title for %r: %r", msg.conversation_id, quick_title)
+
+
+def _usage_tokens(msg: Message, parts: List[str]) -> int:
+    return (msg.tokens_input or 0) + sum(len(p) for p in parts)
+
+
+def _record_usage(msg: Message, model: str | None, parts: List[str], start_ts: float, error: str = "") -> None:
+    """ثبت ModelUsageLog (بافر حافظه‌ای؛ نوشتن دسته‌ای در پس‌زمینه)"""
+    record_usage(
+        model,
+        user_id=msg.conversation.owner_id,
+        tokens=_usage_tokens(msg, parts),
+        latency_ms=int((time.perf_counter() - start_ts) * 1000),
+        success=not error,
+        error=error,
+    )
 
-    # شروع استریم و ثبت ورودی تقریبی
-    if msg.tokens_input is None:
-        msg.tokens_input = len(msg.content or "")
-    msg.status = Message.Status.STREAMING
-    msg.save(update_fields=["status", "tokens_input"])
 
-    _group_send(group, {"type": "started"})
+def _finalize_generation(msg: Message, provider_name: str, model_used: str | None, parts: List[str], outcome: str, latency_ms: int) -> bool:
+    """
+    فاز finalize: انتقال وضعیت و ساخت پیام دستیار در یک تراکنش کوتاه؛
+    اگر وضعیت دیگر STREAMING نباشد (مثلاً reset دستی)، پاسخ دوم ساخته نمی‌شود.
+    """
+    final_text = "".join(parts)
+    final_status = Message.Status.CANCELLED if outcome == "cancelled" else Message.Status.DONE
+    with transaction.atomic():
+        if not _finish_message(msg.id, final_status):
+            log.warning("Message %s left STREAMING before finalize; dropping generated answer.", msg.id)
+            return False
+        # در حالت لغو، پاسخ ناقص با وضعیت cancelled ذخیره می‌شود
+        if final_text or outcome == "completed":
+            Message.objects.create(
+                conversation_id=msg.conversation_id,
+                role=Message.Role.ASSISTANT,
+                content=final_text,
+                status=final_status,
+                tokens_output=len(final_text),
+                latency_ms=latency_ms,
+                provider=provider_name,
+                model_name=model_used,
+            )
+
+    if outcome == "completed":
+        # --- ✨ START: CELERY TASK FOR SMART TITLE ✨ ---
+        # تولید عنوان هوشمند (با نگاه به پیام/پاسخ) در پس‌زمینه و به‌صورت دسته‌ای؛
+        # اگر عنوان سریع قبلاً ست شده باشد، این تسک می‌تواند آن را به نسخهٔ بهتر ارتقا دهد.
+        request_smart_title(msg.conversation_id)
+        log.debug("Queued smart title generation task for conversation %s.", msg.conversation_id)
+        # --- ✨ END: CELERY TASK FOR SMART TITLE ✨ ---
+    else:
+        clear_cancel(msg.id)
+        log.info("Generation for message %s cancelled after %s chunks.", msg.id, len(parts))
+    return True
+
+
+def _record_failure(e: Exception, model_label: str, path: str, start_ts: float) -> str:
+    """متریک‌های شکست/timeout را ثبت می‌کند و نوع خطای قابل ارسال به کلاینت را برمی‌گرداند."""
+    error, outcome = "provider_error", "failed"
+    if isinstance(e, StreamTimeout):
+        error, outcome = e.error_type, "timeout"
+        STREAM_TIMEOUTS_TOTAL.labels(model_label, path, e.kind).inc()
+    STREAM_DURATION_SECONDS.labels(model_label, path, outcome).observe(time.perf_counter() - start_ts)
+    return error
+
+
+def run_generation(message_id: int) -> None:
+    """
+    پیام کاربر را برمی‌دارد، وضعیت را به STREAMING می‌برد،
+    توکن‌ها را تولید می‌کند و رویدادها را به group می‌فرستد.
+
+    سه فاز جدا: claim (UPDATE شرطی)، stream (بدون هیچ تراکنش/قفل DB در طول تماس شبکه)،
+    finalize (یک تراکنش کوتاه برای ذخیرهٔ پاسخ + انتقال وضعیت).
+    """
+    msg = _claim_message(message_id)
+    if msg is None:
+        log.info("Message %s is not queued anymore; skipping duplicate generation.", message_id)
+        return
+    group = _group_name(message_id)
+    start_ts = time.perf_counter()
 
     # انتخاب Provider/Model براساس پیام کاربر
     requested_provider = (msg.provider or "").strip() or None
     requested_model = (msg.model_name or "").strip() or None
-    provider = get_provider(requested_provider)
 
     parts: List[str] = []
     seq = 0
+    model_label = requested_model or ""
+    watcher = CancelWatcher(message_id)
+    outcome = "completed"
+
+    heartbeat_every = float(getattr(settings, "GENERATION_HEARTBEAT_INTERVAL", 15))
+    last_beat = time.monotonic()
 
+    STREAMS_IN_FLIGHT.labels("celery").inc()
+    events = None
     try:
-        for ev in provider.generate(
-            messages=[{"role": "user", "content": msg.content}],
-            model=requested_model,
-            stream=True,
-        ):
-            if ev.get("type") == "token":
-                delta = ev.get("delta", "")
-                if not delta:
-                    continue
-                parts.append(delta)
-                _group_send(group, {"type": "token", "delta": delta, "seq": ev.get("seq", seq)})
-                seq += 1
+        # پیام حالا STREAMING است؛ هر خطایی از این‌جا به بعد باید از مسیر FAILED + رویداد error بگذرد
+        _set_quick_title(msg)
+        _group_send(group, {"type": "started"})
+        provider = get_provider(requested_provider)
+        model_label = model_label or getattr(provider, "default_model", "") or ""
+
+        # ممکن است لغو قبل از برداشتن پیام از صف درخواست شده باشد؛ در این صورت upstream باز نمی‌شود
+        if not watcher.check():
+            events = iter_with_deadlines(provider.generate(
+                messages=[{"role": "user", "content": msg.content}],
+                model=requested_model,
+                stream=True,
+            ), DeadlineTracker(get_deadlines(model_label)))
+            for ev in events:
+                if ev.get("type") == "token":
+                    delta = ev.get("delta", "")
+                    if not delta:
+                        continue
+                    if not parts:
+                        STREAM_TTFT_SECONDS.labels(model_label, "celery").observe(time.perf_counter() - start_ts)
+                    parts.append(delta)
+                    _group_send(group, {"type": "token", "delta": delta, "seq": ev.get("seq", seq)})
+                    seq += 1
+                if time.monotonic() - last_beat >= heartbeat_every:
+                    _heartbeat(message_id)
+                    last_beat = time.monotonic()
+                if watcher.check():
+                    break
+        if watcher.cancelled:
+            outcome = "cancelled"
     except Exception as e:
-        msg.status = Message.Status.FAILED
-        msg.save(update_fields=["status"])
-        _group_send(group, {"type": "error", "error": "provider_error", "detail": str(e)})
+        error = _record_failure(e, model_label, "celery", start_ts)
+        _record_usage(msg, model_label, parts, start_ts, error=f"{error}: {e}")
+        settle_for_message(message_id, _usage_tokens(msg, parts))
+        _finish_message(message_id, Message.Status.FAILED)
+        _group_send(group, {"type": "error", "error": error, "detail": str(e)}, flush=True)
         return
-
-    final_text = "".join(parts)
+    finally:
+        if events is not None:
+            # بستن generator اتصال upstream را همین‌جا آزاد می‌کند (نه در GC)
+            events.close()
+        STREAMS_IN_FLIGHT.labels("celery").dec()
+    STREAM_DURATION_SECONDS.labels(model_label, "celery", outcome).observe(time.perf_counter() - start_ts)
 
     # مدل نهایی که باید در تلمتری ثبت شود (اولویت با انتخاب کاربر)
     model_used = requested_model or getattr(provider, "default_model", None)
+    latency_ms = int((time.perf_counter() - start_ts) * 1000)
+    _record_usage(msg, model_used, parts, start_ts)
+    settle_for_message(message_id, _usage_tokens(msg, parts))
+    if _finalize_generation(msg, getattr(provider, "name", "unknown"), model_used, parts, outcome, latency_ms):
+        _group_send(group, {"type": "done", "finish_reason": outcome}, flush=True)
 
-    # ساخت پیام دستیار + تلمتری
-    Message.objects.create(
-        conversation=msg.conversation,
-        role=Message.Role.ASSISTANT,
-        content=final_text,
-        status=Message.Status.DONE,
-        tokens_output=len(final_text or ""),
-        latency_ms=int((time.perf_counter() - start_ts) * 1000),
-        provider=getattr(provider, "name", "unknown"),
-        model_name=model_used,
-    )
 
-    # --- ✨ START: CELERY TASK FOR SMART TITLE ✨ ---
-    # تولید عنوان هوشمند (با نگاه به پیام/پاسخ) در پس‌زمینه؛
-    # اگر عنوان سریع قبلاً ست شده باشد، این تسک می‌تواند آن را به نسخهٔ بهتر ارتقا دهد.
-    generate_and_save_smart_title_task.delay(msg.conversation.id)
-    log.info(f"Queued smart title generation task for conversation {msg.conversation.id}.")
-    # --- ✨ END: CELERY TASK FOR SMART TITLE ✨ ---
+async def arun_generation(message_id: int, publisher: StreamPublisher) -> None:
+    """
+    نسخهٔ asyncio از run_generation برای worker مبتنی بر Redis Streams (run_generation_worker).
+    فازهای claim/finalize همان توابع همگام‌اند (کوتاه، روی thread ORM)؛ استریم provider و انتشار
+    رویدادها مستقیماً روی event loop worker انجام می‌شود تا یک پروسه صدها استریم هم‌زمان نگه دارد.
+    """
+    msg = await sync_to_async(_claim_message)(message_id)
+    if msg is None:
+        log.info("Message %s is not queued anymore; skipping duplicate generation.", message_id)
+        return
+    group = _group_name(message_id)
+    start_ts = time.perf_counter()
 
-    # اتمام پیام کاربر
-    msg.status = Message.Status.DONE
-    msg.save(update_fields=["status"])
+    requested_model = (msg.model_name or "").strip() or None
 
-    _group_send(group, {"type": "done"})
+    parts: List[str] = []
+    seq = 0
+    model_label = requested_model or ""
+    watcher = CancelWatcher(message_id)
+    outcome = "completed"
+
+    STREAMS_IN_FLIGHT.labels("stream_worker").inc()
+    gen = None
+    try:
+        # مثل run_generation: بعد از claim هر خطایی به FAILED + رویداد error ختم می‌شود
+        await sync_to_async(_set_quick_title)(msg)
+        await publisher.apublish(group, {"type": "started"})
+        provider = get_provider((msg.provider or "").strip() or None)
+        model_label = model_label or getattr(provider, "default_model", "") or ""
+
+        if not await watcher.acheck():
+            gen = provider.generate(messages=[{"role": "user", "content": msg.content}], model=requested_model, stream=True)
+            iterator = gen if hasattr(gen, "__aiter__") else aiter_sync(gen)
+            async for ev in aiter_with_deadlines(iterator, DeadlineTracker(get_deadlines(model_label))):
+                if ev.get("type") == "token":
+                    delta = ev.get("delta", "")
+                    if not delta:
+                        continue
+                    if not parts:
+                        STREAM_TTFT_SECONDS.labels(model_label, "stream_worker").observe(time.perf_counter() - start_ts)
+                    parts.append(delta)
+                    await publisher.apublish(group, {"type": "token", "delta": delta, "seq": ev.get("seq", seq)})
+                    seq += 1
+                if await watcher.acheck():
+                    break
+        if watcher.cancelled:
+            outcome = "cancelled"
+    except Exception as e:
+        error = _record_failure(e, model_label, "stream_worker", start_ts)
+        _record_usage(msg, model_label, parts, start_ts, error=f"{error}: {e}")
+        await sync_to_async(settle_for_message, thread_sensitive=False)(message_id, _usage_tokens(msg, parts))
+        await sync_to_async(_finish_message)(message_id, Message.Status.FAILED)
+        await publisher.apublish(group, {"type": "error", "error": error, "detail": str(e)}, flush=True)
+        return
+    finally:
+        if gen is not None and hasattr(gen, "aclose"):
+            await gen.aclose()
+        STREAMS_IN_FLIGHT.labels("stream_worker").dec()
+    STREAM_DURATION_SECONDS.labels(model_label, "stream_worker", outcome).observe(time.perf_counter() - start_ts)
+
+    model_used = requested_model or getattr(provider, "default_model", None)
+    latency_ms = int((time.perf_counter() - start_ts) * 1000)
+    _record_usage(msg, model_used, parts, start_ts)
+    await sync_to_async(settle_for_message, thread_sensitive=False)(message_id, _usage_tokens(msg, parts))
+    if await sync_to_async(_finalize_generation)(msg, getattr(provider, "name", "unknown"), model_used, parts, outcome, latency_ms):
+        await publisher.apublish(group, {"type": "done", "finish_reason": outcome}, flush=True)
@@ -0,0 +1,78 @@
+# apps/chat/signals.py
+"""
+نگهداری خلاصهٔ denormalized گفتگو: message_count، last_message_at، last_preview، last_model و
+updated_at (ترتیب سایدبار).
+
+فقط پیام‌های user/assistant حساب می‌شوند (همان معیار عنوان‌گذاری هوشمند). همهٔ مسیرهای نوشتن پیام
+(consumer، تسک‌های سلری/worker استریم و viewهای REST) از Message.objects.create/acreate می‌گذرند،
+پس post_save تنها نقطهٔ نگهداری است. به‌روزرسانی یک UPDATE با F()/Case است تا نوشتن‌های هم‌زمان
+workerها و consumer یکدیگر را بازنویسی نکنند و پیام قدیمی‌تر خلاصهٔ پیام جدیدتر را عقب نبرد.
+حذف پیام عمداً سیگنال ندارد: receiver روی post_delete پیام، fast-delete آبشاری گفتگو → پیام‌ها را
+غیرفعال می‌کرد (بارگذاری همهٔ پیام‌ها و یک UPDATE برای هر کدام). مسیرهای صریح حذف پیام (ادمین) بعد
+از حذف refresh_summaries را صدا می‌زنند؛ `manage.py backfill_conversation_summaries` هم از همان استفاده می‌کند.
+"""
+from typing import Iterable
+
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from apps.chat.models import Conversation, Message
+
+COUNTED_ROLES = (Message.Role.USER, Message.Role.ASSISTANT)
+PREVIEW_CHARS = 120
+
+
+def make_preview(content: str) -> str:
+    return " ".join((content or "").split())[:PREVIEW_CHARS]
+
+
+@receiver(post_save, sender=Message)
+def summarize_created_message(sender, instance, created, raw=False, **kwargs):
+    if not created or raw or instance.role not in COUNTED_ROLES:
+        return
+    newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=instance.created_at)
+
+    def latest(field, value):
+        return Case(When(newer, then=Value(value)), default=F(field))
+
+    updates = {
+        "message_count": F("message_count") + 1,
+        "last_message_at": latest("last_message_at", instance.created_at),
+        "last_preview": latest("last_preview", make_preview(instance.content)),
+        "updated_at": Greatest(F("updated_at"), Value(instance.created_at)),
+    }
+    if instance.model_name:
+        updates["last_model"] = latest("last_model", instance.model_name)
+    Conversation.objects.filter(id=instance.conversation_id).update(**updates)
+
+
+def refresh_summaries(conversation_ids: Iterable[int]) -> int:
+    """
+    بازسازی message_count و last_* از خود پیام‌ها برای گفتگوهای داده‌شده (یک SELECT + یک bulk_update).
+    updated_at فقط جلو می‌رود تا ترتیب سایدبار با حذف پیام عقب نرود.
+    """
+    counted = Message.objects.filter(conversation=OuterRef("pk"), role__in=COUNTED_ROLES).order_by("-id")
+    convs = list(
+        Conversation.objects.filter(id__in=list(conversation_ids))
+        .annotate(
+            n=Count("messages", filter=Q(messages__role__in=COUNTED_ROLES)),
+            last_msg_id=Subquery(counted.values("id")[:1]),
+            model=Subquery(counted.exclude(model_name__isnull=True).exclude(model_name="").values("model_name")[:1]),
+        )
+        .only("id", "updated_at")
+    )
+    last = Message.objects.only("created_at", "content").in_bulk([c.last_msg_id for c in convs if c.last_msg_id])
+    for conv in convs:
+        msg = last.get(conv.last_msg_id)
+        conv.message_count = conv.n
+        conv.last_message_at = msg.created_at if msg else None
+        conv.last_preview = make_preview(msg.content) if msg else ""
+        conv.last_model = conv.model or ""
+        if msg and msg.created_at > conv.updated_at:
+            conv.updated_at = msg.created_at
+    Conversation.objects.bulk_update(
+        convs, ["message_count", "last_message_at", "last_preview", "last_model", "updated_at"],
+    )
+    return len(convs)
@@ -1,16 +1,25 @@
 # backend/apps/chat/tasks.py
 
+import json
 import logging
 import re
+from dataclasses import dataclass
+from typing import Dict, Optional
+
 from celery import shared_task
-from django.db import transaction
+from django.conf import settings
+from django.core.cache import cache
 
 # ✅ برای ارسال ایونت سبک وب‌سوکت بعد از ذخیره عنوان
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.layers import get_channel_layer
 
 from apps.chat.models import Conversation, Message
+from apps.chat.titler import extract_title
 from apps.gateway.service import get_provider
+from apps.gateway.deadlines import DeadlineTracker, get_deadlines, iter_with_deadlines
+from apps.observability.metrics import SMART_TITLES_TOTAL
+from apps.queueapp.redis_client import get_redis
 
 log = logging.getLogger(__name__)
 
@@ -28,6 +37,15 @@ Conversation Snippet:
 Title:
 """
 
+BATCH_TITLE_PROMPT = """
+You will receive {count} independent conversation snippets, each starting with a line "### id=<number>".
+For EACH snippet generate a short, concise, and relevant title (under 7 words) in the same language as
+that snippet, without quotes or ending punctuation.
+Return ONLY a JSON array like [{{"id": 12, "title": "..."}}] with one object per snippet and nothing else.
+
+{conversations}
+"""
+
 # -------- WebSocket helpers (سبک) --------
 def _conv_group(cid: int) -> str:
     return f"conv_{cid}"
@@ -168,121 +186,290 @@ def _extract_text_from_provider_response(result) -> str:
     return ""
 
 
-# ✨====== تغییر اصلی برای حل مشکل SynchronousOnlyOperation اینجاست ======✨
+def _collect_title_text(provider, prompt: str) -> str:
+    """
+    پاسخ provider را (sync یا async generator) با مهلت‌های استریم جمع می‌کند.
+    AvalaiProvider یک async generator برمی‌گرداند که قبلاً اصلاً پیمایش نمی‌شد و عنوان همیشه به
+    quick title برمی‌گشت.
+    """
+    model = getattr(provider, "default_model", None)
+    events = provider.generate(messages=[{"role": "user", "content": prompt}], stream=True)
+    collected = list(iter_with_deadlines(events, DeadlineTracker(get_deadlines(model))))
+    return _extract_text_from_provider_response(collected)
+
+
+@dataclass
+class _TitleCandidate:
+    conversation_id: int
+    owner_id: Optional[int]
+    read_title: str
+    quick_title: str
+    history_text: str
+    user_text: str
+
+
+def _try_extractive_title(candidate: _TitleCandidate) -> bool:
+    """
+    عنوان استخراجی محلی؛ اگر اطمینان از SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE کمتر نباشد ذخیره
+    می‌شود و دیگر سراغ LLM نمی‌رویم.
+    """
+    title, confidence = extract_title(candidate.user_text)
+    threshold = float(getattr(settings, "SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE", 0.7))
+    log.debug(
+        "Extractive title (conv=%s): '%s' confidence=%.3f threshold=%.2f",
+        candidate.conversation_id, title, confidence, threshold
+    )
+    if not title or confidence < threshold:
+        return False
+    SMART_TITLES_TOTAL.labels("extractive").inc()
+    _save_title(candidate, title)
+    return True
+
+
+def _title_eligible(message_count: int) -> bool:
+    """عنوان فقط بعد از پیام‌های ۱، ۲ و ۵ (user/assistant) تولید یا ارتقا داده می‌شود."""
+    return message_count in getattr(settings, "SMART_TITLE_AT_MESSAGE_COUNTS", (1, 2, 5))
+
+
+def _title_candidate(conversation_id: int) -> Optional[_TitleCandidate]:
+    """
+    آماده‌سازی تاریخچه برای تولید عنوان (فقط خواندن، autocommit).
+    شرط تعداد پیام قبل از صف‌کردن (request_smart_title) بررسی شده است؛ اینجا فقط اگر کاربر
+    عنوان را خودش عوض کرده باشد None برمی‌گردد.
+    """
+    conv = Conversation.objects.only("id", "title", "owner_id").get(id=conversation_id)
+
+    recent_messages = list(conv.messages.order_by('-created_at')[:5])
+    history_text = "\n".join(
+        f"{msg.get_role_display()}: {msg.content or ''}".strip()
+        for msg in reversed(recent_messages)
+    ).strip()
+    log.debug(
+        "History prepared (conv=%s): %s msgs, preview='%s'",
+        conversation_id, len(recent_messages), history_text[:200]
+    )
+
+    if not history_text:
+        log.info("No history available; skip smart title (conv=%s)", conversation_id)
+        return None
+
+    read_title = conv.title or ""
+    current_title = read_title.strip()
+    first_user_msg = conv.messages.filter(role=Message.Role.USER).order_by('created_at').first()
+    quick_title = _make_quick_title(first_user_msg.content if first_user_msg else "")
+    normalized_current = re.sub(r"\s+", " ", current_title)
+    normalized_quick   = re.sub(r"\s+", " ", quick_title)
+
+    allow_overwrite = False
+    if not current_title:
+        allow_overwrite = True
+    elif normalized_current == normalized_quick:
+        allow_overwrite = True
+    elif current_title.lower() in {"untitled chat", "untitled", "بدون عنوان"}:
+        allow_overwrite = True
+
+    log.debug(
+        "Overwrite check (conv=%s): allow=%s | current='%s' | quick='%s'",
+        conversation_id, allow_overwrite, current_title, quick_title
+    )
+    if not allow_overwrite:
+        log.info(
+            "Skip smart-title overwrite (conv=%s): user-edited title detected",
+            conversation_id
+        )
+        return None
+    user_text = "\n".join(
+        msg.content or "" for msg in reversed(recent_messages) if msg.role == Message.Role.USER
+    )
+    return _TitleCandidate(conversation_id, conv.owner_id, read_title, quick_title, history_text, user_text)
+
+
+def _save_title(candidate: _TitleCandidate, raw_title: str) -> None:
+    """UPDATE شرطی روی همان عنوانی که قبل از تماس شبکه خوانده شد + اطلاع‌رسانی WS."""
+    conversation_id = candidate.conversation_id
+    title = _clean_title(raw_title) or candidate.quick_title or "گفت‌وگوی جدید"
+
+    if not title or title == candidate.read_title:
+        log.debug("Title unchanged (conv=%s)", conversation_id)
+        return
+
+    updated = Conversation.objects.filter(id=conversation_id, title=candidate.read_title).update(title=title)
+    if not updated:
+        log.info("Skip smart-title save (conv=%s): title changed concurrently", conversation_id)
+        return
+    log.info("Title saved (conv=%s): new='%s' old='%s'", conversation_id, title, candidate.read_title)
+
+    _ws_emit(
+        event={
+            "type": "conversation.title_updated",
+            "conversation_id": conversation_id,
+            "title": title,
+        },
+        conv_id=conversation_id,
+        user_id=candidate.owner_id,
+    )
+
+
 @shared_task
 def generate_and_save_smart_title_task(conversation_id: int):
-    """A Celery task to generate (or upgrade) a smart title for a conversation."""
+    """
+    A Celery task to generate (or upgrade) a smart title for a conversation.
+
+    هیچ تراکنش یا قفل ردیفی در طول تماس با provider باز نمی‌ماند:
+    خواندن (autocommit) → تولید عنوان (بدون DB) → UPDATE شرطی روی همان عنوانی که خوانده شد؛
+    اگر کاربر در این فاصله عنوان را عوض کرده باشد، UPDATE هیچ ردیفی را تغییر نمی‌دهد.
+    مسیر عادی request_smart_title (دسته‌ای) است؛ این تسک برای حالت بدون Redis باقی مانده است.
+    """
+    log.debug("SmartTitleTask start conv_id=%s", conversation_id)
+    cache.delete(_title_pending_key(conversation_id))
+    try:
+        candidate = _title_candidate(conversation_id)
+        if candidate is None or _try_extractive_title(candidate):
+            return
+        SMART_TITLES_TOTAL.labels("llm").inc()
+        prompt = SMART_TITLE_PROMPT.format(conversation_history=candidate.history_text)
+        provider = get_provider()
+        log.debug(
+            "Calling provider.generate (conv=%s, provider=%s) prompt_len=%s",
+            conversation_id, getattr(provider, "name", "unknown"), len(prompt)
+        )
+        raw_title = _collect_title_text(provider, prompt)
+        log.debug("Raw title (conv=%s): '%s'", conversation_id, raw_title)
+        _save_title(candidate, raw_title)
 
-    def _sync_logic():
-        log.info("SmartTitleTask start conv_id=%s", conversation_id)
+    except Conversation.DoesNotExist:
+        log.error("Conversation not found (conv_id=%s) for title generation task.", conversation_id)
+    except Exception as e:
+        log.error("Error in smart title task (conv_id=%s): %s", conversation_id, e, exc_info=True)
+    finally:
+        log.debug("SmartTitleTask end conv_id=%s", conversation_id)
+
+
+# -------- عنوان‌گذاری دسته‌ای --------
+# شناسهٔ گفتگوها در یک set در Redis جمع می‌شود و یک تسک flush (با countdown برابر پنجرهٔ دسته)
+# همه را با یک درخواست LLM که آرایهٔ JSON برمی‌گرداند عنوان‌گذاری می‌کند.
+_TITLE_PENDING_KEY = "chat:titles:pending"
+_TITLE_FLUSH_KEY = "chat:titles:flush_scheduled"
+
+
+def _parse_batch_titles(raw: str) -> Dict[int, str]:
+    """آرایهٔ JSON [{"id": .., "title": ..}] را (حتی داخل ```json) به نگاشت id → عنوان تبدیل می‌کند."""
+    start, end = raw.find("["), raw.rfind("]")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        items = json.loads(raw[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    out: Dict[int, str] = {}
+    for item in items if isinstance(items, list) else []:
         try:
-            with transaction.atomic():
-                log.debug("Fetching conversation with SELECT ... FOR UPDATE (conv_id=%s)", conversation_id)
-                conv = Conversation.objects.select_for_update().get(id=conversation_id)
-
-                message_count = conv.messages.filter(
-                    role__in=[Message.Role.USER, Message.Role.ASSISTANT]
-                ).count()
-                log.info("Message count (USER/ASSISTANT) for conv=%s: %s", conversation_id, message_count)
-
-                if message_count not in (1, 2, 5):
-                    log.info("Skip smart title (conv=%s): message_count=%s not in (1,2,5)", conversation_id, message_count)
-                    return
-
-                recent_messages = list(conv.messages.order_by('-created_at')[:5])
-                history_text = "\n".join(
-                    f"{msg.get_role_display()}: {msg.content or ''}".strip()
-                    for msg in reversed(recent_messages)
-                ).strip()
-                log.debug(
-                    "History prepared (conv=%s): %s msgs, preview='%s'",
-                    conversation_id, len(recent_messages), history_text[:200]
-                )
-
-                if not history_text:
-                    log.info("No history available; skip smart title (conv=%s)", conversation_id)
-                    return
-
-                current_title = (conv.title or "").strip()
-                first_user_msg = conv.messages.filter(role=Message.Role.USER).order_by('created_at').first()
-                quick_title = _make_quick_title(first_user_msg.content if first_user_msg else "")
-                normalized_current = re.sub(r"\s+", " ", current_title)
-                normalized_quick   = re.sub(r"\s+", " ", quick_title)
-
-                allow_overwrite = False
-                if not current_title:
-                    allow_overwrite = True
-                elif normalized_current == normalized_quick:
-                    allow_overwrite = True
-                elif current_title.lower() in {"untitled chat", "untitled", "بدون عنوان"}:
-                    allow_overwrite = True
-
-                log.info(
-                    "Overwrite check (conv=%s): allow=%s | current='%s' | quick='%s'",
-                    conversation_id, allow_overwrite, current_title, quick_title
-                )
-                if not allow_overwrite:
-                    log.info(
-                        "Skip smart-title overwrite (conv=%s): user-edited title detected",
-                        conversation_id
-                    )
-                    return
-
-                prompt = SMART_TITLE_PROMPT.format(conversation_history=history_text)
-                provider = get_provider()
-                prov_name = getattr(provider, "name", "unknown")
-                log.debug(
-                    "Calling provider.generate (conv=%s, provider=%s) prompt_len=%s",
-                    conversation_id, prov_name, len(prompt)
-                )
-                try:
-                    result = provider.generate(
-                        messages=[{"role": "user", "content": prompt}],
-                        stream=False,
-                    )
-                except TypeError:
-                    log.debug("Provider does not accept stream kw; retrying without it (conv=%s)", conversation_id)
-                    result = provider.generate(messages=[{"role": "user", "content": prompt}])
-
-                raw_title = _extract_text_from_provider_response(result)
-                log.debug("Raw title (conv=%s): '%s'", conversation_id, raw_title)
-                title = _clean_title(raw_title) or quick_title or "گفت‌وگوی جدید"
-                log.info("Cleaned title (conv=%s): '%s'", conversation_id, title)
-
-                if title:
-                    old_title = conv.title
-                    conv.title = title
-                    conv.save(update_fields=["title"])
-                    log.info(
-                        "Title saved (conv=%s): new='%s' old='%s'",
-                        conversation_id, title, old_title
-                    )
-
-                    sid = getattr(conv, "session_id", None)
-                    _ws_emit(
-                        event={
-                            "type": "conversation.title_updated",
-                            "conversation_id": conv.id,
-                            "title": conv.title,
-                        },
-                        conv_id=conv.id,
-                        user_id=getattr(conv.owner, "id", None),
-                        session_id=str(sid) if sid else None,
-                    )
-                else:
-                    log.warning(
-                        "Empty/invalid title generated (conv=%s). Raw=%r",
-                        conversation_id, raw_title
-                    )
+            out[int(item["id"])] = str(item["title"])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return out
 
-        except Conversation.DoesNotExist:
-            log.error("Conversation not found (conv_id=%s) for title generation task.", conversation_id)
+
+def _title_pending_key(conversation_id: int) -> str:
+    return f"chat:titles:pending:{conversation_id}"
+
+
+def request_smart_title(conversation_id: int) -> None:
+    """
+    درخواست عنوان هوشمند بعد از هر نوبت.
+
+    - شرط واجد بودن از شمارندهٔ denormalized (Conversation.message_count) خوانده می‌شود؛ برای
+      نوبت‌های نامرتبط اصلاً تسکی صف نمی‌شود.
+    - با Redis، شناسه به set دستهٔ در انتظار اضافه می‌شود (تکرارها خودبه‌خود ادغام می‌شوند) و
+      اولین درخواست هر پنجره یک flush با countdown برابر SMART_TITLE_BATCH_WINDOW_SECONDS زمان‌بندی می‌کند.
+    - بدون Redis، کلید pending در cache تسک‌های تکراری هر گفتگو را در همان پنجره حذف می‌کند و
+      تسک تکی با همان countdown اجرا می‌شود تا رگباری از نوبت‌ها یک job بسازد.
+    """
+    message_count = (
+        Conversation.objects.filter(id=conversation_id).values_list("message_count", flat=True).first()
+    )
+    if message_count is None or not _title_eligible(message_count):
+        log.debug("Skip smart title (conv=%s): message_count=%s", conversation_id, message_count)
+        return
+    _enqueue_smart_title(conversation_id)
+
+
+async def arequest_smart_title(conversation_id: int) -> None:
+    """
+    نسخهٔ async برای consumerها: شمارنده با ORM async روی event loop خوانده می‌شود و فقط صف‌کردن
+    (Redis/Celery، بدون ORM) به thread جدا می‌رود؛ ORM روی threadهای executor پیش‌فرض اتصالی
+    باز می‌کند که جنگو هرگز نمی‌بندد.
+    """
+    message_count = await (
+        Conversation.objects.filter(id=conversation_id).values_list("message_count", flat=True).afirst()
+    )
+    if message_count is None or not _title_eligible(message_count):
+        log.debug("Skip smart title (conv=%s): message_count=%s", conversation_id, message_count)
+        return
+    await sync_to_async(_enqueue_smart_title, thread_sensitive=False)(conversation_id)
+
+
+def _enqueue_smart_title(conversation_id: int) -> None:
+    window = int(getattr(settings, "SMART_TITLE_BATCH_WINDOW_SECONDS", 10))
+    client = get_redis()
+    if client is not None:
+        try:
+            client.sadd(_TITLE_PENDING_KEY, conversation_id)
+            # فقط اولین درخواست پنجره flush را زمان‌بندی می‌کند
+            if client.set(_TITLE_FLUSH_KEY, b"1", nx=True, ex=window * 3):
+                flush_smart_titles_task.apply_async(countdown=window)
+            return
         except Exception as e:
-            log.error("Error in smart title task (conv_id=%s): %s", conversation_id, e, exc_info=True)
-        finally:
-            log.info("SmartTitleTask end conv_id=%s", conversation_id)
+            log.warning("Title batching unavailable (conv=%s): %s; falling back to single task", conversation_id, e)
 
-    # فراخوانی تابع داخلی به صورت همزمان (sync)
-    _sync_logic()
+    if cache.add(_title_pending_key(conversation_id), 1, timeout=window * 3):
+        generate_and_save_smart_title_task.apply_async((conversation_id,), countdown=window)
+    else:
+        log.debug("Smart title already pending (conv=%s)", conversation_id)
 
-# ✨====== پایان تغییرات ======✨
\ No newline at end of file
+
+@shared_task
+def flush_smart_titles_task():
+    """یک دسته از گفتگوهای در انتظار را با یک درخواست LLM عنوان‌گذاری می‌کند."""
+    client = get_redis()
+    if client is None:
+        return
+    batch_max = int(getattr(settings, "SMART_TITLE_BATCH_MAX", 20))
+    # پرچم قبل از برداشتن دسته پاک می‌شود تا درخواست‌های جدید flush بعدی را زمان‌بندی کنند
+    client.delete(_TITLE_FLUSH_KEY)
+    ids = [int(x) for x in client.spop(_TITLE_PENDING_KEY, batch_max) or []]
+    if client.scard(_TITLE_PENDING_KEY) and client.set(_TITLE_FLUSH_KEY, b"1", nx=True, ex=60):
+        flush_smart_titles_task.apply_async()
+    if not ids:
+        return
+
+    candidates: Dict[int, _TitleCandidate] = {}
+    for conversation_id in ids:
+        try:
+            candidate = _title_candidate(conversation_id)
+        except Conversation.DoesNotExist:
+            continue
+        if candidate is not None and not _try_extractive_title(candidate):
+            candidates[conversation_id] = candidate
+    if not candidates:
+        return
+    SMART_TITLES_TOTAL.labels("llm").inc(len(candidates))
+
+    snippets = "\n\n".join(
+        f"### id={cid}\n{c.history_text[:1500]}" for cid, c in candidates.items()
+    )
+    prompt = BATCH_TITLE_PROMPT.format(count=len(candidates), conversations=snippets)
+    try:
+        raw = _collect_title_text(get_provider(), prompt)
+        titles = _parse_batch_titles(raw)
+    except Exception as e:
+        log.error("Batch title request failed for %s conversations: %s", len(candidates), e, exc_info=True)
+        titles = {}
+    log.info("Batch titles: requested=%s parsed=%s", len(candidates), len(titles))
+
+    for conversation_id, candidate in candidates.items():
+        try:
+            # عنوانی که در پاسخ نیامده باشد به quick title برمی‌گردد (همان رفتار تسک تکی)
+            _save_title(candidate, titles.get(conversation_id, ""))
+        except Exception as e:
+            log.error("Saving batch title failed (conv=%s): %s", conversation_id, e, exc_info=True)
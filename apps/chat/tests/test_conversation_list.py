@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.chat.models import Conversation
+
+
+@pytest.fixture
+def member(django_user_model):
+    return django_user_model.objects.create_user(email="sidebar@example.com", password="x")
+
+
+def _conversations(owner, count):
+    base = timezone.now()
+    convs = Conversation.objects.bulk_create(Conversation(owner=owner, title=f"c{i}") for i in range(count))
+    # دو گفتگو با updated_at یکسان تا ترتیب id روی مرز صفحه هم بررسی شود
+    for i, conv in enumerate(convs):
+        Conversation.objects.filter(pk=conv.pk).update(updated_at=base - timedelta(minutes=i // 2))
+    return convs
+
+
+def _walk(client, page_size):
+    ids, cursor, pages = [], None, 0
+    while True:
+        params = {"page_size": page_size, **({"cursor": cursor} if cursor else {})}
+        data = client.get("/api/v1/conversations/", params).json()
+        ids += [c["id"] for c in data["results"]]
+        pages += 1
+        if not data["has_more"]:
+            return ids, pages
+        cursor = data["next_cursor"]
+
+
+@pytest.mark.django_db
+def test_cursor_pages_cover_every_conversation_once(member):
+    convs = _conversations(member, 25)
+    Conversation.objects.create(title="someone else's")
+    client = APIClient()
+    client.force_login(member)
+
+    ids, pages = _walk(client, page_size=7)
+
+    expected = sorted(convs, key=lambda c: (Conversation.objects.get(pk=c.pk).updated_at, c.pk), reverse=True)
+    assert ids == [c.pk for c in expected]
+    assert pages == 4
+    assert client.get("/api/v1/conversations/", {"cursor": "garbage"}).status_code == 404
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("count", [5, 120])
+def test_page_query_budget_is_constant(member, count, django_assert_num_queries):
+    _conversations(member, count)
+    client = APIClient()
+    client.force_login(member)
+    first = client.get("/api/v1/conversations/").json()
+
+    # session + user + یک SELECT صفحه؛ مستقل از تعداد گفتگوها و بدون COUNT
+    with django_assert_num_queries(3):
+        page = client.get("/api/v1/conversations/", {"cursor": first["next_cursor"]} if first["has_more"] else {})
+    assert page.status_code == 200
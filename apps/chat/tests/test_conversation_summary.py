@@ -0,0 +1,86 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib import admin
+from django.core.management import call_command
+from django.utils import timezone
+
+from apps.chat.admin import MessageAdmin
+from apps.chat.models import Conversation, Message
+from apps.chat.signals import summarize_created_message
+
+
+@pytest.mark.django_db
+def test_new_messages_update_summary_and_sidebar_order():
+    older = Conversation.objects.create(title="older")
+    newer = Conversation.objects.create(title="newer")
+    Conversation.objects.filter(pk=older.pk).update(updated_at=timezone.now() - timedelta(days=1))
+
+    Message.objects.create(conversation=older, role=Message.Role.USER, content="  سلام\n دنیا ", model_name="gpt-4o")
+    reply = Message.objects.create(conversation=older, role=Message.Role.ASSISTANT, content="x" * 300)
+    Message.objects.create(conversation=older, role=Message.Role.SYSTEM, content="ignored")
+
+    older.refresh_from_db()
+    assert older.message_count == 2
+    assert older.last_message_at == reply.created_at
+    assert older.last_preview == "x" * 120
+    assert older.last_model == "gpt-4o"  # پیام بدون model_name مدل قبلی را پاک نمی‌کند
+    assert list(Conversation.objects.order_by("-updated_at").values_list("id", flat=True)) == [older.id, newer.id]
+
+
+@pytest.mark.django_db
+def test_late_write_of_older_message_keeps_latest_preview():
+    conv = Conversation.objects.create()
+    Message.objects.create(conversation=conv, role=Message.Role.USER, content="latest")
+    stale = Message(conversation=conv, role=Message.Role.ASSISTANT, content="stale")
+    Message.objects.bulk_create([stale])  # bulk_create سیگنال ندارد؛ تحویل دیرهنگام را دستی شبیه‌سازی می‌کنیم
+    stale.created_at = timezone.now() - timedelta(minutes=5)
+    summarize_created_message(Message, stale, created=True)
+
+    conv.refresh_from_db()
+    assert conv.last_preview == "latest" and conv.message_count == 2
+
+
+@pytest.mark.django_db
+def test_backfill_command_rebuilds_summaries():
+    conv = Conversation.objects.create()
+    Message.objects.bulk_create([
+        Message(conversation=conv, role=Message.Role.USER, content="q", model_name="gpt-4o-mini"),
+        Message(conversation=conv, role=Message.Role.ASSISTANT, content="final answer"),
+    ])
+    empty = Conversation.objects.create()
+
+    call_command("backfill_conversation_summaries", chunk=1)
+
+    conv.refresh_from_db()
+    empty.refresh_from_db()
+    assert (conv.message_count, conv.last_preview, conv.last_model) == (2, "final answer", "gpt-4o-mini")
+    assert conv.last_message_at is not None
+    assert (empty.message_count, empty.last_message_at, empty.last_preview) == (0, None, "")
+
+
+@pytest.mark.django_db
+def test_conversation_delete_keeps_fast_cascade(django_assert_max_num_queries):
+    conv = Conversation.objects.create()
+    Message.objects.bulk_create(Message(conversation=conv, role=Message.Role.USER, content=str(i)) for i in range(50))
+
+    # بدون receiver حذف روی Message، پیام‌ها با یک DELETE آبشاری پاک می‌شوند (نه بارگذاری + UPDATE برای هر ردیف)
+    with django_assert_max_num_queries(4):
+        conv.delete()
+    assert not Message.objects.exists()
+
+
+@pytest.mark.django_db
+def test_admin_delete_recomputes_summary():
+    conv = Conversation.objects.create()
+    first = Message.objects.create(conversation=conv, role=Message.Role.USER, content="first", model_name="gpt-4o")
+    last = Message.objects.create(conversation=conv, role=Message.Role.ASSISTANT, content="last")
+    message_admin = MessageAdmin(Message, admin.site)
+
+    message_admin.delete_model(None, last)
+    conv.refresh_from_db()
+    assert (conv.message_count, conv.last_preview, conv.last_message_at) == (1, "first", first.created_at)
+
+    message_admin.delete_queryset(None, Message.objects.filter(conversation=conv))
+    conv.refresh_from_db()
+    assert (conv.message_count, conv.last_preview, conv.last_model, conv.last_message_at) == (0, "", "", None)
@@ -0,0 +1,42 @@
+import pytest
+
+from apps.chat import tasks
+from apps.chat.models import Conversation, Message
+from apps.chat.titler import extract_title, normalize
+
+IDF = (1000, {"python": 300, "list": 200})
+
+
+def test_normalize_persian_letters_and_zwnj():
+    assert normalize("كتاب علي") == "کتاب علی"
+    assert normalize("می‌‌خواهم ‌کتاب") == "می‌خواهم کتاب"
+    assert normalize("شبكهٔ عصبيِ") == "شبکه عصبی"
+
+
+def test_extract_title_persian_and_english():
+    title, confidence = extract_title("می‌خواهم یک رزومه برای موقعیت برنامه‌نویس پایتون بنویسم", IDF)
+    assert title == "موقعیت برنامه‌نویس پایتون"
+    assert confidence >= 0.7
+
+    title, confidence = extract_title("Write a cover letter for a senior data engineer position", IDF)
+    assert title == "Senior data engineer position"
+    assert confidence >= 0.7
+
+    # دو موضوع هم‌وزن یا فقط کلمات تکی → اطمینان پایین، تصمیم با LLM
+    assert extract_title("درباره یادگیری ماشین و شبکه عصبی توضیح بده", IDF)[1] < 0.7
+    assert extract_title("How do I sort a list by value in Python?", IDF)[1] < 0.7
+    assert extract_title("سلام", IDF) == ("", 0.0)
+
+
+@pytest.mark.django_db
+def test_confident_extractive_title_skips_llm(settings, monkeypatch):
+    settings.SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE = 0.3  # بدون جدول idf اطمینان‌ها سقف پایین‌تری دارند
+    monkeypatch.setattr(tasks, "_ws_emit", lambda *a, **kw: None)
+    monkeypatch.setattr(tasks, "_collect_title_text", lambda *a: pytest.fail("LLM should not be called"))
+
+    conv = Conversation.objects.create()
+    Message.objects.create(conversation=conv, role=Message.Role.USER, content="Write a cover letter for a senior data engineer position")
+    tasks.generate_and_save_smart_title_task(conv.id)
+
+    conv.refresh_from_db()
+    assert conv.title == "Senior data engineer position"
@@ -0,0 +1,57 @@
+import pytest
+from rest_framework.test import APIClient
+
+from apps.chat.models import Conversation, Message
+
+
+@pytest.fixture
+def thread(django_user_model):
+    user = django_user_model.objects.create_user(email="history@example.com", password="x")
+    conv = Conversation.objects.create(owner=user)
+    Message.objects.bulk_create(
+        Message(conversation=conv, role=Message.Role.USER if i % 2 == 0 else Message.Role.ASSISTANT, content=f"m{i}")
+        for i in range(12)
+    )
+    client = APIClient()
+    client.force_login(user)
+    return client, conv
+
+
+@pytest.mark.django_db
+def test_latest_page_first_then_older_pages(thread):
+    client, conv = thread
+    url = f"/api/v1/conversations/{conv.id}/messages/"
+
+    latest = client.get(url, {"page_size": 5}).json()
+    assert [m["content"] for m in latest["results"]] == ["m7", "m8", "m9", "m10", "m11"]
+    assert latest["has_more"] and "count" not in latest
+
+    older = client.get(url, {"page_size": 5, "cursor": latest["next_cursor"]}).json()
+    oldest = client.get(url, {"page_size": 5, "cursor": older["next_cursor"]}).json()
+    assert [m["content"] for m in older["results"]] == ["m2", "m3", "m4", "m5", "m6"]
+    assert [m["content"] for m in oldest["results"]] == ["m0", "m1"]
+    assert not oldest["has_more"] and oldest["next_cursor"] is None
+
+
+@pytest.mark.django_db
+def test_reopen_is_revalidated_with_etag(thread, django_assert_num_queries):
+    client, conv = thread
+    url = f"/api/v1/conversations/{conv.id}/messages/"
+    first = client.get(url)
+    etag = first["ETag"]
+    assert "no-cache" in first["Cache-Control"]
+
+    # session + user + دسترسی + صفحه؛ بدون COUNT
+    with django_assert_num_queries(4):
+        again = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert again.status_code == 304 and not again.content
+
+    Message.objects.create(conversation=conv, role=Message.Role.USER, content="new")
+    changed = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert changed.status_code == 200 and changed["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_other_users_conversation_is_404(thread):
+    _client, conv = thread
+    assert APIClient().get(f"/api/v1/conversations/{conv.id}/messages/").status_code == 404
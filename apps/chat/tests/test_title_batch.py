@@ -0,0 +1,113 @@
+import pytest
+
+from apps.chat import tasks
+from apps.chat.models import Conversation, Message
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.sets, self.keys = {}, {}
+
+    def sadd(self, key, value):
+        self.sets.setdefault(key, set()).add(str(value).encode())
+
+    def spop(self, key, count):
+        members = self.sets.get(key, set())
+        return [members.pop() for _ in range(min(count, len(members)))]
+
+    def scard(self, key):
+        return len(self.sets.get(key, ()))
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    def delete(self, key):
+        self.keys.pop(key, None)
+
+
+def test_parse_batch_titles_tolerates_fences_and_bad_items():
+    raw = '```json\n[{"id": 1, "title": "سلام دنیا"}, {"id": "x"}, {"id": "2", "title": "Tax help"}]\n```'
+    assert tasks._parse_batch_titles(raw) == {1: "سلام دنیا", 2: "Tax help"}
+    assert tasks._parse_batch_titles("not json") == {}
+
+
+@pytest.mark.django_db
+def test_batched_titles_use_one_request(settings, monkeypatch):
+    settings.SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE = 1.1  # مسیر LLM
+    fake = _FakeRedis()
+    scheduled, prompts, emitted = [], [], []
+    monkeypatch.setattr(tasks, "get_redis", lambda: fake)
+    monkeypatch.setattr(tasks, "get_provider", lambda: None)
+    monkeypatch.setattr(tasks.flush_smart_titles_task, "apply_async", lambda **kw: scheduled.append(kw))
+    monkeypatch.setattr(tasks, "_ws_emit", lambda event, **kw: emitted.append(event))
+
+    convs = []
+    for text in ("how do I bake bread", "python list sorting", "weekend trip ideas"):
+        conv = Conversation.objects.create()
+        Message.objects.create(conversation=conv, role=Message.Role.USER, content=text)
+        convs.append(conv)
+        tasks.request_smart_title(conv.id)
+    assert len(scheduled) == 1  # فقط اولین درخواست پنجره flush را زمان‌بندی می‌کند
+
+    def collect(provider, prompt):
+        prompts.append(prompt)
+        return '[{"id": %d, "title": "Baking Bread"}, {"id": %d, "title": "Sorting Lists"}]' % (convs[0].id, convs[1].id)
+
+    monkeypatch.setattr(tasks, "_collect_title_text", collect)
+    tasks.flush_smart_titles_task()
+
+    assert len(prompts) == 1
+    titles = dict(Conversation.objects.filter(id__in=[c.id for c in convs]).values_list("id", "title"))
+    assert titles[convs[0].id] == "Baking Bread"
+    assert titles[convs[1].id] == "Sorting Lists"
+    # گفتگوی بی‌پاسخ در خروجی مدل به quick title برمی‌گردد
+    assert titles[convs[2].id] == tasks._make_quick_title("weekend trip ideas")
+    assert len(emitted) == 3
+
+
+@pytest.mark.django_db
+def test_title_scheduling_uses_counter_and_dedupes(settings, monkeypatch):
+    settings.REDIS_URL = None
+    monkeypatch.setattr(tasks, "get_redis", lambda: None)
+    queued = []
+    monkeypatch.setattr(
+        tasks.generate_and_save_smart_title_task, "apply_async", lambda args, **kw: queued.append((args, kw))
+    )
+
+    conv = Conversation.objects.create()
+    Message.objects.create(conversation=conv, role=Message.Role.USER, content="hi")
+    Message.objects.create(conversation=conv, role=Message.Role.SYSTEM, content="sys")
+    conv.refresh_from_db()
+    assert conv.message_count == 1
+
+    tasks.request_smart_title(conv.id)
+    tasks.request_smart_title(conv.id)  # نوبت دوم در همان پنجره
+    assert len(queued) == 1
+    assert queued[0][1]["countdown"] == settings.SMART_TITLE_BATCH_WINDOW_SECONDS
+
+    for text in ("a", "b"):
+        Message.objects.create(conversation=conv, role=Message.Role.ASSISTANT, content=text)
+    tasks.cache.clear()
+    tasks.request_smart_title(conv.id)  # message_count == 3: بدون صف‌کردن
+    assert len(queued) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_async_title_request_reads_counter_on_loop(settings, monkeypatch):
+    settings.REDIS_URL = None
+    monkeypatch.setattr(tasks, "get_redis", lambda: None)
+    queued = []
+    monkeypatch.setattr(
+        tasks.generate_and_save_smart_title_task, "apply_async", lambda args, **kw: queued.append(args)
+    )
+
+    conv = await Conversation.objects.acreate()
+    await tasks.arequest_smart_title(conv.id)  # message_count == 0
+    assert queued == []
+
+    await Message.objects.acreate(conversation=conv, role=Message.Role.USER, content="hi")
+    await tasks.arequest_smart_title(conv.id)
+    assert queued == [(conv.id,)]
@@ -0,0 +1,165 @@
+# apps/chat/titler.py
+"""
+عنوان‌ساز استخراجی آفلاین (فارسی/انگلیسی) بین _make_quick_title و مسیر LLM.
+
+- نرمال‌سازی فارسی: ي/ى → ی، ك → ک، حذف اعراب و کشیده، یکدست‌کردن نیم‌فاصله (ZWNJ).
+- عبارت‌های کاندید به سبک RAKE: دنباله‌های بیشینهٔ کلمه‌های غیر stopword بین stopwordها و علائم.
+  افعال «می‌/نمی‌» دار هم مرز عبارت‌اند چون عنوان معمولاً یک گروه اسمی است.
+- امتیاز هر کلمه = (degree / frequency) × idf؛ idf از جدول فراوانی سندی پیش‌محاسبه‌شده
+  (`manage.py build_title_idf` → settings.SMART_TITLE_IDF_PATH) خوانده می‌شود.
+- اطمینان (۰ تا ۱) از برتری عبارت اول بر دومی و طول آن؛ بدون جدول idf سقف پایین‌تری دارد تا
+  تصمیم به LLM واگذار شود. هزینه: چند ده میکروثانیه برای یک پیام معمولی
+  (`manage.py bench_titler`).
+"""
+import json
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+ZWNJ = "\u200c"
+
+_CHAR_MAP = str.maketrans({
+    "\u064a": "\u06cc", "\u0649": "\u06cc", "\u0626": "\u06cc",  # ي ى ئ → ی
+    "\u0643": "\u06a9",  # ك → ک
+    "\u0629": "\u0647",  # ة → ه
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0671": "\u0627",  # أ إ ٱ → ا
+    "\u0624": "\u0648",  # ؤ → و
+    "\u0640": None,  # کشیده
+    "\u200f": None, "\u200e": None, "\ufeff": None,
+})
+_DIACRITICS_RE = re.compile("[\u064b-\u065f\u0670]")
+_ZWNJ_SPACE_RE = re.compile(f"\\s*{ZWNJ}+\\s*")
+_TOKEN_RE = re.compile(f"[\\w{ZWNJ}]+|[^\\w\\s{ZWNJ}]")
+# فعل‌های مضارع/ماضی استمراری (می‌/نمی‌ + نیم‌فاصله)
+_PERSIAN_VERB_RE = re.compile(f"^\u0646?\u0645\u06cc{ZWNJ}")
+
+STOPWORDS_EN = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my no nor not now of off on once only or other our
+out over own same she should so some such than that the their them then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your yours
+hi hello hey thanks thank please help want need know tell give show explain write make let get like ok okay
+also still really something anything way use using used question answer
+""".split())
+
+STOPWORDS_FA = frozenset("""
+و در به از که این آن را با برای است هست نیست بود بودن باشد باشه شد شود شده شدن کرد کرده کردن کن کنم کنی کنید
+کند کنه یک یه تا هم یا اما ولی چه چی چیه چطور چطوری چگونه چرا کجا کی کدام کدوم لطفا سلام مرسی ممنون متشکرم
+من تو شما ما او اون ایشان آنها اونها خیلی درباره دربارهٔ مورد نه اگر هر همه بر روی پس یعنی دارم دارد داره دارید
+ها های ای بده بگو بگید بنویس توضیح میشه میخوام میخواهم خواهم خواهد باید نباید توان تواند بتوانم بتونم رو هایی
+ام ات اش مان تان شان دیگه دیگر حالا الان فقط هنوز بیشتر کمی چند چندتا بعد قبل بین طور جوری چیزی کسی کار
+بنویسم بنویسی بنویسید بسازم بسازیم بدانم بدونم بفهمم بگیرم بخوانم بخونم بکنم بشه بشود بدهید برام برایم
+""".split())
+
+STOPWORDS = STOPWORDS_EN | STOPWORDS_FA
+
+_MAX_PHRASE_WORDS = 4
+
+
+def normalize(text: str) -> str:
+    """نرمال‌سازی حروف عربی/فارسی و نیم‌فاصله؛ حروف انگلیسی دست نمی‌خورند."""
+    text = _DIACRITICS_RE.sub("", (text or "").translate(_CHAR_MAP))
+    # نیم‌فاصلهٔ کنار فاصله یا تکراری بی‌معناست
+    return _ZWNJ_SPACE_RE.sub(lambda m: " " if m.group(0).strip(ZWNJ) else ZWNJ, text)
+
+
+def _key(token: str) -> str:
+    return token.lower()
+
+
+def _is_boundary(token: str) -> bool:
+    if not (token[0].isalnum() or token[0] == "_"):
+        return True  # علامت نگارشی
+    key = _key(token)
+    # «درباره‌ی»، «آن‌ها»: پایه (قبل از نیم‌فاصله) هم با stopwordها مقایسه می‌شود
+    if key in STOPWORDS or key.split(ZWNJ, 1)[0] in STOPWORDS or key.isdigit() or len(key) < 2:
+        return True
+    return bool(_PERSIAN_VERB_RE.match(key))
+
+
+def candidate_phrases(text: str) -> List[List[str]]:
+    phrases: List[List[str]] = []
+    current: List[str] = []
+    for token in _TOKEN_RE.findall(normalize(text)):
+        if _is_boundary(token):
+            if current:
+                phrases.append(current)
+            current = []
+            continue
+        current.append(token.strip(ZWNJ))
+        if len(current) == _MAX_PHRASE_WORDS:
+            phrases.append(current)
+            current = []
+    if current:
+        phrases.append(current)
+    return phrases
+
+
+@lru_cache(maxsize=1)
+def load_idf_table() -> Optional[Tuple[int, Dict[str, int]]]:
+    """جدول (تعداد سند، فراوانی سندی هر کلمه) یا None اگر هنوز ساخته نشده باشد."""
+    path = getattr(settings, "SMART_TITLE_IDF_PATH", None)
+    if not path:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return int(data["docs"]), {str(k): int(v) for k, v in data["df"].items()}
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        log.warning("Invalid title idf table %s: %s", path, e)
+        return None
+
+
+def extract_title(text: str, idf_table: Optional[Tuple[int, Dict[str, int]]] = None) -> Tuple[str, float]:
+    """
+    (عنوان، اطمینان) برای متن کاربر. اطمینان پایین یعنی باید سراغ LLM رفت.
+    idf_table برای تست/بنچمارک قابل تزریق است؛ در غیر این صورت از فایل خوانده می‌شود.
+    """
+    phrases = candidate_phrases(text)
+    if not phrases:
+        return "", 0.0
+    table = idf_table if idf_table is not None else load_idf_table()
+
+    freq: Dict[str, int] = {}
+    degree: Dict[str, int] = {}
+    for phrase in phrases:
+        for token in phrase:
+            key = _key(token)
+            freq[key] = freq.get(key, 0) + 1
+            degree[key] = degree.get(key, 0) + len(phrase)
+
+    def idf(key: str) -> float:
+        if table is None:
+            return 1.0
+        docs, df = table
+        # کلمهٔ غایب از جدول نادر فرض می‌شود (بیشترین idf)
+        return math.log((docs + 1) / (df.get(key, 0) + 1)) + 1
+
+    # عبارت تکراری فقط یک بار (با اولین شکل نوشتاری) رقابت می‌کند
+    scored: Dict[Tuple[str, ...], Tuple[float, List[str]]] = {}
+    for phrase in phrases:
+        keys = tuple(_key(t) for t in phrase)
+        if keys not in scored:
+            score = sum(degree[k] / freq[k] * idf(k) for k in keys)
+            scored[keys] = (score, phrase)
+    ranked = sorted(scored.values(), key=lambda item: item[0], reverse=True)
+
+    best_score, best = ranked[0]
+    runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+    dominance = best_score / (best_score + runner_up) if best_score > 0 else 0.0
+    length_factor = min(len(best), 2) / 2
+    confidence = dominance * (0.5 + 0.5 * length_factor) * (1.0 if table is not None else 0.6)
+
+    title = " ".join(best)
+    if title[:1].isascii():
+        title = title[:1].upper() + title[1:]
+    return title, round(confidence, 3)
@@ -88,7 +88,8 @@
             console.log("🔄 Fetching available models from API...");
             
             try {
-                const response = await fetchApi('/models/', { method: 'GET' });
+                // revalidate با ETag: اگر کاتالوگ تغییر نکرده باشد سرور 304 بدون بدنه برمی‌گرداند
+                const response = await fetchApi('/models/', { method: 'GET', cache: 'no-cache' });
                 const models = Array.isArray(response?.models) ? response.models : [];
                 
                 window.appState.update({ models: models, modelsLoading: false });
@@ -148,9 +149,17 @@
             }
         },
         
-        getChatHistory: () => fetchApi('/conversations/', { method: 'GET' }),
-
-        getConversationMessages: (conversationId) => fetchApi(`/conversations/${conversationId}/messages/`, { method: 'GET' }),
+        // صفحه‌بندی cursor: { results, next_cursor, has_more }
+        getChatHistory: (cursor = null) => fetchApi(
+            `/conversations/${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''}`,
+            { method: 'GET' }
+        ),
+
+        // جدیدترین صفحه اول؛ cursor = next_cursor صفحهٔ قبلی برای پیام‌های قدیمی‌تر. با ETag اعتبارسنجی می‌شود.
+        getConversationMessages: (conversationId, cursor = null) => fetchApi(
+            `/conversations/${conversationId}/messages/${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''}`,
+            { method: 'GET', cache: 'no-cache' }
+        ),
         
         createStreamMessage: (payload) => fetchApi('/messages/stream/', {
             method: 'POST',
@@ -96,17 +96,17 @@ const App = (() => {
     async function runInitialDataFetch() {
         console.log(" M️aking initial data fetches...");
         try {
-            const history = await window.api.getChatHistory();
+            const page = await window.api.getChatHistory();
             if (window.appState) {
-                window.appState.update({ chatHistory: history });
-                console.log(`✅ Chat history loaded with ${history.length} conversations.`);
+                window.appState.update({ chatHistory: page.results, chatHistoryCursor: page.next_cursor });
+                console.log(`✅ Chat history loaded with ${page.results.length} conversations.`);
             } else {
                 console.error("❌ App State module not found! Cannot store chat history.");
             }
         } catch (error) {
             console.error("❌ Failed during initial data fetch for chat history:", error);
             if (window.appState) {
-                window.appState.update({ chatHistory: [], chatHistoryError: "Could not load chats." });
+                window.appState.update({ chatHistory: [], chatHistoryCursor: null, chatHistoryError: "Could not load chats." });
             }
         }
     }
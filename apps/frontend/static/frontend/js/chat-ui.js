@@ -14,6 +14,11 @@
   let currentAssistantBubbleElement = null;
   let currentMessageTextBuffer = ''; // raw Markdown buffer
 
+  // ---------- History paging (keyset cursor; newest page first) ----------
+  let historyConversationId = null;
+  let historyCursor = null;      // next_cursor → older page
+  let historyLoading = false;
+
   // ---------- Smart Scroll State & Helpers ----------
   let autoScroll = true;
   let rafScrollId = null;
@@ -68,6 +73,22 @@
     return messageDiv;
   }
 
+  async function renderHistoryMessage(message) {
+    const messageElement = createMessageElement(message.role, message.content, message.content);
+    if (message.role === 'assistant') {
+      const bubble = messageElement.querySelector('.bubble');
+      if (window.PyamoozRenderers) {
+        await window.PyamoozRenderers.renderRich(bubble, message.content);
+      } else {
+        bubble.textContent = message.content;
+      }
+      if (window.bidiUtils) {
+        window.bidiUtils.applyBidiDirection(bubble, message.content);
+      }
+    }
+    return messageElement;
+  }
+
   function scrollToBottom() {
     const container = window.elements.chatMessagesContainer;
     if (container) container.scrollTop = container.scrollHeight;
@@ -183,6 +204,7 @@ function handleStreamToken(token) {
       if (c) {
         c.addEventListener('scroll', () => {
           autoScroll = isNearBottom(c);
+          if (c.scrollTop < 200) this.loadOlderMessages();
           const btn = document.getElementById('jumpToBottom');
           if (btn) btn.classList.toggle('show', !autoScroll);
         }, { passive: true });
@@ -211,6 +233,32 @@ function handleStreamToken(token) {
       currentMessageTextBuffer = '';
     },
     
+    /**
+     * Prepends the next older page of the open conversation, keeping the viewport in place.
+     */
+    loadOlderMessages: async function() {
+      if (!historyCursor || historyLoading) return;
+      const conversationId = historyConversationId;
+      historyLoading = true;
+      try {
+        const page = await window.api.getConversationMessages(conversationId, historyCursor);
+        if (conversationId !== historyConversationId) return; // گفتگوی دیگری باز شده
+        const c = window.elements.chatMessagesContainer;
+        const fragment = document.createDocumentFragment();
+        for (const message of page.results) {
+          fragment.appendChild(await renderHistoryMessage(message));
+        }
+        const previousHeight = c.scrollHeight;
+        c.prepend(fragment);
+        c.scrollTop += c.scrollHeight - previousHeight;
+        historyCursor = page.next_cursor;
+      } catch (error) {
+        console.error(`❌ Failed to load older messages for conversation ${conversationId}:`, error);
+      } finally {
+        historyLoading = false;
+      }
+    },
+
     clearMessages: function() {
       if (window.elements.chatMessagesContainer) {
         window.elements.chatMessagesContainer.innerHTML = '';
@@ -234,25 +282,18 @@ function handleStreamToken(token) {
       window.appState.update({ isLoading: true });
       
       try {
-        const messages = await window.api.getConversationMessages(conversationId);
-
-        for (const message of messages) {
-          const messageElement = createMessageElement(message.role, message.content, message.content);
-          window.elements.chatMessagesContainer.appendChild(messageElement);
+        historyConversationId = conversationId;
+        historyCursor = null;
+        const page = await window.api.getConversationMessages(conversationId);
 
-          if (message.role === 'assistant') {
-            const bubble = messageElement.querySelector('.bubble');
-            if (window.PyamoozRenderers) {
-              await window.PyamoozRenderers.renderRich(bubble, message.content);
-            } else {
-              bubble.textContent = message.content;
-            }
-            if (window.bidiUtils) {
-              window.bidiUtils.applyBidiDirection(bubble, message.content);
-            }
-          }
+        for (const message of page.results) {
+          window.elements.chatMessagesContainer.appendChild(await renderHistoryMessage(message));
         }
-        setTimeout(() => scrollToBottom(), 100);
+        setTimeout(() => {
+          scrollToBottom();
+          // فقط بعد از رسیدن به پایین؛ وگرنه scrollTop=0 اولیه صفحهٔ قدیمی‌تر را بی‌دلیل می‌گیرد
+          if (conversationId === historyConversationId) historyCursor = page.next_cursor;
+        }, 100);
       } catch (error) {
         console.error(`❌ Failed to load messages for conversation ${conversationId}:`, error);
         handleStreamError("Could not load chat history. Please try again.");
@@ -140,7 +140,8 @@ class ModelManager {
             });
             
             const url = `${this.baseUrl}/models/${params.toString() ? '?' + params.toString() : ''}`;
-            const response = await fetch(url);
+            // no-cache: مرورگر نسخهٔ قبلی را با If-None-Match اعتبارسنجی می‌کند و روی 304 از cache می‌خواند
+            const response = await fetch(url, { cache: 'no-cache' });
             const data = await response.json();
             
             if (data.success) {
@@ -658,22 +658,17 @@ updateSelectedModel(model) {
     }
     
     async handleFilterChange(filter) {
-        let filters = {};
+        // لیست کامل یک بار بارگذاری (و با ETag اعتبارسنجی) شده؛ فیلترها سمت کلاینت اعمال می‌شوند
+        // تا هر تغییر فیلتر یک درخواست و یک نسخهٔ رندرشدهٔ جدید سمت سرور نسازد
+        const allModels = this.modelManager.getAvailableModels();
         
         if (filter === 'free') {
-            filters.tier = 'free';
+            this.renderModelList(allModels.filter(model => model.tier === 'free'));
         } else if (filter === 'premium') {
             // Show all non-free models
-            const allModels = this.modelManager.getAvailableModels();
-            const premiumModels = allModels.filter(model => model.tier !== 'free');
-            this.renderModelList(premiumModels);
-            return;
-        }
-        
-        if (filter !== 'all') {
-            await this.modelManager.loadModels(filters);
+            this.renderModelList(allModels.filter(model => model.tier !== 'free'));
         } else {
-            await this.modelManager.loadModels();
+            this.renderModelList(allModels);
         }
     }
     
@@ -13,12 +13,39 @@
     const span = document.createElement('span');
     // DOM-safe: عنوان فقط متن می‌شود، نه HTML
     span.textContent = chat.title || 'Untitled Chat';
+    // پیش‌نمایش آخرین پیام (Conversation.last_preview) به‌صورت tooltip
+    if (chat.last_preview) a.title = chat.last_preview;
 
     a.appendChild(span);
     return a;
   }
 
+  let loadingMore = false;
+
   const sidebarUI = {
+    /**
+     * Fetches the next page of chat history (cursor pagination) and appends it.
+     */
+    loadMoreChatHistory: async function() {
+      const cursor = window.appState.get().chatHistoryCursor;
+      if (!cursor || loadingMore) return;
+      loadingMore = true;
+      try {
+        const page = await window.api.getChatHistory(cursor);
+        const current = window.appState.get().chatHistory || [];
+        const seen = new Set(current.map(c => c.id));
+        window.appState.update({
+          chatHistoryCursor: page.next_cursor,
+          chatHistory: current.concat(page.results.filter(c => !seen.has(c.id))),
+        });
+      } catch (error) {
+        console.error("❌ Failed to load more chat history:", error);
+      } finally {
+        loadingMore = false;
+      }
+    },
+
+
     /**
      * Renders the chat history into the sidebar.
      * Accepts array or state event payload {to: [...]}
@@ -69,6 +96,13 @@
 
       const container = document.getElementById('chatHistoryList');
       if (container) {
+        // نزدیک انتهای لیست صفحهٔ بعد گرفته می‌شود
+        container.addEventListener('scroll', () => {
+          if (container.scrollTop + container.clientHeight >= container.scrollHeight - 200) {
+            this.loadMoreChatHistory();
+          }
+        }, { passive: true });
+
         container.addEventListener('click', (event) => {
           const link = event.target.closest('.history-link');
           if (!link) return;
@@ -87,6 +87,8 @@
     // --- Chat / Conversation ---
     currentConversationId: null,
     messages: [],
+    chatHistory: [],
+    chatHistoryCursor: null, // next_cursor of /conversations/ (null = no more pages)
 
     // --- Models ---
     models: [],
@@ -0,0 +1,152 @@
+# apps/gateway/deadlines.py
+"""
+مهلت‌های فازبندی‌شدهٔ استریم upstream.
+
+به‌جای یک timeout کلی، هر فاز مهلت خودش را دارد:
+- connect: برقراری اتصال TCP/TLS با provider (به httpx داده می‌شود)
+- ttft:    از شروع درخواست تا اولین توکن
+- idle:    حداکثر فاصلهٔ بین دو توکن متوالی
+- total:   سقف کل تولید (برای پاسخ‌های طولانی اما سالم، بلند)
+
+مقادیر برای هر مدل از settings.STREAM_DEADLINES خوانده می‌شوند (کلید «default» + پیشوند نام مدل).
+برای بازتولید پیش‌فرض‌ها از p99 های واقعی: `manage.py suggest_stream_deadlines`.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from django.conf import settings
+
+PHASES = ("connect", "ttft", "idle", "total")
+
+
+@dataclass(frozen=True)
+class StreamDeadlines:
+    connect: float = 5.0
+    ttft: float = 30.0
+    idle: float = 20.0
+    total: float = 600.0
+
+
+class StreamTimeout(Exception):
+    """عبور از مهلت یک فاز؛ kind یکی از PHASES است."""
+
+    def __init__(self, kind: str, seconds: float):
+        self.kind = kind
+        self.seconds = seconds
+        super().__init__(f"Upstream {kind} deadline of {seconds:g}s exceeded")
+
+    @property
+    def error_type(self) -> str:
+        return f"timeout_{self.kind}"
+
+
+def get_deadlines(model: Optional[str]) -> StreamDeadlines:
+    """مهلت‌های یک مدل: default، سپس طولانی‌ترین پیشوند منطبق با نام مدل روی آن اعمال می‌شود."""
+    config: Dict[str, Dict[str, Any]] = getattr(settings, "STREAM_DEADLINES", {}) or {}
+    deadlines = StreamDeadlines()
+    if config.get("default"):
+        deadlines = replace(deadlines, **_clean(config["default"]))
+    name = (model or "").lower()
+    matches = [key for key in config if key != "default" and name.startswith(key.lower())]
+    if matches:
+        deadlines = replace(deadlines, **_clean(config[max(matches, key=len)]))
+    return deadlines
+
+
+def _clean(values: Dict[str, Any]) -> Dict[str, float]:
+    return {k: float(v) for k, v in values.items() if k in PHASES}
+
+
+class DeadlineTracker:
+    """وضعیت فاز جاری یک استریم را نگه می‌دارد و مهلت باقی‌مانده تا رویداد بعدی را حساب می‌کند."""
+
+    def __init__(self, deadlines: StreamDeadlines):
+        self.deadlines = deadlines
+        self.started_at = time.monotonic()
+        self.last_token_at: Optional[float] = None
+
+    def next_timeout(self) -> Tuple[float, str]:
+        now = time.monotonic()
+        total_left = self.started_at + self.deadlines.total - now
+        if self.last_token_at is None:
+            kind, phase_left = "ttft", self.started_at + self.deadlines.ttft - now
+        else:
+            kind, phase_left = "idle", self.last_token_at + self.deadlines.idle - now
+        if total_left <= phase_left:
+            return max(0.0, total_left), "total"
+        return max(0.0, phase_left), kind
+
+    def mark_token(self) -> None:
+        self.last_token_at = time.monotonic()
+
+    def expired(self, kind: str) -> StreamTimeout:
+        return StreamTimeout(kind, getattr(self.deadlines, kind))
+
+    def check(self) -> None:
+        """برای generatorهای همگام که نمی‌توان وسطشان قطع کرد: بعد از هر رویداد صدا زده می‌شود."""
+        remaining, kind = self.next_timeout()
+        if remaining <= 0:
+            raise self.expired(kind)
+
+    def observe(self, event: Any) -> None:
+        if isinstance(event, dict) and event.get("type") == "token":
+            self.mark_token()
+
+
+async def aiter_sync(gen):
+    """generator همگام (مثل FakeProvider) را بدون بلاک کردن طولانی event loop پیمایش می‌کند."""
+    for event in gen:
+        yield event
+        await asyncio.sleep(0)
+
+
+async def aiter_with_deadlines(iterator: AsyncIterator, tracker: DeadlineTracker):
+    """
+    رویدادهای یک async iterator را با اعمال مهلت ttft/idle/total برمی‌گرداند.
+    با timeout، __anext__ لغو می‌شود؛ CancelledError داخل generator provider بالا می‌رود و
+    اتصال httpx همان لحظه بسته می‌شود.
+    """
+    while True:
+        timeout, kind = tracker.next_timeout()
+        try:
+            event = await asyncio.wait_for(iterator.__anext__(), timeout)
+        except StopAsyncIteration:
+            return
+        except asyncio.TimeoutError:
+            raise tracker.expired(kind) from None
+        tracker.observe(event)
+        yield event
+
+
+def iter_with_deadlines(gen, tracker: DeadlineTracker):
+    """
+    نسخهٔ همگام aiter_with_deadlines برای workerهای سلری: خروجی provider (sync یا async generator)
+    را پیمایش می‌کند. برای async generator یک event loop اختصاصی ساخته می‌شود؛ با timeout یا بستن
+    این generator، provider لغو/aclose می‌شود تا stream httpx فوراً بسته شود.
+    """
+    if not hasattr(gen, "__aiter__"):
+        # generator همگام را نمی‌توان وسط کار قطع کرد؛ مهلت بعد از هر رویداد بررسی می‌شود
+        for event in gen:
+            tracker.observe(event)
+            yield event
+            tracker.check()
+        return
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            timeout, kind = tracker.next_timeout()
+            try:
+                event = loop.run_until_complete(asyncio.wait_for(gen.__anext__(), timeout))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise tracker.expired(kind) from None
+            tracker.observe(event)
+            yield event
+    finally:
+        try:
+            loop.run_until_complete(gen.aclose())
+        finally:
+            loop.close()
@@ -0,0 +1,92 @@
+import json
+import math
+import os
+from collections import defaultdict
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from prometheus_client import CollectorRegistry
+from prometheus_client.parser import text_string_to_metric_families
+
+from apps.gateway.deadlines import StreamDeadlines
+
+# متریک منبع برای هر فاز (connect مستقیم اندازه‌گیری نمی‌شود و پیش‌فرض می‌ماند)
+_SOURCES = {
+    "ttft": "chat_stream_upstream_ttft_seconds",
+    "idle": "chat_stream_inter_token_seconds",
+    "total": "chat_stream_duration_seconds",
+}
+
+
+class Command(BaseCommand):
+    help = 'پیشنهاد STREAM_DEADLINES برای هر مدل از روی p99 هیستوگرام‌های Prometheus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='آدرس endpoint متریک (مثلاً https://host/metrics)؛ در غیر این صورت PROMETHEUS_MULTIPROC_DIR')
+        parser.add_argument('--token', default=os.getenv("METRICS_AUTH_TOKEN", ""), help='توکن Bearer برای /metrics')
+        parser.add_argument('--quantile', type=float, default=0.99)
+        parser.add_argument('--headroom', type=float, default=2.0, help='ضریب اطمینان روی صدک')
+        parser.add_argument('--min-samples', type=int, default=200, help='مدل‌های کم‌داده نادیده گرفته می‌شوند')
+
+    def handle(self, *args, **options):
+        families = self._load(options)
+        # buckets[phase][model] = [(le, cumulative_count), ...]
+        buckets = defaultdict(lambda: defaultdict(list))
+        for family in families:
+            for phase, name in _SOURCES.items():
+                if family.name != name:
+                    continue
+                for sample in family.samples:
+                    if not sample.name.endswith("_bucket"):
+                        continue
+                    # مدت کل فقط از تولیدهای موفق؛ timeoutها صدک را به سمت مهلت فعلی می‌کشند
+                    if phase == "total" and sample.labels.get("outcome") != "completed":
+                        continue
+                    le = float(sample.labels["le"])
+                    series = buckets[phase][sample.labels.get("model", "")]
+                    series.append((le, sample.value))
+
+        defaults = StreamDeadlines()
+        suggested = {}
+        for phase, per_model in buckets.items():
+            for model, series in per_model.items():
+                value = self._quantile(series, options['quantile'], options['min_samples'])
+                if value is None:
+                    continue
+                floor = getattr(defaults, phase) / 4
+                suggested.setdefault(model or "default", {})[phase] = max(floor, math.ceil(value * options['headroom']))
+
+        if not suggested:
+            raise CommandError("داده‌ای کافی برای پیشنهاد مهلت پیدا نشد.")
+        self.stdout.write(json.dumps(suggested, ensure_ascii=False, indent=2, sort_keys=True))
+        self.stdout.write(self.style.SUCCESS("↑ این JSON را در متغیر محیطی STREAM_DEADLINES_JSON قرار دهید."))
+
+    def _load(self, options):
+        if options['url']:
+            headers = {"Authorization": f"Bearer {options['token']}"} if options['token'] else {}
+            resp = requests.get(options['url'], headers=headers, timeout=10)
+            resp.raise_for_status()
+            return list(text_string_to_metric_families(resp.text))
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return list(registry.collect())
+        raise CommandError("--url بدهید یا PROMETHEUS_MULTIPROC_DIR را ست کنید.")
+
+    @staticmethod
+    def _quantile(series, q, min_samples):
+        """صدک از باکت‌های تجمعی (برای مدل‌هایی با چند path/outcome، باکت‌های هم‌مرز جمع می‌شوند)."""
+        merged = defaultdict(float)
+        for le, count in series:
+            merged[le] += count
+        points = sorted(merged.items())
+        total = points[-1][1] if points else 0
+        if total < min_samples:
+            return None
+        target = total * q
+        for le, count in points:
+            if count >= target:
+                # صدک در باکت +Inf افتاده؛ مرز بالا نامعلوم است
+                return None if math.isinf(le) else le
+        return None
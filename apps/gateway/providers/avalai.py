@@ -7,6 +7,8 @@ import logging
 from typing import Any, Dict, AsyncIterable, List, Optional  # <--- تغییر: Iterable به AsyncIterable
 import httpx  # <--- تغییر: جایگزینی requests با httpx
 from .base import BaseProvider
+from apps.gateway.deadlines import StreamTimeout, get_deadlines
+from apps.observability.metrics import UPSTREAM_RESPONSES_TOTAL, UPSTREAM_ERRORS_TOTAL
 
 logger = logging.getLogger(__name__)
 
@@ -31,9 +33,9 @@ class AvalaiProvider(BaseProvider):
         if not self.api_key:
             raise RuntimeError("❌ AVALAI_API_KEY is not set")
         
-        logger.info(f"✅ AvalAI provider initialized with base URL: {self.base_url}")
-        logger.info(f"🎯 Default model: {self.default_model}")
-        logger.debug(f"🔧 Parameter handler initialized for {self.name}")
+        logger.debug("✅ AvalAI provider initialized with base URL: %s", self.base_url)
+        logger.debug("🎯 Default model: %s", self.default_model)
+        logger.debug("🔧 Parameter handler initialized for %s", self.name)
 
     def _headers(self) -> Dict[str, str]:
         """Generate headers for AvalAI API requests"""
@@ -82,7 +84,7 @@ class AvalaiProvider(BaseProvider):
                 model=model or self.default_model,
                 **params
             )
-            logger.info("🔧 AvalAI payload prepared successfully")
+            logger.debug("🔧 AvalAI payload prepared successfully")
             logger.debug("📋 Final parameters: %s", list(request_data.keys()))
             return request_data
 
@@ -129,6 +131,8 @@ class AvalaiProvider(BaseProvider):
         Yields:
             Event dictionaries with type, data, etc.
         """
+        seq = 0
+        deadlines = get_deadlines(model or self.default_model)
         try:
             # بخش اعتبارسنجی و آماده‌سازی payload کاملاً بدون تغییر باقی می‌ماند
             if not messages:
@@ -157,19 +161,28 @@ class AvalaiProvider(BaseProvider):
             
             url = f"{self.base_url}/chat/completions"
             
-            logger.info(f"🚀 Starting AvalAI request")
-            logger.info(f"📍 URL: {url}")
-            logger.info(f"🤖 Model: {payload.get('model')}")
-            logger.info(f"🌊 Stream: {payload.get('stream')}")
-            logger.debug(f"📦 Payload keys: {list(payload.keys())}")
+            logger.debug("🚀 Starting AvalAI request")
+            logger.debug("📍 URL: %s", url)
+            logger.debug("🤖 Model: %s", payload.get('model'))
+            logger.debug("🌊 Stream: %s", payload.get('stream'))
+            logger.debug("📦 Payload keys: %s", list(payload.keys()))
             
             yield self.create_event("started", model=payload.get("model"), provider=self.name)
             
             # --- شروع بلوک کد جایگزین شده با httpx ---
-            async with httpx.AsyncClient(timeout=(10, 300)) as client:
+            # connect مستقیماً به httpx سپرده می‌شود؛ read فقط سقف ایمنی است و مهلت‌های دقیق
+            # ttft/idle/total را فراخوان (aiter_with_deadlines) اعمال می‌کند.
+            timeout = httpx.Timeout(
+                connect=deadlines.connect,
+                read=max(deadlines.ttft, deadlines.idle),
+                write=deadlines.connect,
+                pool=deadlines.connect,
+            )
+            async with httpx.AsyncClient(timeout=timeout) as client:
                 async with client.stream("POST", url, headers=self._headers(), json=payload) as response:
                     
-                    logger.info(f"📡 AvalAI response status: {response.status_code}")
+                    logger.debug("📡 AvalAI response status: %s", response.status_code)
+                    UPSTREAM_RESPONSES_TOTAL.labels(self.name, str(response.status_code)).inc()
                     
                     if response.status_code != 200:
                         error_body = await response.aread()
@@ -179,16 +192,17 @@ class AvalaiProvider(BaseProvider):
                         except (json.JSONDecodeError, UnicodeDecodeError):
                             error_message = error_body.decode(errors='ignore')
                         
-                        logger.error(f"❌ AvalAI API error {response.status_code}: {error_message}")
+                        logger.error("❌ AvalAI API error %s: %s", response.status_code, error_message)
                         yield self.create_event("token", delta=f"❌ Error: {error_message}", seq=0)
                         yield self.create_event("done", finish_reason="error")
                         return
                     
-                    seq = 0
+                    # یک بار بررسی می‌شود تا در حلقهٔ توکن‌ها هیچ هزینهٔ لاگ پرداخت نشود
+                    debug_tokens = logger.isEnabledFor(logging.DEBUG)
                     total_content = "" # این متغیرها از کد اصلی شما حفظ شده‌اند
                     line_count = 0
                     
-                    logger.debug(f"🔄 Processing AvalAI stream...")
+                    logger.debug("🔄 Processing AvalAI stream...")
                     
                     async for raw_line in response.aiter_lines():
                         line_count += 1
@@ -202,13 +216,13 @@ class AvalaiProvider(BaseProvider):
                             data_str = raw_line.strip()
                         
                         if data_str == "[DONE]":
-                            logger.info(f"✅ AvalAI stream completed normally")
+                            logger.debug("✅ AvalAI stream completed normally")
                             break
                         
                         try:
                             chunk = json.loads(data_str)
                         except json.JSONDecodeError as e:
-                            logger.warning(f"⚠️ Failed to parse AvalAI JSON: {e} on line: '{data_str}'")
+                            logger.warning("⚠️ Failed to parse AvalAI JSON: %s on line: '%s'", e, data_str)
                             continue
                         
                         choices = chunk.get("choices", [])
@@ -221,32 +235,43 @@ class AvalaiProvider(BaseProvider):
                         
                         if content:
                             total_content += content
-                            logger.debug(f"📝 AvalAI token: {repr(content[:50])}")
+                            if debug_tokens:
+                                logger.debug("📝 AvalAI token: %r", content[:50])
                             yield self.create_event("token", delta=content, seq=seq)
                             seq += 1
                         
                         finish_reason = choice.get("finish_reason")
                         if finish_reason:
-                            logger.info(f"🏁 AvalAI finished: {finish_reason}")
+                            logger.debug("🏁 AvalAI finished: %s", finish_reason)
                             yield self.create_event("done", finish_reason=finish_reason)
                             return
                 
-                logger.info(f"✅ AvalAI stream ended normally, total tokens: {seq}")
+                logger.debug("✅ AvalAI stream ended normally, total tokens: %s", seq)
                 yield self.create_event("done", finish_reason="stop")
         
         # --- بخش مدیریت خطا با خطاهای httpx به‌روزرسانی شده است ---
+        except httpx.ConnectTimeout as e:
+            logger.error("⏱️ AvalAI connect timeout: %s", e)
+            UPSTREAM_ERRORS_TOTAL.labels(self.name, "connect_timeout").inc()
+            raise StreamTimeout("connect", deadlines.connect) from e
         except httpx.TimeoutException as e:
-            logger.error(f"⏱️ AvalAI timeout: {e}")
-            yield self.handle_api_error(e, "request_timeout")
+            # read timeout قبل از اولین توکن یعنی TTFT و بعد از آن یعنی idle
+            kind = "idle" if seq else "ttft"
+            logger.error("⏱️ AvalAI %s timeout: %s", kind, e)
+            UPSTREAM_ERRORS_TOTAL.labels(self.name, f"{kind}_timeout").inc()
+            raise StreamTimeout(kind, getattr(deadlines, kind)) from e
         except httpx.ConnectError as e:
-            logger.error(f"🔌 AvalAI connection error: {e}")
+            logger.error("🔌 AvalAI connection error: %s", e)
+            UPSTREAM_ERRORS_TOTAL.labels(self.name, "connection_error").inc()
             yield self.handle_api_error(e, "connection_error")
         except httpx.RequestError as e:
-            logger.error(f"📡 AvalAI request error: {e}")
+            logger.error("📡 AvalAI request error: %s", e)
+            UPSTREAM_ERRORS_TOTAL.labels(self.name, "request_error").inc()
             yield self.handle_api_error(e, "request_error")
         except Exception as e:
-            logger.error(f"💥 Unexpected AvalAI error: {e}")
+            logger.error("💥 Unexpected AvalAI error: %s", e)
             logger.exception("Full traceback:")
+            UPSTREAM_ERRORS_TOTAL.labels(self.name, "unexpected_error").inc()
             yield self.handle_api_error(e, "unexpected_error")
 
     # --- این متد بدون تغییر باقی می‌ماند ---
@@ -33,8 +33,8 @@ class BaseProvider:
         # Initialize parameter handler based on provider name
         self.param_handler = ParameterHandler(self.name)
         
-        logger.info(f"Initialized {self.name} provider with dynamic parameter handling")
-        logger.debug(f"Provider config: {self.config}")
+        logger.debug("Initialized %s provider with dynamic parameter handling", self.name)
+        logger.debug("Provider config: %s", self.config)
     
     # vvvv ----- تغییر اینجاست ----- vvvv
     def prepare_request_data(self, messages: List[Dict[str, str]], model: str, **params: Any) -> Dict[str, Any]:
@@ -53,8 +53,8 @@ class BaseProvider:
         if params is None:
             params = {}
         
-        logger.debug(f"Preparing request data for {self.name} provider")
-        logger.debug(f"Input parameters: {list(params.keys())}")
+        logger.debug("Preparing request data for %s provider", self.name)
+        logger.debug("Input parameters: %s", list(params.keys()))
         
         try:
             # Use parameter handler to prepare data
@@ -67,16 +67,16 @@ class BaseProvider:
             # Validate the prepared data
             is_valid, error_msg = self.param_handler.validate_request_data(request_data)
             if not is_valid:
-                logger.error(f"Invalid request data for {self.name}: {error_msg}")
+                logger.error("Invalid request data for %s: %s", self.name, error_msg)
                 raise ValueError(f"Invalid request data for {self.name}: {error_msg}")
             
-            logger.info(f"Successfully prepared request data for {self.name}")
-            logger.debug(f"Final parameters: {list(request_data.keys())}")
+            logger.debug("Successfully prepared request data for %s", self.name)
+            logger.debug("Final parameters: %s", list(request_data.keys()))
             
             return request_data
             
         except Exception as e:
-            logger.error(f"Error preparing request data for {self.name}: {e}")
+            logger.error("Error preparing request data for %s: %s", self.name, e)
             # Fallback to basic parameters
             return {
                 'model': model,
@@ -96,7 +96,7 @@ class BaseProvider:
             Filtered parameters dictionary
         """
         if not hasattr(self, 'param_handler'):
-            logger.warning(f"Parameter handler not initialized for {self.name}, returning original params")
+            logger.warning("Parameter handler not initialized for %s, returning original params", self.name)
             return params
         
         filtered_params = {}
@@ -115,7 +115,7 @@ class BaseProvider:
                 unsupported_params.append(param_name)
         
         if unsupported_params:
-            logger.info(f"Filtered unsupported parameters for {self.name}: {unsupported_params}")
+            logger.info("Filtered unsupported parameters for %s: %s", self.name, unsupported_params)
         
         return filtered_params
     
@@ -188,7 +188,7 @@ class BaseProvider:
             error_type = "UNKNOWN_ERROR"
             user_message = f"خطا در ارتباط با {self.name}"
         
-        logger.error(f"{self.name} {context} error [{error_type}]: {error_message}")
+        logger.error("%s %s error [%s]: %s", self.name, context, error_type, error_message)
         
         return {
             "type": "error",
@@ -280,7 +280,7 @@ class BaseProvider:
             yield self.create_event("done", finish_reason="completed")
             
         except Exception as e:
-            logger.error(f"Unexpected error in {self.name} generate: {e}")
+            logger.error("Unexpected error in %s generate: %s", self.name, e)
             yield self.handle_api_error(e, "generate")
     
     def __str__(self) -> str:
@@ -23,7 +23,7 @@ def get_provider(name: str | None = None):
     cls = REGISTRY[selected]
     try:
         provider = cls()
-        logger.info("✅ Provider selected: %s", selected)
+        logger.debug("✅ Provider selected: %s", selected)
         return provider
     except Exception as e:
         logger.exception("💥 Provider init failed for '%s': %s", selected, e)
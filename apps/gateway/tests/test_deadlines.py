@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from apps.gateway.deadlines import (
+    DeadlineTracker, StreamDeadlines, StreamTimeout, aiter_with_deadlines, get_deadlines,
+)
+
+
+def test_get_deadlines_longest_prefix_overrides_default(settings):
+    settings.STREAM_DEADLINES = {
+        "default": {"ttft": 10, "total": 300},
+        "o1": {"ttft": 90},
+        "o1-mini": {"idle": 5},
+    }
+    assert get_deadlines("gpt-4o") == StreamDeadlines(connect=5, ttft=10, idle=20, total=300)
+    assert get_deadlines("o1-preview").ttft == 90
+    assert get_deadlines("o1-mini-2024") == StreamDeadlines(connect=5, ttft=10, idle=5, total=300)
+
+
+async def _tokens(delays):
+    for i, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield {"type": "token", "delta": str(i)}
+
+
+async def _drain(delays, deadlines):
+    out = []
+    async for event in aiter_with_deadlines(_tokens(delays), DeadlineTracker(deadlines)):
+        out.append(event["delta"])
+    return out
+
+
+async def test_ttft_and_idle_are_reported_separately():
+    fast = StreamDeadlines(connect=1, ttft=0.05, idle=0.05, total=5)
+    with pytest.raises(StreamTimeout) as exc:
+        await _drain([0.2], fast)
+    assert exc.value.error_type == "timeout_ttft"
+
+    with pytest.raises(StreamTimeout) as exc:
+        await _drain([0, 0, 0.2], fast)
+    assert exc.value.kind == "idle"
+
+
+async def test_total_deadline_caps_a_steady_stream():
+    # هر توکن زیر مهلت idle است ولی مجموع از total می‌گذرد
+    deadlines = StreamDeadlines(connect=1, ttft=1, idle=1, total=0.1)
+    with pytest.raises(StreamTimeout) as exc:
+        await _drain([0.03] * 10, deadlines)
+    assert exc.value.kind == "total"
+    assert await _drain([0, 0], deadlines) == ["0", "1"]
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import ModelProvider, AIModel, UserModelPermission, ModelUsageLog
+from .models import ModelProvider, AIModel, UserModelPermission, ModelUsageLog, ModelUsageRollup
+from .services.catalog import bump_catalog_version
 
 @admin.register(ModelProvider)
 class ModelProviderAdmin(admin.ModelAdmin):
@@ -78,12 +79,15 @@ class AIModelAdmin(admin.ModelAdmin):
     pricing_display.short_description = 'قیمت‌گذاری'
     
     def activate_models(self, request, queryset):
-        count = queryset.update(is_active=True)
+        # تصمیم ادمین بر وضعیت sync مقدم است
+        count = queryset.update(is_active=True, deactivated_by_sync=False)
+        bump_catalog_version()
         self.message_user(request, f'{count} مدل فعال شد.')
     activate_models.short_description = 'فعال کردن مدل‌های انتخاب شده'
     
     def deactivate_models(self, request, queryset):
-        count = queryset.update(is_active=False)
+        count = queryset.update(is_active=False, deactivated_by_sync=False)
+        bump_catalog_version()
         self.message_user(request, f'{count} مدل غیرفعال شد.')
     deactivate_models.short_description = 'غیرفعال کردن مدل‌های انتخاب شده'
     
@@ -93,21 +97,12 @@ class AIModelAdmin(admin.ModelAdmin):
         
         # دریافت مدل‌های جدید از API
         avalai_models = avalai_service.fetch_models(force_refresh=True)
-        avalai_model_ids = {model.get('id') for model in avalai_models}
+        selected_ids = set(queryset.values_list('model_id', flat=True))
+        selected = [m for m in avalai_models if m.get('id') in selected_ids]
         
-        synced_count = 0
-        for model in queryset:
-            if model.model_id in avalai_model_ids:
-                # پیدا کردن داده‌های جدید
-                model_data = next(
-                    (m for m in avalai_models if m.get('id') == model.model_id), 
-                    None
-                )
-                if model_data:
-                    # به‌روزرسانی مدل
-                    stats = {'updated': 0}
-                    model_manager._sync_single_model(model_data, stats)
-                    synced_count += stats.get('updated', 0)
+        # بازنویسی اجباری (بدون توجه به هش) و بدون غیرفعال کردن سایر مدل‌ها
+        stats = model_manager.sync_catalog(selected, deactivate_missing=False, force=True)
+        synced_count = stats['updated'] + stats['created']
         
         self.message_user(request, f'{synced_count} مدل همگام‌سازی شد.')
     sync_selected_models.short_description = 'همگام‌سازی مدل‌های انتخاب شده'
@@ -154,6 +149,24 @@ class ModelUsageLogAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False  # فقط خواندنی
 
+@admin.register(ModelUsageRollup)
+class ModelUsageRollupAdmin(admin.ModelAdmin):
+    list_display = [
+        'bucket_start', 'granularity', 'model', 'subject',
+        'request_count', 'failure_count', 'tokens_used'
+    ]
+    list_filter = ['granularity', 'model__provider', 'bucket_start']
+    search_fields = ['subject', 'user__email', 'model__display_name']
+    list_select_related = ['model']
+
+    date_hierarchy = 'bucket_start'
+
+    def has_add_permission(self, request):
+        return False  # فقط توسط rollup_usage_logs نوشته می‌شود
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # تنظیمات اضافی برای Admin
 admin.site.site_header = 'مدیریت مدل‌های هوش مصنوعی'
 admin.site.site_title = 'Pyamooz AI Models'
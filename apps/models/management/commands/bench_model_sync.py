@@ -0,0 +1,81 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.models.models import AIModel, ModelProvider
+from apps.models.services.model_manager import model_manager
+
+
+def _catalog(n, revision=0, changed_every=0):
+    owners = ['openai', 'anthropic', 'google', 'meta', 'mistral']
+    out = []
+    for i in range(n):
+        bump = revision if changed_every and i % changed_every == 0 else 0
+        out.append({
+            'id': f'bench-model-{i}',
+            'owned_by': owners[i % len(owners)],
+            'max_tokens': 4096 + bump,
+            'max_input_tokens': 8192,
+            'max_output_tokens': 4096,
+            'max_requests_per_1_minute': 60,
+            'supports_vision': i % 3 == 0,
+            'supports_function_calling': i % 2 == 0,
+            'pricing': {'input': 0.0005 * (i % 4), 'output': 0.0015},
+            'min_tier': i % 4,
+        })
+    return out
+
+
+def _legacy_sync(catalog):
+    """مسیر قبلی: get_or_create و مقایسه/ذخیرهٔ جداگانه برای هر مدخل"""
+    for model_data in catalog:
+        provider_name = model_data.get('owned_by', 'unknown')
+        provider, _ = ModelProvider.objects.get_or_create(
+            name=provider_name, defaults={'display_name': provider_name.title(), 'is_active': True}
+        )
+        fresh = model_manager._build_model(model_data, provider, '', timezone.now())
+        values = {f: getattr(fresh, f) for f in model_manager.SYNCED_FIELDS if f not in ('provider', 'updated_at')}
+        model, created = AIModel.objects.get_or_create(
+            model_id=model_data['id'], defaults={**values, 'provider': provider}
+        )
+        if created:
+            continue
+        changed = [f for f, v in values.items() if getattr(model, f) != v]
+        for f in changed:
+            setattr(model, f, values[f])
+        model.save(update_fields=changed)
+
+
+class Command(BaseCommand):
+    help = 'مقایسهٔ زمان و تعداد کوئری همگام‌سازی قبلی (سطر به سطر) با upsert دسته‌ای (بدون تغییر ماندگار در DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', type=int, default=500)
+        parser.add_argument('--changed-every', type=int, default=10, help='در اجرای سوم هر n-امین مدل تغییر می‌کند')
+
+    def handle(self, *args, **options):
+        n, every = options['models'], options['changed_every']
+        runs = [
+            ('cold (empty table)', _catalog(n)),
+            ('warm (unchanged)', _catalog(n)),
+            (f'warm (1/{every} changed)', _catalog(n, revision=1, changed_every=every)),
+        ]
+        for label, runner in (('legacy per-row', _legacy_sync), ('bulk upsert', self._bulk)):
+            with transaction.atomic():
+                for run_label, catalog in runs:
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        runner(catalog)
+                        elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"{label:>15} | {run_label:<22} | {elapsed * 1000:8.1f} ms | {len(ctx.captured_queries):5d} queries"
+                    )
+                transaction.set_rollback(True)
+
+    @staticmethod
+    def _bulk(catalog):
+        # مدل‌های واقعی خارج از کاتالوگ بنچمارک نباید غیرفعال شوند
+        model_manager.sync_catalog(catalog, deactivate_missing=False)
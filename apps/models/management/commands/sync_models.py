@@ -47,6 +47,8 @@ class Command(BaseCommand):
                         f'  - کل مدل‌ها: {stats["total"]}\n'
                         f'  - ایجاد شده: {stats["created"]}\n'
                         f'  - به‌روزرسانی شده: {stats["updated"]}\n'
+                        f'  - بدون تغییر: {stats["unchanged"]}\n'
+                        f'  - غیرفعال شده: {stats["deactivated"]}\n'
                         f'  - خطاها: {stats["errors"]}\n'
                         f'⏱️ مدت زمان: {duration:.2f} ثانیه'
                     )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("models", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aimodel",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
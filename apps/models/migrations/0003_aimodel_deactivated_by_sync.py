@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("models", "0002_aimodel_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aimodel",
+            name="deactivated_by_sync",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("models", "0003_aimodel_deactivated_by_sync"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="modelusagelog",
+            name="request_timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("models", "0004_modelusagelog_request_timestamp"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UsageRollupCheckpoint",
+            fields=[
+                ("name", models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ("last_log_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "model_usage_rollup_checkpoints",
+            },
+        ),
+        migrations.CreateModel(
+            name="ModelUsageRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("granularity", models.CharField(choices=[("hour", "ساعتی"), ("day", "روزانه")], max_length=4)),
+                ("bucket_start", models.DateTimeField()),
+                ("subject", models.CharField(max_length=110)),
+                ("session_key", models.CharField(blank=True, default="", max_length=100)),
+                ("request_count", models.PositiveIntegerField(default=0)),
+                ("success_count", models.PositiveIntegerField(default=0)),
+                ("failure_count", models.PositiveIntegerField(default=0)),
+                ("tokens_used", models.BigIntegerField(default=0)),
+                ("latency_count", models.PositiveIntegerField(default=0)),
+                ("latency_sum_ms", models.BigIntegerField(default=0)),
+                ("latency_histogram", models.JSONField(default=list)),
+                ("model", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="models.aimodel")),
+                ("user", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "db_table": "model_usage_rollups",
+                "indexes": [models.Index(fields=["model", "subject", "granularity", "bucket_start"], name="model_usage_model_i_d2dbcf_idx"), models.Index(fields=["user", "granularity", "bucket_start"], name="model_usage_user_id_ef313b_idx")],
+                "constraints": [models.UniqueConstraint(fields=("granularity", "bucket_start", "model", "subject"), name="uniq_usage_rollup_bucket")],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-19 09:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("models", "0005_usage_rollups"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenQuotaUsage",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("period", models.CharField(choices=[("day", "روزانه"), ("month", "ماهانه")], max_length=5)),
+                ("period_start", models.DateField()),
+                ("tokens_used", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("model", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="models.aimodel")),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "db_table": "token_quota_usage",
+                "constraints": [models.UniqueConstraint(fields=("user", "model", "period", "period_start"), name="uniq_token_quota_period")],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 import json
 
@@ -59,6 +60,10 @@ class AIModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     last_synced = models.DateTimeField(null=True, blank=True)
+    # sha256 مدخل کاتالوگ AvalAI؛ sync مدل‌های بدون تغییر را بازنویسی نمی‌کند
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    # غیرفعال‌شده توسط sync (غایب از کاتالوگ)؛ فقط همین‌ها با بازگشت به کاتالوگ دوباره فعال می‌شوند
+    deactivated_by_sync = models.BooleanField(default=False, editable=False)
     
     def __str__(self):
         return f"{self.display_name} ({self.provider.name})"
@@ -98,7 +103,7 @@ class ModelUsageLog(models.Model):
     
     # اطلاعات درخواست
     tokens_used = models.IntegerField(default=0)
-    request_timestamp = models.DateTimeField(auto_now_add=True)
+    request_timestamp = models.DateTimeField(default=timezone.now)  # زمان واقعی درخواست؛ نوشتن دسته‌ای با تأخیر است
     response_time_ms = models.IntegerField(null=True, blank=True)
     
     # وضعیت
@@ -110,4 +115,77 @@ class ModelUsageLog(models.Model):
         indexes = [
             models.Index(fields=['user', 'model', 'request_timestamp']),
             models.Index(fields=['session_key', 'model', 'request_timestamp']),
-        ]
\ No newline at end of file
+        ]
+
+class ModelUsageRollup(models.Model):
+    """
+    جمع‌بندی ساعتی/روزانهٔ ModelUsageLog برای هر (مدل، کاربر/نشست)؛ به‌صورت افزایشی توسط
+    rollup_usage_logs نگه داشته می‌شود. ردیف‌های subject='*' جمع کل مدل در آن بازه‌اند.
+    """
+    class Granularity(models.TextChoices):
+        HOUR = 'hour', 'ساعتی'
+        DAY = 'day', 'روزانه'
+
+    # مرزهای بالای هیستوگرام تأخیر (میلی‌ثانیه)؛ خانهٔ آخر latency_histogram برای بیشتر از آخرین مرز است
+    LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+    ALL_SUBJECTS = '*'
+
+    granularity = models.CharField(max_length=4, choices=Granularity.choices)
+    bucket_start = models.DateTimeField()
+    model = models.ForeignKey(AIModel, on_delete=models.CASCADE)
+    # u:<user_id> / s:<session_key> / '*'؛ فیلد یکتا (NULL در قید یکتایی برابر حساب نمی‌شود)
+    subject = models.CharField(max_length=110)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    session_key = models.CharField(max_length=100, blank=True, default='')
+
+    request_count = models.PositiveIntegerField(default=0)
+    success_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+    tokens_used = models.BigIntegerField(default=0)
+    latency_count = models.PositiveIntegerField(default=0)
+    latency_sum_ms = models.BigIntegerField(default=0)
+    latency_histogram = models.JSONField(default=list)
+
+    class Meta:
+        db_table = 'model_usage_rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'bucket_start', 'model', 'subject'], name='uniq_usage_rollup_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['model', 'subject', 'granularity', 'bucket_start']),
+            models.Index(fields=['user', 'granularity', 'bucket_start']),
+        ]
+
+
+class UsageRollupCheckpoint(models.Model):
+    """آخرین شناسهٔ ModelUsageLog که در rollupها اعمال شده (هم‌تراکنش با به‌روزرسانی rollupها)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_log_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'model_usage_rollup_checkpoints'
+
+
+class TokenQuotaUsage(models.Model):
+    """پشتیبان دوره‌ای شمارنده‌های سهمیهٔ توکن در Redis (apps/models/services/quotas.py)"""
+    class Period(models.TextChoices):
+        DAY = 'day', 'روزانه'
+        MONTH = 'month', 'ماهانه'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    model = models.ForeignKey(AIModel, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=Period.choices)
+    period_start = models.DateField()
+    tokens_used = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'token_quota_usage'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'model', 'period', 'period_start'], name='uniq_token_quota_period',
+            ),
+        ]
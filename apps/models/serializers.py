@@ -44,15 +44,14 @@ class UserModelSelectionSerializer(serializers.Serializer):
     
     def validate_model_id(self, value):
         """اعتبارسنجی model_id"""
-        try:
-            model = AIModel.objects.get(model_id=value, is_active=True)
-        except AIModel.DoesNotExist:
+        from .services.model_manager import model_manager
+        
+        if model_manager.get_model_by_id(value) is None:
             raise serializers.ValidationError("مدل یافت نشد یا غیرفعال است.")
         
         # بررسی دسترسی کاربر
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            from .services.model_manager import model_manager
             if not model_manager.check_user_model_access(request.user, value):
                 raise serializers.ValidationError("شما به این مدل دسترسی ندارید.")
         
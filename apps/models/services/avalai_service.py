@@ -1,76 +1,121 @@
-import requests
 import logging
-from typing import List, Dict, Optional
+import time
+from typing import List, Dict, Optional, Tuple
+
+import httpx
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.core.cache import cache
-from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
 class AvalAIService:
-    """سرویس ارتباط با AvalAI API"""
+    """
+    سرویس ارتباط با AvalAI API
+    
+    کاتالوگ با درخواست شرطی (If-None-Match / If-Modified-Since) دریافت و به شکل
+    {models, etag, last_modified, fetched_at} در کش نگه داشته می‌شود:
+    - کمتر از CACHE_TIMEOUT: تازه، مستقیم از کش
+    - بیشتر از آن (تا STALE_TTL): دادهٔ کهنه برگردانده و بازاعتبارسنجی در پس‌زمینه (تسک
+      refresh_catalog_task زیر قفل توزیع‌شده) زمان‌بندی می‌شود (stale-while-revalidate)
+    - پاسخ 304 فقط زمان دریافت را تازه می‌کند؛ خطای upstream دادهٔ کهنه را حفظ می‌کند.
+    """
     
     def __init__(self):
-        self.api_url = getattr(settings, 'MODEL_SETTINGS', {}).get(
+        model_settings = getattr(settings, 'MODEL_SETTINGS', {})
+        self.api_url = model_settings.get(
             'AVALAI_API_URL', 
             'https://api.avalai.ir/public/models'
         )
-        self.cache_timeout = getattr(settings, 'MODEL_SETTINGS', {}).get(
-            'CACHE_TIMEOUT', 
-            300
-        )
-        self.cache_key = 'avalai_models_list'
+        self.cache_timeout = model_settings.get('CACHE_TIMEOUT', 300)
+        self.stale_ttl = model_settings.get('STALE_TTL', 86400)
+        self.fetch_timeout = model_settings.get('FETCH_TIMEOUT', 10)
+        self.cache_key = 'avalai_models_catalog'
+        self.revalidate_flag_key = 'avalai_models_revalidate_scheduled'
     
     def fetch_models(self, force_refresh: bool = False) -> List[Dict]:
         """
         دریافت لیست مدل‌ها از AvalAI
         
         Args:
-            force_refresh: اجبار به دریافت جدید (نادیده گرفتن کش)
+            force_refresh: بازاعتبارسنجی همگام (فقط برای sync دستی/تسک‌ها، نه مسیر درخواست کاربر)
             
         Returns:
             List[Dict]: لیست مدل‌ها
         """
-        # چک کردن کش
-        if not force_refresh:
-            cached_models = cache.get(self.cache_key)
-            if cached_models:
-                logger.info("📋 Models loaded from cache")
-                return cached_models
+        entry = cache.get(self.cache_key)
+        if entry and not force_refresh:
+            if time.time() - entry['fetched_at'] >= self.cache_timeout:
+                logger.info("📋 Serving stale models catalog; scheduling revalidation")
+                self.schedule_revalidate()
+            return entry['models']
+        
+        models, _changed = self.revalidate()
+        return models
+    
+    def schedule_revalidate(self, force_sync: bool = False) -> None:
+        """زمان‌بندی بازاعتبارسنجی در پس‌زمینه؛ درخواست‌های هم‌زمان فقط یک تسک صف می‌کنند"""
+        if not cache.add(self.revalidate_flag_key, 1, 300):
+            return
+        from apps.models.tasks import refresh_catalog_task
+        try:
+            refresh_catalog_task.delay(force_sync=force_sync)
+        except Exception as e:
+            cache.delete(self.revalidate_flag_key)
+            logger.warning(f"⚠️ Could not schedule catalog revalidation: {str(e)}")
+    
+    def revalidate(self) -> Tuple[List[Dict], bool]:
+        """نسخهٔ همگام arevalidate برای تسک‌ها و دستورات مدیریتی"""
+        return async_to_sync(self.arevalidate)()
+    
+    async def arevalidate(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> Tuple[List[Dict], bool]:
+        """
+        درخواست شرطی به AvalAI.
+        
+        Returns:
+            (models, changed): changed فقط وقتی True است که پاسخ 200 با کاتالوگ معتبر آمده باشد
+        """
+        entry = await cache.aget(self.cache_key)
+        stale = entry['models'] if entry else []
+        headers = {
+            'User-Agent': 'Pyamooz-AI/1.0',
+            'Accept': 'application/json'
+        }
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
         
         try:
-            logger.info("🔍 Fetching models from AvalAI API...")
+            logger.info("🔍 Revalidating models catalog from AvalAI API...")
+            async with httpx.AsyncClient(timeout=self.fetch_timeout, transport=transport) as client:
+                response = await client.get(self.api_url, headers=headers)
             
-            response = requests.get(
-                self.api_url,
-                timeout=30,
-                headers={
-                    'User-Agent': 'Pyamooz-AI/1.0',
-                    'Accept': 'application/json'
-                }
-            )
+            if response.status_code == 304 and entry:
+                entry['fetched_at'] = time.time()
+                await cache.aset(self.cache_key, entry, self.stale_ttl)
+                logger.info("📋 Models catalog not modified (304)")
+                return stale, False
             
             response.raise_for_status()
             data = response.json()
-            
-            if data.get('object') == 'list' and 'data' in data:
-                models = data['data']
-                
-                # ذخیره در کش
-                cache.set(self.cache_key, models, self.cache_timeout)
-                
-                logger.info(f"✅ Successfully fetched {len(models)} models from AvalAI")
-                return models
-            else:
-                logger.error("❌ Invalid response format from AvalAI API")
-                return []
-                
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"❌ Error fetching models from AvalAI: {str(e)}")
-            return []
-        except Exception as e:
-            logger.error(f"❌ Unexpected error: {str(e)}")
-            return []
+            return stale, False
+        
+        if data.get('object') != 'list' or 'data' not in data:
+            logger.error("❌ Invalid response format from AvalAI API")
+            return stale, False
+        
+        models = data['data']
+        await cache.aset(self.cache_key, {
+            'models': models,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }, self.stale_ttl)
+        logger.info(f"✅ Successfully fetched {len(models)} models from AvalAI")
+        return models, True
     
     def get_model_by_id(self, model_id: str) -> Optional[Dict]:
         """
@@ -130,6 +175,9 @@ class AvalAIService:
         
         return free_models
     
+    def clear_revalidate_flag(self):
+        cache.delete(self.revalidate_flag_key)
+    
     def clear_cache(self):
         """پاک کردن کش مدل‌ها"""
         cache.delete(self.cache_key)
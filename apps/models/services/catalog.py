@@ -0,0 +1,240 @@
+"""
+اسنپ‌شات تغییرناپذیر کاتالوگ مدل‌ها در حافظهٔ هر پروسه.
+
+خواندن‌های داغ (لیست/جزئیات مدل، مدل انتخاب‌شده، اعتبارسنجی انتخاب و بررسی دسترسی) به‌جای
+کوئری روی AIModel از این اسنپ‌شات می‌خوانند:
+- فقط مدل‌های فعال (و providerهای فعال برای لیست providerها)، مرتب مثل Meta.ordering مدل (provider، display_name)
+- ایندکس بر اساس model_id، pk، tier و نام provider
+- قابلیت‌ها به‌صورت bitset (CAP_*) برای فیلتر بدون پیمایش فیلدها
+
+هماهنگی بین پروسه‌ها با یک شمارندهٔ نسخه در Redis (`catalog:version`) انجام می‌شود که sync و
+اکشن‌های ادمین آن را با bump_catalog_version() افزایش می‌دهند. هر پروسه حداکثر هر
+CATALOG_VERSION_CHECK_SECONDS یک GET روی Redis می‌زند و فقط با تغییر نسخه دوباره از DB می‌سازد.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.queueapp.redis_client import get_redis
+from ..models import AIModel, ModelProvider
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+
+CAP_VISION = 1
+CAP_FUNCTION_CALLING = 2
+CAP_TOOL_CHOICE = 4
+CAP_RESPONSE_SCHEMA = 8
+
+_CAPABILITY_FIELDS = (
+    ('supports_vision', CAP_VISION),
+    ('supports_function_calling', CAP_FUNCTION_CALLING),
+    ('supports_tool_choice', CAP_TOOL_CHOICE),
+    ('supports_response_schema', CAP_RESPONSE_SCHEMA),
+)
+
+
+@dataclass(frozen=True)
+class CatalogProvider:
+    id: int
+    name: str
+    display_name: str
+    is_active: bool
+
+
+@dataclass(frozen=True)
+class CatalogModel:
+    """نمای فقط‌خواندنی AIModel؛ سریالایزرهای مدل همان ویژگی‌ها را از آن می‌خوانند."""
+    id: int
+    model_id: str
+    display_name: str
+    provider: CatalogProvider
+    tier: str
+    capabilities: int
+    max_requests_per_minute: int
+    max_tokens_per_minute: int
+    max_tokens: int
+    max_input_tokens: int
+    max_output_tokens: int
+    pricing_data: Mapping[str, Any] = field(compare=False)
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    last_synced: Optional[datetime] = None
+    is_active: bool = True
+
+    @property
+    def supports_vision(self) -> bool:
+        return bool(self.capabilities & CAP_VISION)
+
+    @property
+    def supports_function_calling(self) -> bool:
+        return bool(self.capabilities & CAP_FUNCTION_CALLING)
+
+    @property
+    def supports_tool_choice(self) -> bool:
+        return bool(self.capabilities & CAP_TOOL_CHOICE)
+
+    @property
+    def supports_response_schema(self) -> bool:
+        return bool(self.capabilities & CAP_RESPONSE_SCHEMA)
+
+    @property
+    def is_premium(self) -> bool:
+        return self.tier in (AIModel.ModelTier.PREMIUM, AIModel.ModelTier.ENTERPRISE)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    models: Tuple[CatalogModel, ...]
+    providers: Tuple[CatalogProvider, ...]
+    by_model_id: Mapping[str, CatalogModel]
+    by_id: Mapping[int, CatalogModel]
+    by_tier: Mapping[str, Tuple[CatalogModel, ...]]
+    by_provider: Mapping[str, Tuple[CatalogModel, ...]]
+    built_at: float
+
+    def get(self, model_id: str) -> Optional[CatalogModel]:
+        return self.by_model_id.get(model_id)
+
+    def filter(self, models: Optional[Tuple[CatalogModel, ...]] = None, tier: Optional[str] = None,
+               provider: Optional[str] = None, capabilities: int = 0) -> Tuple[CatalogModel, ...]:
+        """
+        فیلتر روی ایندکس‌ها؛ models (مثلاً مدل‌های در دسترس کاربر) دامنه را محدود می‌کند و
+        capabilities ماسکی از CAP_* است که همهٔ بیت‌هایش باید روشن باشند.
+        """
+        if tier:
+            candidates = self.by_tier.get(tier, ())
+        elif provider:
+            candidates = self.by_provider.get(provider, ())
+        else:
+            candidates = self.models if models is None else models
+        allowed = None if models is None else {m.id for m in models}
+        return tuple(
+            m for m in candidates
+            if (allowed is None or m.id in allowed)
+            and (not provider or m.provider.name == provider)
+            and (not tier or m.tier == tier)
+            and (m.capabilities & capabilities) == capabilities
+        )
+
+
+def capability_mask(**flags: bool) -> int:
+    """capability_mask(supports_vision=True, ...) → bitset"""
+    return sum(bit for name, bit in _CAPABILITY_FIELDS if flags.get(name))
+
+
+def _build(version: int) -> CatalogSnapshot:
+    providers = {
+        p.id: CatalogProvider(p.id, p.name, p.display_name, p.is_active)
+        for p in ModelProvider.objects.all()
+    }
+    models = []
+    for m in AIModel.objects.filter(is_active=True).order_by('provider__name', 'display_name'):
+        models.append(CatalogModel(
+            id=m.id,
+            model_id=m.model_id,
+            display_name=m.display_name,
+            provider=providers[m.provider_id],
+            tier=m.tier,
+            capabilities=sum(bit for name, bit in _CAPABILITY_FIELDS if getattr(m, name)),
+            max_requests_per_minute=m.max_requests_per_minute,
+            max_tokens_per_minute=m.max_tokens_per_minute,
+            max_tokens=m.max_tokens,
+            max_input_tokens=m.max_input_tokens,
+            max_output_tokens=m.max_output_tokens,
+            pricing_data=MappingProxyType(dict(m.pricing_data or {})),
+            created_at=m.created_at,
+            updated_at=m.updated_at,
+            last_synced=m.last_synced,
+        ))
+    by_tier: Dict[str, list] = {}
+    by_provider: Dict[str, list] = {}
+    for m in models:
+        by_tier.setdefault(m.tier, []).append(m)
+        by_provider.setdefault(m.provider.name, []).append(m)
+    return CatalogSnapshot(
+        version=version,
+        models=tuple(models),
+        providers=tuple(sorted((p for p in providers.values() if p.is_active), key=lambda p: p.name)),
+        by_model_id=MappingProxyType({m.model_id: m for m in models}),
+        by_id=MappingProxyType({m.id: m for m in models}),
+        by_tier=MappingProxyType({k: tuple(v) for k, v in by_tier.items()}),
+        by_provider=MappingProxyType({k: tuple(v) for k, v in by_provider.items()}),
+        built_at=time.monotonic(),
+    )
+
+
+def _read_version() -> Optional[int]:
+    client = get_redis()
+    try:
+        value = client.get(VERSION_KEY) if client is not None else cache.get(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read catalog version: {str(e)}")
+        return None
+    return int(value or 0)
+
+
+def bump_catalog_version() -> None:
+    """بعد از commit تراکنش جاری نسخه را افزایش می‌دهد تا همهٔ پروسه‌ها اسنپ‌شات را بازسازی کنند."""
+    transaction.on_commit(_bump_now)
+
+
+def _bump_now() -> None:
+    client = get_redis()
+    try:
+        if client is not None:
+            client.incr(VERSION_KEY)
+        else:
+            cache.add(VERSION_KEY, 0, None)
+            cache.incr(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not bump catalog version: {str(e)}")
+    # همین پروسه منتظر دورهٔ بررسی نماند
+    _state['checked_at'] = 0.0
+
+
+_state: Dict[str, Any] = {'snapshot': None, 'checked_at': 0.0}
+_lock = threading.Lock()
+
+
+def get_catalog() -> CatalogSnapshot:
+    """اسنپ‌شات جاری؛ در حالت پایدار بدون هیچ I/O (جز یک GET دوره‌ای نسخه روی Redis)."""
+    snapshot = _state['snapshot']
+    now = time.monotonic()
+    check_every = getattr(settings, 'CATALOG_VERSION_CHECK_SECONDS', 1.0)
+    if snapshot is not None and now - _state['checked_at'] < check_every:
+        return snapshot
+
+    with _lock:
+        snapshot = _state['snapshot']
+        if snapshot is not None and now - _state['checked_at'] < check_every:
+            return snapshot
+        version = _read_version()
+        max_age = getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', 300)
+        stale = snapshot is None or (
+            # بدون دسترسی به نسخه (یا cache محلی بدون Redis) اسنپ‌شات حداکثر max_age ثانیه می‌ماند
+            (version is None or get_redis() is None) and now - snapshot.built_at > max_age
+        )
+        if stale or (version is not None and version != snapshot.version):
+            snapshot = _build(version or 0)
+            _state['snapshot'] = snapshot
+            logger.info(f"📦 Catalog snapshot v{snapshot.version} built: {len(snapshot.models)} models")
+        _state['checked_at'] = now
+        return snapshot
+
+
+def invalidate_local() -> None:
+    """دور ریختن اسنپ‌شات همین پروسه (تست‌ها)"""
+    with _lock:
+        _state['snapshot'] = None
+        _state['checked_at'] = 0.0
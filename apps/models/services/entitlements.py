@@ -0,0 +1,104 @@
+"""
+مجموعهٔ از پیش محاسبه‌شدهٔ مدل‌های مجاز هر کاربر (entitlements).
+
+مجموعه = شناسهٔ مدل‌های فعال رایگان ∪ مدل‌های فعالی که مجوز فعال و منقضی‌نشده دارند (برای ادمین
+همهٔ مدل‌های فعال). نتیجه در cache با کلید نسخه‌دار نگه داشته می‌شود:
+
+    model_entitlements:{catalog_version}:{user_id}:{user_version}
+
+- تغییر AIModel/ModelProvider نسخهٔ کاتالوگ را بالا می‌برد (apps/models/signals.py)؛
+- تغییر UserModelPermission نسخهٔ همان کاربر را بالا می‌برد؛
+پس هیچ کلیدی پاک نمی‌شود و کلیدهای قدیمی با TTL خودشان می‌میرند. TTL هرگز از نزدیک‌ترین
+expires_at مجوزهای کاربر بیشتر نیست تا انقضا بدون سیگنال هم اعمال شود.
+
+شمارندهٔ نسخهٔ کاربر مثل `catalog:version` در Redis است تا bump در یک پروسه برای همهٔ
+workerها دیده شود (cache پیش‌فرض LocMem و محلی است)؛ بدون Redis به cache برمی‌گردد.
+"""
+import logging
+from typing import FrozenSet, Optional, TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.queueapp.redis_client import get_redis
+from ..models import AIModel, UserModelPermission
+from .catalog import get_catalog
+
+if TYPE_CHECKING:
+    from django.contrib.auth.models import AbstractUser
+
+logger = logging.getLogger(__name__)
+
+_USER_VERSION_KEY = 'model_entitlements_version:{}'
+_SET_KEY = 'model_entitlements:{}:{}:{}'
+
+
+# عمر شمارندهٔ نسخه بعد از آخرین bump؛ باید از MODEL_ENTITLEMENTS_TTL بیشتر باشد تا با انقضای آن
+# (بازگشت به ۰) هیچ مجموعهٔ قدیمی با همان نسخه هنوز در cache نمانده باشد
+_USER_VERSION_TTL = 86400
+
+
+def _user_version(user_id: int) -> Optional[int]:
+    """None یعنی نسخه خواندنی نیست؛ مجموعه بدون cache محاسبه می‌شود"""
+    key = _USER_VERSION_KEY.format(user_id)
+    client = get_redis()
+    try:
+        value = client.get(key) if client is not None else cache.get(key)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read entitlements version for user {user_id}: {str(e)}")
+        return None
+    return int(value or 0)
+
+
+def bump_user_entitlements(user_id: int) -> None:
+    """بعد از تغییر مجوزهای کاربر؛ کلید قبلی در هیچ پروسه‌ای دیگر خوانده نمی‌شود"""
+    key = _USER_VERSION_KEY.format(user_id)
+    client = get_redis()
+    try:
+        if client is not None:
+            client.pipeline().incr(key).expire(key, _USER_VERSION_TTL).execute()
+        else:
+            cache.add(key, 0, _USER_VERSION_TTL)
+            cache.incr(key)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not bump entitlements version for user {user_id}: {str(e)}")
+
+
+def get_entitlements(user: Optional['AbstractUser']) -> FrozenSet[int]:
+    """شناسهٔ (pk) مدل‌های فعالی که کاربر به آن‌ها دسترسی دارد"""
+    catalog = get_catalog()
+    free_ids = frozenset(m.id for m in catalog.by_tier.get(AIModel.ModelTier.FREE, ()))
+    if not user or not user.is_authenticated:
+        return free_ids
+    if user.is_superuser:
+        return frozenset(catalog.by_id)
+
+    version = _user_version(user.pk)
+    key = _SET_KEY.format(catalog.version, user.pk, version)
+    cached = cache.get(key) if version is not None else None
+    if cached is not None:
+        return cached
+
+    now = timezone.now()
+    grants = list(
+        UserModelPermission.objects.filter(user=user, is_active=True)
+        .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+        .values_list('model_id', 'expires_at')
+    )
+    entitled = free_ids | frozenset(model_id for model_id, _ in grants if model_id in catalog.by_id)
+
+    ttl = getattr(settings, 'MODEL_ENTITLEMENTS_TTL', 300)
+    expiries = [expires_at for _, expires_at in grants if expires_at is not None]
+    if expiries:
+        ttl = max(1, min(ttl, int((min(expiries) - now).total_seconds())))
+    if version is not None:
+        cache.set(key, entitled, ttl)
+    return entitled
+
+
+def has_model_access(user: Optional['AbstractUser'], model_id: str) -> bool:
+    """بررسی دسترسی با یک lookup در اسنپ‌شات و یک عضویت در مجموعه"""
+    model = get_catalog().get(model_id)
+    return model is not None and model.id in get_entitlements(user)
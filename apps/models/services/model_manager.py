@@ -1,12 +1,18 @@
+import hashlib
+import json
 import logging
-from typing import List, Dict, Optional, TYPE_CHECKING
+from typing import List, Dict, Optional, Set, Tuple, TYPE_CHECKING
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Sum, QuerySet
+from django.db.models import QuerySet
 from datetime import timedelta
 
-from ..models import AIModel, ModelProvider, UserModelPermission, ModelUsageLog
+from ..models import AIModel, ModelProvider, ModelUsageRollup
 from .avalai_service import avalai_service
+from .catalog import CatalogModel, bump_catalog_version, get_catalog
+from .entitlements import get_entitlements, has_model_access
+from .usage_rollup import usage_totals
 
 # Type checking imports
 if TYPE_CHECKING:
@@ -18,6 +24,15 @@ logger = logging.getLogger(__name__)
 class ModelManager:
     """مدیر اصلی مدل‌ها"""
     
+    # فیلدهایی که از کاتالوگ می‌آیند و در upsert بازنویسی می‌شوند
+    SYNCED_FIELDS = [
+        'display_name', 'provider', 'tier', 'is_active',
+        'max_requests_per_minute', 'max_tokens_per_minute', 'max_tokens',
+        'max_input_tokens', 'max_output_tokens',
+        'supports_vision', 'supports_function_calling', 'supports_tool_choice', 'supports_response_schema',
+        'pricing_data', 'metadata', 'content_hash', 'deactivated_by_sync', 'last_synced', 'updated_at',
+    ]
+
     def sync_models_from_avalai(self, force_refresh: bool = False) -> Dict:
         """
         همگام‌سازی مدل‌ها از AvalAI
@@ -37,18 +52,10 @@ class ModelManager:
             return {
                 'success': False,
                 'message': 'Failed to fetch models from AvalAI',
-                'stats': {'total': 0, 'created': 0, 'updated': 0, 'errors': 0}
+                'stats': {'total': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'deactivated': 0, 'errors': 0}
             }
         
-        stats = {'total': len(avalai_models), 'created': 0, 'updated': 0, 'errors': 0}
-        
-        for model_data in avalai_models:
-            try:
-                self._sync_single_model(model_data, stats)
-            except Exception as e:
-                logger.error(f"❌ Error syncing model {model_data.get('id', 'unknown')}: {str(e)}")
-                stats['errors'] += 1
-        
+        stats = self.sync_catalog(avalai_models)
         logger.info(f"✅ Model sync completed: {stats}")
         
         return {
@@ -57,105 +64,124 @@ class ModelManager:
             'stats': stats
         }
     
-    def _sync_single_model(self, model_data: Dict, stats: Dict):
-        """همگام‌سازی یک مدل با مدیریت مقادیر NULL"""
-        model_id = model_data.get('id')
-        if not model_id:
-            return
-        
-        # پیدا کردن یا ایجاد provider
-        provider_name = model_data.get('owned_by', 'unknown')
-        provider, created = ModelProvider.objects.get_or_create(
-            name=provider_name,
-            defaults={
-                'display_name': provider_name.title(),
-                'is_active': True
-            }
-        )
-        
-        # تعیین tier بر اساس قیمت و محدودیت‌ها
-        tier = self._determine_model_tier(model_data)
+    def sync_catalog(self, catalog: List[Dict], deactivate_missing: bool = True, force: bool = False) -> Dict:
+        """
+        همگام‌سازی مجموعه‌ای (set-based) کاتالوگ با جدول مدل‌ها.
         
-        # آماده‌سازی محدودیت‌ها با مقادیر پیش‌فرض
-        limits = {
-            'max_requests_per_minute': model_data.get('max_requests_per_1_minute') or 60,
-            'max_tokens_per_minute': model_data.get('max_tokens_per_1_minute') or 150000,
-            'max_tokens': model_data.get('max_tokens') or 4096,
-            'max_input_tokens': model_data.get('max_input_tokens') or 4096,
-            'max_output_tokens': model_data.get('max_output_tokens') or 4096,
-        }
+        - providerها و مدل‌های موجود هر کدام با یک کوئری خوانده می‌شوند.
+        - برای هر مدخل هش محتوا حساب می‌شود؛ مدل‌های بدون تغییر فقط last_synced می‌گیرند.
+        - تغییرات با یک bulk_create(update_conflicts=True) روی model_id نوشته می‌شوند.
+        - مدل‌هایی که دیگر در کاتالوگ نیستند غیرفعال می‌شوند (deactivate_missing) و با بازگشت به
+          کاتالوگ دوباره فعال می‌شوند؛ is_active مدلی که ادمین غیرفعال کرده دست نمی‌خورد.
+        همه در یک تراکنش؛ تعداد کوئری مستقل از اندازهٔ کاتالوگ است.
         
-        # آماده‌سازی قابلیت‌ها
-        capabilities = {
-            'supports_vision': model_data.get('supports_vision', False),
-            'supports_function_calling': model_data.get('supports_function_calling', False),
-            'supports_tool_choice': model_data.get('supports_tool_choice', False),
-            'supports_response_schema': model_data.get('supports_response_schema', False),
+        Args:
+            catalog: لیست مدل‌ها با همان فرمت پاسخ AvalAI
+            deactivate_missing: غیرفعال کردن مدل‌های غایب از کاتالوگ
+            force: نادیده گرفتن هش و بازنویسی همهٔ مدخل‌ها
+        """
+        entries = {m['id']: m for m in catalog if m.get('id')}
+        stats = {
+            'total': len(catalog), 'created': 0, 'updated': 0, 'unchanged': 0,
+            'deactivated': 0, 'errors': len(catalog) - len(entries),
         }
+        now = timezone.now()
         
-        # پیدا کردن یا ایجاد مدل
-        model, created = AIModel.objects.get_or_create(
-            model_id=model_id,
-            defaults={
-                'display_name': self._generate_display_name(model_data),
-                'provider': provider,
-                'tier': tier,
-                'is_active': True,
-                'pricing_data': model_data.get('pricing', {}),
-                'metadata': model_data,
-                'last_synced': timezone.now(),
-                **limits,
-                **capabilities
+        with transaction.atomic():
+            providers = self._ensure_providers({m.get('owned_by') or 'unknown' for m in entries.values()})
+            existing = {
+                row['model_id']: row
+                for row in AIModel.objects.values('id', 'model_id', 'content_hash', 'is_active', 'deactivated_by_sync')
             }
-        )
-        
-        if created:
-            stats['created'] += 1
-            return
-        
-        # به‌روزرسانی مدل موجود
-        updated_fields = []
-        
-        # به‌روزرسانی فیلدهای اصلی
-        new_display_name = self._generate_display_name(model_data)
-        if model.display_name != new_display_name:
-            model.display_name = new_display_name
-            updated_fields.append('display_name')
-        
-        if model.tier != tier:
-            model.tier = tier
-            updated_fields.append('tier')
-        
-        # به‌روزرسانی محدودیت‌ها
-        for field, value in limits.items():
-            if getattr(model, field) != value:
-                setattr(model, field, value)
-                updated_fields.append(field)
-        
-        # به‌روزرسانی قابلیت‌ها
-        for field, value in capabilities.items():
-            if getattr(model, field) != value:
-                setattr(model, field, value)
-                updated_fields.append(field)
-        
-        # به‌روزرسانی قیمت‌گذاری و متادیتا
-        new_pricing = model_data.get('pricing', {})
-        if model.pricing_data != new_pricing:
-            model.pricing_data = new_pricing
-            updated_fields.append('pricing_data')
-        
-        if model.metadata != model_data:
-            model.metadata = model_data
-            updated_fields.append('metadata')
-        
-        # زمان آخرین همگام‌سازی
-        model.last_synced = timezone.now()
-        updated_fields.append('last_synced')
+            
+            to_write = []
+            unchanged_ids = []
+            for model_id, model_data in entries.items():
+                try:
+                    content_hash = self._content_hash(model_data)
+                    current = existing.get(model_id)
+                    if (current and not force and not current['deactivated_by_sync']
+                            and current['content_hash'] == content_hash):
+                        unchanged_ids.append(current['id'])
+                        continue
+                    provider = providers[model_data.get('owned_by') or 'unknown']
+                    # مدل جدید یا غیرفعال‌شده توسط خود sync فعال می‌شود؛ بقیه وضعیت ذخیره‌شده را نگه می‌دارند
+                    is_active = current is None or current['deactivated_by_sync'] or current['is_active']
+                    to_write.append(self._build_model(model_data, provider, content_hash, now, is_active))
+                    stats['updated' if current else 'created'] += 1
+                except Exception as e:
+                    logger.error(f"❌ Error syncing model {model_id}: {str(e)}")
+                    stats['errors'] += 1
+            
+            if to_write:
+                AIModel.objects.bulk_create(
+                    to_write,
+                    batch_size=500,
+                    update_conflicts=True,
+                    unique_fields=['model_id'],
+                    update_fields=self.SYNCED_FIELDS,
+                )
+            if unchanged_ids:
+                AIModel.objects.filter(id__in=unchanged_ids).update(last_synced=now)
+            stats['unchanged'] = len(unchanged_ids)
+            
+            if deactivate_missing:
+                missing_ids = [
+                    row['id'] for model_id, row in existing.items()
+                    if row['is_active'] and model_id not in entries
+                ]
+                if missing_ids:
+                    stats['deactivated'] = AIModel.objects.filter(id__in=missing_ids).update(
+                        is_active=False, deactivated_by_sync=True, updated_at=now
+                    )
+            
+            if to_write or stats['deactivated']:
+                bump_catalog_version()
         
-        # ذخیره تغییرات
-        if updated_fields:
-            model.save(update_fields=updated_fields)
-            stats['updated'] += 1
+        return stats
+    
+    def _ensure_providers(self, names: Set[str]) -> Dict[str, ModelProvider]:
+        """providerهای لازم: یک SELECT و در صورت نیاز یک INSERT دسته‌ای"""
+        providers = {p.name: p for p in ModelProvider.objects.filter(name__in=names)}
+        missing = names - providers.keys()
+        if missing:
+            ModelProvider.objects.bulk_create(
+                [ModelProvider(name=name, display_name=name.title(), is_active=True) for name in missing],
+                ignore_conflicts=True,
+            )
+            providers.update({p.name: p for p in ModelProvider.objects.filter(name__in=missing)})
+        return providers
+    
+    @staticmethod
+    def _content_hash(model_data: Dict) -> str:
+        """هش پایدار مدخل کاتالوگ (کلیدها مرتب) برای تشخیص تغییر بدون مقایسهٔ فیلد به فیلد"""
+        payload = json.dumps(model_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _build_model(self, model_data: Dict, provider: ModelProvider, content_hash: str, now,
+                     is_active: bool = True) -> AIModel:
+        """نمونهٔ ذخیره‌نشدهٔ AIModel برای upsert (مقادیر NULL کاتالوگ با پیش‌فرض‌ها جایگزین می‌شوند)"""
+        return AIModel(
+            model_id=model_data['id'],
+            display_name=self._generate_display_name(model_data),
+            provider=provider,
+            tier=self._determine_model_tier(model_data),
+            is_active=is_active,
+            deactivated_by_sync=False,
+            max_requests_per_minute=model_data.get('max_requests_per_1_minute') or 60,
+            max_tokens_per_minute=model_data.get('max_tokens_per_1_minute') or 150000,
+            max_tokens=model_data.get('max_tokens') or 4096,
+            max_input_tokens=model_data.get('max_input_tokens') or 4096,
+            max_output_tokens=model_data.get('max_output_tokens') or 4096,
+            supports_vision=bool(model_data.get('supports_vision', False)),
+            supports_function_calling=bool(model_data.get('supports_function_calling', False)),
+            supports_tool_choice=bool(model_data.get('supports_tool_choice', False)),
+            supports_response_schema=bool(model_data.get('supports_response_schema', False)),
+            pricing_data=model_data.get('pricing') or {},
+            metadata=model_data,
+            content_hash=content_hash,
+            last_synced=now,
+        )
     
     def _determine_model_tier(self, model_data: Dict) -> str:
         """تعیین tier مدل بر اساس متادیتا"""
@@ -216,28 +242,8 @@ class ModelManager:
         else:
             base_qs = AIModel.objects.filter(is_active=True)
         
-        if user and user.is_authenticated:
-            # کاربر لاگین شده
-            if user.is_superuser:
-                # ادمین: همه مدل‌ها
-                return base_qs.order_by('provider__name', 'display_name')
-            else:
-                # کاربر عادی: مدل‌های مجاز + رایگان
-                user_models = base_qs.filter(
-                    usermodelpermission__user=user,
-                    usermodelpermission__is_active=True
-                ).distinct()
-                
-                free_models = base_qs.filter(
-                    tier=AIModel.ModelTier.FREE
-                )
-                
-                return (user_models | free_models).distinct().order_by('provider__name', 'display_name')
-        else:
-            # کاربر مهمان: فقط مدل‌های رایگان
-            return base_qs.filter(
-                tier=AIModel.ModelTier.FREE
-            ).order_by('provider__name', 'display_name')
+        # مجموعهٔ entitlement (رایگان ∪ مجوزهای معتبر) از cache؛ به‌جای OR دو QuerySet با distinct
+        return base_qs.filter(id__in=get_entitlements(user)).order_by('provider__name', 'display_name')
     
     # <<<<<<<<<<<<<<< [تغییر کلیدی] این متد هم حالا QuerySet برمی‌گرداند >>>>>>>>>>>>>>>
     def get_models_by_tier(self, tier: str) -> QuerySet:
@@ -255,20 +261,28 @@ class ModelManager:
             tier=tier
         ).order_by('provider__name', 'display_name')
     
-    def get_model_by_id(self, model_id: str) -> Optional[AIModel]:
+    def available_models(self, user: Optional['AbstractUser'] = None) -> Tuple[CatalogModel, ...]:
+        """
+        مدل‌های در دسترس کاربر از اسنپ‌شات کاتالوگ (همان قواعد get_available_models_for_user،
+        بدون کوئری روی AIModel)
+        """
+        catalog = get_catalog()
+        if user and user.is_authenticated and user.is_superuser:
+            return catalog.models
+        entitled = get_entitlements(user)
+        return tuple(m for m in catalog.models if m.id in entitled)
+    
+    def get_model_by_id(self, model_id: str) -> Optional[CatalogModel]:
         """
-        دریافت مدل بر اساس model_id
+        دریافت مدل فعال بر اساس model_id (از اسنپ‌شات کاتالوگ)
         
         Args:
             model_id: شناسه مدل
             
         Returns:
-            AIModel یا None
+            CatalogModel یا None
         """
-        try:
-            return AIModel.objects.get(model_id=model_id, is_active=True)
-        except AIModel.DoesNotExist:
-            return None
+        return get_catalog().get(model_id)
     
     def check_user_model_access(self, user: Optional['AbstractUser'], model_id: str) -> bool:
         """
@@ -281,28 +295,7 @@ class ModelManager:
         Returns:
             bool: آیا کاربر دسترسی دارد یا نه
         """
-        model = self.get_model_by_id(model_id)
-        if not model:
-            return False
-        
-        # مدل‌های رایگان برای همه قابل دسترس هستند
-        if model.tier == AIModel.ModelTier.FREE:
-            return True
-        
-        # کاربران مهمان فقط به مدل‌های رایگان دسترسی دارند
-        if not user or not user.is_authenticated:
-            return False
-        
-        # ادمین‌ها به همه مدل‌ها دسترسی دارند
-        if user.is_superuser:
-            return True
-        
-        # بررسی مجوز خاص کاربر
-        return UserModelPermission.objects.filter(
-            user=user,
-            model=model,
-            is_active=True
-        ).exists()
+        return has_model_access(user, model_id)
     
     def get_model_usage_stats(self, model_id: str, days: int = 7) -> Dict:
         """
@@ -319,28 +312,25 @@ class ModelManager:
         if not model:
             return {'error': 'Model not found'}
         
-        from_date = timezone.now() - timedelta(days=days)
-        
-        logs = ModelUsageLog.objects.filter(
-            model=model,
-            request_timestamp__gte=from_date
-        )
-        
-        total_requests = logs.count()
-        successful_requests = logs.filter(success=True).count()
-        total_tokens = logs.aggregate(
-            total=Sum('tokens_used')  # ✅ تصحیح شده
-        )['total'] or 0
-        
+        # از rollupهای از پیش جمع‌شده (usage_rollup) خوانده می‌شود، نه اسکن لاگ خام
+        totals = usage_totals(model.id, timezone.now() - timedelta(days=days))
+        total_requests = totals['request_count']
+        successful_requests = totals['success_count']
+        total_tokens = totals['tokens_used']
+        latency_count = totals['latency_count']
+        bounds = [f"<={b}" for b in ModelUsageRollup.LATENCY_BUCKETS_MS] + [f">{ModelUsageRollup.LATENCY_BUCKETS_MS[-1]}"]
+
         return {
             'model_id': model_id,
             'period_days': days,
             'total_requests': total_requests,
             'successful_requests': successful_requests,
-            'failed_requests': total_requests - successful_requests,
+            'failed_requests': totals['failure_count'],
             'success_rate': (successful_requests / total_requests * 100) if total_requests > 0 else 0,
             'total_tokens_used': total_tokens,
-            'average_tokens_per_request': total_tokens / total_requests if total_requests > 0 else 0
+            'average_tokens_per_request': total_tokens / total_requests if total_requests > 0 else 0,
+            'average_response_time_ms': totals['latency_sum_ms'] / latency_count if latency_count > 0 else None,
+            'response_time_histogram_ms': dict(zip(bounds, totals['latency_histogram'])),
         }
 
 # Instance سراسری
@@ -0,0 +1,320 @@
+"""
+اعمال سهمیه‌های UserModelPermission: daily_limit / monthly_limit (توکن) و custom_rate_limit
+(درخواست در دقیقه) برای هر (کاربر، مدل).
+
+- قبل از تماس upstream، reserve_tokens() تخمین توکن‌ها را با یک اسکریپت Lua اتمیک رزرو می‌کند:
+  اگر سهمیهٔ روزانه/ماهانه تمام شده یا نرخ دقیقه پر باشد QuotaExceeded، وگرنه هر سه شمارنده با هم
+  بالا می‌روند. مسیر داغ = یک cache hit برای سقف‌ها + یک EVALSHA (زیر یک میلی‌ثانیه).
+- بعد از پایان تولید، settle_tokens() اختلاف مصرف واقعی و تخمین را (با کف صفر) اعمال می‌کند. در
+  مسیر صف (MessageCreateStreamView → worker) رزرو با hold_for_message کنار شناسهٔ پیام نگه داشته
+  و worker با settle_for_message تسویه می‌کند.
+- شمارنده‌های تغییرکرده در مجموعهٔ quota:dirty ثبت و هر QUOTA_PERSIST_INTERVAL ثانیه توسط
+  persist_quota_counters در TokenQuotaUsage نوشته می‌شوند. اگر Redis کلید را نداشته باشد (ری‌استارت
+  یا eviction) از همین جدول بازسازی می‌شود؛ پس از دست رفتن حداکثر به یک بازهٔ persist محدود است.
+- سقف‌های هر کاربر با همان نسخهٔ entitlement کاربر cache می‌شوند و با تغییر مجوزها باطل می‌شوند.
+- خطای Redis درخواست را رد نمی‌کند (fail-open)؛ سهمیه ابزار حسابداری است نه مرز امنیتی.
+
+مقدار «توکن» در این پروژه تعداد کاراکتر است (مثل Message.tokens_input/tokens_output و ModelUsageLog).
+"""
+import json
+import logging
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.queueapp.redis_client import get_redis
+from ..models import AIModel, TokenQuotaUsage, UserModelPermission
+from .entitlements import _user_version
+
+if TYPE_CHECKING:
+    from django.contrib.auth.models import AbstractUser
+
+logger = logging.getLogger(__name__)
+
+_LIMITS_KEY = 'model_quota_limits:{}:{}'
+_COUNTER_KEY = 'quota:{}:{}:{}:{}'
+_RATE_KEY = 'quota:{}:{}:rpm:{}'
+_HELD_KEY = 'quota:held:{}'
+DIRTY_KEY = 'quota:dirty'
+
+_DAY_TTL = 2 * 86400
+_MONTH_TTL = 35 * 86400
+_HELD_TTL = 86400
+
+# KEYS: day, month, minute, dirty — ARGV: estimate, daily, monthly, rpm (-1 = بدون سقف)
+_RESERVE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('EXISTS', KEYS[2]) == 0 then
+  return {-1, 'missing'}
+end
+local estimate = tonumber(ARGV[1])
+local daily, monthly, rpm = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+if daily >= 0 and tonumber(redis.call('GET', KEYS[1])) + estimate > daily then
+  return {0, 'daily'}
+end
+if monthly >= 0 and tonumber(redis.call('GET', KEYS[2])) + estimate > monthly then
+  return {0, 'monthly'}
+end
+if rpm >= 0 then
+  if tonumber(redis.call('GET', KEYS[3]) or '0') >= rpm then
+    return {0, 'rate'}
+  end
+  redis.call('INCR', KEYS[3])
+  redis.call('EXPIRE', KEYS[3], 60)
+end
+redis.call('INCRBY', KEYS[1], estimate)
+redis.call('INCRBY', KEYS[2], estimate)
+redis.call('SADD', KEYS[4], KEYS[1], KEYS[2])
+return {1, 'ok'}
+"""
+
+# KEYS: day, month, dirty — ARGV: delta (مصرف واقعی - تخمین)
+_SETTLE_LUA = """
+local delta = tonumber(ARGV[1])
+for i = 1, 2 do
+  if redis.call('EXISTS', KEYS[i]) == 1 and redis.call('INCRBY', KEYS[i], delta) < 0 then
+    redis.call('SET', KEYS[i], 0, 'KEEPTTL')
+  end
+end
+redis.call('SADD', KEYS[3], KEYS[1], KEYS[2])
+return 1
+"""
+
+_scripts: Dict[int, Tuple] = {}
+
+
+class QuotaExceeded(Exception):
+    """سهمیهٔ kind (daily / monthly / rate) برای این مدل تمام شده است"""
+
+    def __init__(self, kind: str, model_id: str):
+        self.kind = kind
+        self.model_id = model_id
+        super().__init__(f"{kind} quota exceeded for model {model_id}")
+
+
+@dataclass(frozen=True)
+class Reservation:
+    day_key: str
+    month_key: str
+    estimate: int
+
+    def to_json(self) -> str:
+        return json.dumps([self.day_key, self.month_key, self.estimate])
+
+    @classmethod
+    def from_json(cls, raw) -> 'Reservation':
+        return cls(*json.loads(raw))
+
+
+def _scripts_for(client) -> Tuple:
+    scripts = _scripts.get(id(client))
+    if scripts is None:
+        scripts = _scripts[id(client)] = (client.register_script(_RESERVE_LUA), client.register_script(_SETTLE_LUA))
+    return scripts
+
+
+def estimate_tokens(content: str) -> int:
+    """تخمین مصرف یک نوبت: ورودی + سقف پیش‌فرض خروجی (بعد از پاسخ با مقدار واقعی تسویه می‌شود)"""
+    return len(content or '') + getattr(settings, 'QUOTA_OUTPUT_ESTIMATE', 1000)
+
+
+def get_quota_limits(user: Optional['AbstractUser']) -> Dict[str, Tuple[int, int, int]]:
+    """model_id → (rpm، daily، monthly) فقط برای مجوزهای فعالی که حداقل یک سقف دارند؛ -1 یعنی بدون سقف"""
+    if not user or not user.is_authenticated:
+        return {}
+    version = _user_version(user.pk)
+    key = _LIMITS_KEY.format(user.pk, version)
+    cached = cache.get(key) if version is not None else None
+    if cached is not None:
+        return cached
+
+    now = timezone.now()
+    rows = UserModelPermission.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        Q(custom_rate_limit__isnull=False) | Q(daily_limit__isnull=False) | Q(monthly_limit__isnull=False),
+        user_id=user.pk,
+        is_active=True,
+    ).values_list('model__model_id', 'custom_rate_limit', 'daily_limit', 'monthly_limit')
+    limits = {
+        model_id: tuple(-1 if value is None else value for value in (rpm, daily, monthly))
+        for model_id, rpm, daily, monthly in rows
+    }
+    if version is not None:
+        cache.set(key, limits, getattr(settings, 'MODEL_ENTITLEMENTS_TTL', 300))
+    return limits
+
+
+def _period_keys(user_id: int, model_id: str) -> Tuple[str, str, str]:
+    now = timezone.localtime()
+    return (
+        _COUNTER_KEY.format(user_id, model_id, 'day', now.strftime('%Y%m%d')),
+        _COUNTER_KEY.format(user_id, model_id, 'month', now.strftime('%Y%m')),
+        _RATE_KEY.format(user_id, model_id, now.strftime('%Y%m%d%H%M')),
+    )
+
+
+def _parse_counter_key(key: str) -> Tuple[int, str, str, date]:
+    """quota:{user}:{model}:{day|month}:{YYYYMMDD|YYYYMM} — model_id ممکن است خودش ':' داشته باشد"""
+    _prefix, user_id, *model, period, stamp = key.split(':')
+    start = date(int(stamp[:4]), int(stamp[4:6]), int(stamp[6:8]) if period == 'day' else 1)
+    return int(user_id), ':'.join(model), period, start
+
+
+def _hydrate(client, user_id: int, model_id: str, day_key: str, month_key: str) -> None:
+    """بازسازی شمارنده‌های غایب از آخرین مقدار ذخیره‌شده در DB"""
+    stored = {
+        (period, start): tokens
+        for period, start, tokens in TokenQuotaUsage.objects.filter(
+            user_id=user_id, model__model_id=model_id,
+            period_start__in=[_parse_counter_key(day_key)[3], _parse_counter_key(month_key)[3]],
+        ).values_list('period', 'period_start', 'tokens_used')
+    }
+    pipe = client.pipeline()
+    for key, ttl in ((day_key, _DAY_TTL), (month_key, _MONTH_TTL)):
+        _user, _model, period, start = _parse_counter_key(key)
+        pipe.set(key, stored.get((period, start), 0), ex=ttl, nx=True)
+    pipe.execute()
+
+
+def _reserve_local(keys: Tuple[str, str, str], estimate: int, limits: Tuple[int, int, int]) -> Optional[str]:
+    """نسخهٔ بدون Redis (dev/تست‌ها)؛ اتمیک نیست"""
+    day_key, month_key, rate_key = keys
+    rpm, daily, monthly = limits
+    if daily >= 0 and cache.get(day_key, 0) + estimate > daily:
+        return 'daily'
+    if monthly >= 0 and cache.get(month_key, 0) + estimate > monthly:
+        return 'monthly'
+    if rpm >= 0:
+        if cache.get(rate_key, 0) >= rpm:
+            return 'rate'
+        cache.add(rate_key, 0, 60)
+        cache.incr(rate_key)
+    for key, ttl in ((day_key, _DAY_TTL), (month_key, _MONTH_TTL)):
+        cache.add(key, 0, ttl)
+        cache.incr(key, estimate)
+    return None
+
+
+def reserve_tokens(user: Optional['AbstractUser'], model_id: Optional[str], estimate: int) -> Optional[Reservation]:
+    """
+    رزرو estimate توکن برای یک نوبت؛ None اگر سقفی برای (کاربر، مدل) تعریف نشده باشد.
+    اگر مصرف فعلی + estimate از سقف بگذرد QuotaExceeded (نه فقط وقتی سقف قبلاً پر شده باشد).
+    """
+    limits = get_quota_limits(user).get(model_id) if model_id else None
+    if limits is None:
+        return None
+    keys = _period_keys(user.pk, model_id)
+    client = get_redis()
+    if client is None:
+        rejected = _reserve_local(keys, estimate, limits)
+    else:
+        reserve, _settle = _scripts_for(client)
+        try:
+            for _attempt in range(2):
+                status, kind = reserve(keys=[*keys, DIRTY_KEY], args=[estimate, *limits], client=client)
+                if status != -1:
+                    break
+                _hydrate(client, user.pk, model_id, keys[0], keys[1])
+        except Exception as e:
+            logger.warning(f"⚠️ Quota check skipped for user {user.pk} / {model_id}: {str(e)}")
+            return None
+        rejected = kind.decode() if status == 0 else None
+    if rejected:
+        raise QuotaExceeded(rejected, model_id)
+    return Reservation(keys[0], keys[1], estimate)
+
+
+def settle_tokens(reservation: Optional[Reservation], actual: int) -> None:
+    """جایگزینی تخمین رزرو با مصرف واقعی"""
+    if reservation is None:
+        return
+    delta = int(actual) - reservation.estimate
+    client = get_redis()
+    try:
+        if client is None:
+            for key in (reservation.day_key, reservation.month_key):
+                if cache.get(key) is not None:
+                    cache.set(key, max(0, cache.get(key) + delta), _DAY_TTL if ':day:' in key else _MONTH_TTL)
+            return
+        _reserve, settle = _scripts_for(client)
+        settle(keys=[reservation.day_key, reservation.month_key, DIRTY_KEY], args=[delta], client=client)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not settle quota reservation {reservation}: {str(e)}")
+
+
+def hold_for_message(message_id: int, reservation: Optional[Reservation]) -> None:
+    """نگه‌داشتن رزرو تا worker تولید پیام را تمام کند"""
+    if reservation is None:
+        return
+    key = _HELD_KEY.format(message_id)
+    client = get_redis()
+    try:
+        if client is not None:
+            client.set(key, reservation.to_json(), ex=_HELD_TTL)
+        else:
+            cache.set(key, reservation.to_json(), _HELD_TTL)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not hold quota reservation for message {message_id}: {str(e)}")
+
+
+def settle_for_message(message_id: int, actual: int) -> None:
+    """تسویهٔ رزرو پیام (فقط یک بار؛ تحویل دوبارهٔ پیام چیزی پیدا نمی‌کند)"""
+    key = _HELD_KEY.format(message_id)
+    client = get_redis()
+    try:
+        if client is not None:
+            raw, _deleted = client.pipeline().get(key).delete(key).execute()
+        else:
+            raw = cache.get(key)
+            cache.delete(key)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not load quota reservation for message {message_id}: {str(e)}")
+        return
+    if raw is not None:
+        settle_tokens(Reservation.from_json(raw), actual)
+
+
+def persist_counters(batch: int = 1000, max_batches: int = 50) -> int:
+    """نوشتن شمارنده‌های تغییرکرده در TokenQuotaUsage (مقدار Redis مرجع است)"""
+    client = get_redis()
+    if client is None:
+        return 0
+    written = 0
+    for _ in range(max_batches):
+        keys: List[bytes] = client.spop(DIRTY_KEY, batch) or []
+        if not keys:
+            break
+        try:
+            values = client.mget(keys)
+            parsed = [
+                (_parse_counter_key(key.decode()), int(value))
+                for key, value in zip(keys, values) if value is not None
+            ]
+            model_pks = dict(
+                AIModel.objects.filter(model_id__in={p[1] for p, _v in parsed}).values_list('model_id', 'id')
+            )
+            rows = [
+                TokenQuotaUsage(
+                    user_id=user_id, model_id=model_pks[model_id], period=period,
+                    period_start=start, tokens_used=value,
+                )
+                for (user_id, model_id, period, start), value in parsed if model_id in model_pks
+            ]
+            TokenQuotaUsage.objects.bulk_create(
+                rows,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['user', 'model', 'period', 'period_start'],
+                update_fields=['tokens_used', 'updated_at'],
+            )
+        except Exception:
+            client.sadd(DIRTY_KEY, *keys)
+            raise
+        written += len(rows)
+        if len(keys) < batch:
+            break
+    return written
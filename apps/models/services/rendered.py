@@ -0,0 +1,114 @@
+"""
+پاسخ‌های JSON از پیش رندرشدهٔ لیست و آمار مدل‌ها.
+
+بدنهٔ هر پاسخ فقط به این‌ها بستگی دارد: نسخهٔ کاتالوگ، «کلاس entitlement» کاربر (مجموعهٔ مدل‌های
+مجاز + مهمان/لاگین/ادمین) و ترکیب فیلترها. پس سریالایز یک بار برای هر ترکیب انجام می‌شود و
+بایت‌ها به همراه ETag قوی (sha256 بدنه) در cache با کلید نسخه‌دار نگه داشته می‌شوند:
+
+    model_list:{catalog_version}:{entitlement_class}:{filters}
+    model_stats:{catalog_version}:{entitlement_class}
+
+کاربران با مجوزهای یکسان (مثلاً همهٔ کاربران فقط-رایگان) یک نسخهٔ مشترک دارند. با bump نسخهٔ
+کاتالوگ کلیدها عوض می‌شوند و نسخه‌های قبلی با TTL می‌میرند؛ هیچ invalidation دستی لازم نیست.
+"""
+import hashlib
+import logging
+from typing import Callable, Dict, FrozenSet, Optional, Tuple, TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from ..models import AIModel
+from .catalog import CatalogSnapshot, capability_mask
+from .entitlements import get_entitlements
+
+if TYPE_CHECKING:
+    from django.contrib.auth.models import AbstractUser
+
+logger = logging.getLogger(__name__)
+
+_LIST_KEY = 'model_list:{}:{}:{}'
+_STATS_KEY = 'model_stats:{}:{}'
+
+
+def entitlement_class(user: Optional['AbstractUser'], entitled: FrozenSet[int]) -> str:
+    """شناسهٔ کوتاه و پایدار برای (نوع کاربر، مجموعهٔ مدل‌های مجاز)"""
+    if user is None or not user.is_authenticated:
+        kind = 'guest'
+    elif user.is_superuser:
+        kind = 'admin'
+    else:
+        kind = 'user'
+    digest = hashlib.sha1(','.join(map(str, sorted(entitled))).encode('ascii')).hexdigest()[:16]
+    return f'{kind}-{digest}'
+
+
+def _render(key: str, build: Callable[[], Dict]) -> Tuple[str, bytes]:
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    body = JSONRenderer().render(build())
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+    cache.set(key, (etag, body), getattr(settings, 'MODEL_RESPONSE_CACHE_TTL', 600))
+    logger.debug(f"🧱 Rendered {key} ({len(body)} bytes)")
+    return etag, body
+
+
+def model_list(catalog: CatalogSnapshot, user: Optional['AbstractUser'], params) -> Tuple[str, bytes]:
+    """(ETag، بدنه) لیست مدل‌های در دسترس کاربر با فیلترهای tier/provider/vision/function_calling"""
+    from ..serializers import AIModelListSerializer
+
+    entitled = get_entitlements(user)
+    tier = params.get('tier') or ''
+    provider = params.get('provider') or ''
+    capabilities = capability_mask(
+        supports_vision=params.get('vision') == 'true',
+        supports_function_calling=params.get('function_calling') == 'true',
+    )
+    # مقدار ناشناخته همیشه نتیجهٔ خالی دارد؛ در کلید یکسان می‌شود تا فضای کلیدها محدود بماند
+    filters = '{}|{}|{}'.format(
+        tier if not tier or tier in catalog.by_tier else '?',
+        provider if not provider or provider in catalog.by_provider else '?',
+        capabilities,
+    )
+    authenticated = user is not None and user.is_authenticated
+
+    def build() -> Dict:
+        available = tuple(m for m in catalog.models if m.id in entitled)
+        models = catalog.filter(
+            available, tier=tier or None, provider=provider or None, capabilities=capabilities,
+        )
+        data = AIModelListSerializer(models, many=True).data
+        return {
+            'success': True,
+            'count': len(data),
+            'models': data,
+            'user_authenticated': authenticated,
+            'user_tier': 'admin' if authenticated and user.is_superuser else 'guest',
+        }
+
+    key = _LIST_KEY.format(catalog.version, entitlement_class(user, entitled), filters)
+    return _render(key, build)
+
+
+def model_stats(catalog: CatalogSnapshot, user: Optional['AbstractUser']) -> Tuple[str, bytes]:
+    """(ETag، بدنه) آمار کاتالوگ؛ user_accessible_models به کلاس entitlement کاربر بستگی دارد"""
+    entitled = get_entitlements(user)
+
+    def build() -> Dict:
+        total_models = len(catalog.models)
+        free_models = len(catalog.by_tier.get(AIModel.ModelTier.FREE, ()))
+        return {
+            'success': True,
+            'stats': {
+                'total_models': total_models,
+                'free_models': free_models,
+                'premium_models': total_models - free_models,
+                'user_accessible_models': len(entitled & catalog.by_id.keys()),
+                'providers_count': len(catalog.providers),
+            }
+        }
+
+    key = _STATS_KEY.format(catalog.version, entitlement_class(user, entitled))
+    return _render(key, build)
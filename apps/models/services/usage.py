@@ -0,0 +1,225 @@
+"""
+ثبت دسته‌ای و ناهمگام ModelUsageLog برای هر تولید پاسخ.
+
+- record_usage(...) در مسیر داغ فقط یک dict به بافر حافظه‌ای پروسه اضافه می‌کند (یک قفل، بدون
+  I/O)؛ از event loop، thread سلری و view به یک اندازه امن است.
+- thread پس‌زمینهٔ هر پروسه بافر را وقتی به USAGE_BATCH_SIZE برسد یا هر USAGE_FLUSH_INTERVAL ثانیه
+  تخلیه می‌کند:
+    * با Redis: یک RPUSH دسته‌ای به لیست `usage:pending`؛ تسک beat (drain_usage_logs) رکوردهای همهٔ
+      پروسه‌ها (Daphne، workerهای سلری و استریم) را برمی‌دارد و با bulk_create می‌نویسد؛
+    * بدون Redis: bulk_create مستقیم از همان thread.
+- model با model_id متنی ثبت و هنگام نوشتن با یک کوئری به pk تبدیل می‌شود؛ رکورد مدل‌های خارج از
+  جدول (مثلاً provider ساختگی) شمرده و کنار گذاشته می‌شود.
+- حسابرسی از دست رفتن: بافر سقف USAGE_BUFFER_MAX دارد (قدیمی‌ترها دور ریخته می‌شوند) و در خروج
+  پروسه (atexit / worker_process_shutdown) یک flush نهایی انجام می‌شود؛ باقی‌ماندهٔ ناموفق لاگ و
+  شمرده می‌شود. همه در متریک model_usage_records_total{outcome}.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from apps.observability.metrics import USAGE_RECORDS_TOTAL
+from apps.queueapp.redis_client import get_redis
+from ..models import AIModel, ModelUsageLog
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'usage:pending'
+
+_ERROR_MAX_CHARS = 500
+
+
+def _usage_settings() -> Dict:
+    return {
+        'batch_size': getattr(settings, 'USAGE_BATCH_SIZE', 200),
+        'flush_interval': getattr(settings, 'USAGE_FLUSH_INTERVAL', 2.0),
+        'buffer_max': getattr(settings, 'USAGE_BUFFER_MAX', 10000),
+    }
+
+
+def write_usage(records: List[Dict]) -> int:
+    """نوشتن دسته‌ای رکوردها (شکل record_usage) در ModelUsageLog؛ تعداد ردیف‌های نوشته‌شده"""
+    if not records:
+        return 0
+    model_pks = dict(
+        AIModel.objects.filter(model_id__in={r['model'] for r in records}).values_list('model_id', 'id')
+    )
+    rows = [
+        ModelUsageLog(
+            user_id=r.get('user_id'),
+            session_key=r.get('session_key'),
+            model_id=model_pks[r['model']],
+            tokens_used=r.get('tokens', 0),
+            request_timestamp=datetime.fromtimestamp(r['ts'], tz=dt_timezone.utc),
+            response_time_ms=r.get('latency_ms'),
+            success=r.get('success', True),
+            error_message=r.get('error', ''),
+        )
+        for r in records if r['model'] in model_pks
+    ]
+    ModelUsageLog.objects.bulk_create(rows, batch_size=500)
+    USAGE_RECORDS_TOTAL.labels('written').inc(len(rows))
+    if len(rows) < len(records):
+        USAGE_RECORDS_TOTAL.labels('unknown_model').inc(len(records) - len(rows))
+    return len(rows)
+
+
+def _ship(batch: List[Dict]) -> None:
+    client = get_redis()
+    if client is not None:
+        client.rpush(PENDING_KEY, *(json.dumps(r, separators=(',', ':')) for r in batch))
+        USAGE_RECORDS_TOTAL.labels('queued').inc(len(batch))
+        return
+    try:
+        write_usage(batch)
+    finally:
+        # thread طولانی‌عمر است و چرخهٔ request جنگو اتصالش را نمی‌بندد
+        close_old_connections()
+
+
+class UsageRecorder:
+    def __init__(self, batch_size: int = None, flush_interval: float = None, buffer_max: int = None,
+                 autostart: bool = True):
+        defaults = _usage_settings()
+        self.batch_size = batch_size or defaults['batch_size']
+        self.flush_interval = flush_interval or defaults['flush_interval']
+        self.buffer_max = buffer_max or defaults['buffer_max']
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+        if autostart:
+            self._thread = threading.Thread(target=self._run, name='usage-recorder', daemon=True)
+            self._thread.start()
+
+    def record(self, entry: Dict) -> None:
+        with self._lock:
+            self._buffer.append(entry)
+            overflow = len(self._buffer) - self.buffer_max
+            if overflow > 0:
+                # Redis/DB در دسترس نیست و بافر پر شده؛ قدیمی‌ترها فدای محدود ماندن حافظه می‌شوند
+                del self._buffer[:overflow]
+                USAGE_RECORDS_TOTAL.labels('dropped').inc(overflow)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """ارسال بافر فعلی؛ در صورت خطا رکوردها به ابتدای بافر برمی‌گردند"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                _ship(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Usage flush failed ({len(batch)} records kept for retry): {str(e)}")
+                with self._lock:
+                    self._buffer[:0] = batch
+                return 0
+            return len(batch)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def close(self) -> int:
+        """flush نهایی هنگام خروج پروسه؛ تعداد رکوردهای از دست رفته را برمی‌گرداند"""
+        if self._closed:
+            return 0
+        self._closed = True
+        self._wake.set()
+        self.flush()
+        with self._lock:
+            lost, self._buffer = len(self._buffer), []
+        if lost:
+            USAGE_RECORDS_TOTAL.labels('lost').inc(lost)
+            logger.error(f"❌ {lost} usage records lost on shutdown (pid={os.getpid()})")
+        return lost
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._closed:
+                self.flush()
+
+
+_recorder: Optional[UsageRecorder] = None
+_recorder_pid: Optional[int] = None
+_recorder_lock = threading.Lock()
+
+
+def get_usage_recorder() -> UsageRecorder:
+    """یک recorder برای هر پروسه؛ بعد از fork (prefork سلری) دوباره ساخته می‌شود."""
+    global _recorder, _recorder_pid
+    pid = os.getpid()
+    if _recorder is None or _recorder_pid != pid:
+        with _recorder_lock:
+            if _recorder is None or _recorder_pid != pid:
+                _recorder = UsageRecorder()
+                _recorder_pid = pid
+                atexit.register(_recorder.close)
+    return _recorder
+
+
+def shutdown_usage_recorder() -> int:
+    """برای خروج پروسه‌هایی که atexit در آن‌ها اجرا نمی‌شود (فرزندهای prefork سلری)"""
+    if _recorder is None or _recorder_pid != os.getpid():
+        return 0
+    return _recorder.close()
+
+
+def record_usage(model: Optional[str], *, user_id: Optional[int] = None, session_key: Optional[str] = None,
+                 tokens: int = 0, latency_ms: Optional[int] = None, success: bool = True, error: str = '') -> None:
+    """ثبت استفاده از یک مدل (بدون I/O در فراخوان)"""
+    if not model or not getattr(settings, 'USAGE_LOGGING_ENABLED', True):
+        return
+    get_usage_recorder().record({
+        'ts': time.time(),
+        'model': model,
+        'user_id': user_id,
+        'session_key': session_key,
+        'tokens': int(tokens or 0),
+        'latency_ms': latency_ms,
+        'success': bool(success),
+        'error': (error or '')[:_ERROR_MAX_CHARS],
+    })
+
+
+def drain_pending(max_batches: int = 20) -> int:
+    """
+    تخلیهٔ لیست Redis (رکوردهای همهٔ پروسه‌ها) در DB؛ هر دسته با LRANGE+LTRIM اتمیک برداشته
+    می‌شود و اگر نوشتن شکست بخورد به ابتدای لیست برمی‌گردد.
+    """
+    client = get_redis()
+    if client is None:
+        return 0
+    batch_size = _usage_settings()['batch_size'] * 5
+    written = 0
+    for _ in range(max_batches):
+        pipe = client.pipeline()
+        pipe.lrange(PENDING_KEY, 0, batch_size - 1)
+        pipe.ltrim(PENDING_KEY, batch_size, -1)
+        raw, _trimmed = pipe.execute()
+        if not raw:
+            break
+        try:
+            written += write_usage([json.loads(item) for item in raw])
+        except Exception:
+            client.lpush(PENDING_KEY, *reversed(raw))
+            raise
+        if len(raw) < batch_size:
+            break
+    return written
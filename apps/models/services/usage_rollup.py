@@ -0,0 +1,227 @@
+"""
+rollupهای ساعتی/روزانهٔ ModelUsageLog و نگهداری (retention) لاگ خام.
+
+- rollup_usage(): لاگ‌های جدیدتر از checkpoint را تکه‌تکه (به ترتیب id) می‌خواند، در حافظه روی
+  (بازه، مدل، subject) جمع می‌زند و با یک upsert دسته‌ای به ردیف‌های موجود اضافه می‌کند. جابه‌جایی
+  checkpoint در همان تراکنش است، پس هر لاگ دقیقاً یک بار شمرده می‌شود. هر لاگ در چهار ردیف اثر
+  می‌گذارد: ساعتی/روزانه × (کاربر یا نشست، جمع کل مدل با subject='*').
+- usage_totals(): آمار یک مدل در پنجرهٔ زمانی از ردیف‌های '*' (حداکثر ۲۴ ردیف در روز) به‌علاوهٔ
+  دنبالهٔ کوچک لاگ‌های هنوز rollup نشده.
+- prune_usage(): حذف تکه‌ای لاگ خام قدیمی‌تر از USAGE_RAW_RETENTION_DAYS (فقط آن‌هایی که rollup
+  شده‌اند) و rollupهای ساعتی قدیمی‌تر از USAGE_HOURLY_ROLLUP_RETENTION_DAYS.
+
+نکته: شناسه‌ها به ترتیب commit دیده نمی‌شوند؛ چون هر flush یک INSERT کوتاه است، لاگی که بعد از
+عبور checkpoint با id کمتر commit شود عملاً رخ نمی‌دهد و هزینهٔ قفل جدول را نمی‌ارزد.
+"""
+import logging
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from apps.queueapp.redis_client import distributed_lock
+from ..models import ModelUsageLog, ModelUsageRollup, UsageRollupCheckpoint
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = 'model_usage_logs'
+ROLLUP_LOCK = 'usage:rollup'
+
+_COUNTERS = ('request_count', 'success_count', 'failure_count', 'tokens_used', 'latency_count', 'latency_sum_ms')
+
+Key = Tuple[str, datetime, int, str]
+
+
+def _retention_settings() -> Dict:
+    return {
+        'raw_days': getattr(settings, 'USAGE_RAW_RETENTION_DAYS', 30),
+        'hourly_days': getattr(settings, 'USAGE_HOURLY_ROLLUP_RETENTION_DAYS', 14),
+        'chunk': getattr(settings, 'USAGE_PRUNE_CHUNK', 5000),
+    }
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if granularity == ModelUsageRollup.Granularity.DAY else ts
+
+
+def _latency_bucket(latency_ms: int) -> int:
+    return bisect_left(ModelUsageRollup.LATENCY_BUCKETS_MS, latency_ms)
+
+
+def _empty() -> Dict:
+    return {
+        **dict.fromkeys(_COUNTERS, 0),
+        'latency_histogram': [0] * (len(ModelUsageRollup.LATENCY_BUCKETS_MS) + 1),
+    }
+
+
+def _accumulate(rows: List[Dict]) -> Dict[Key, Dict]:
+    acc: Dict[Key, Dict] = {}
+    for row in rows:
+        if row['user_id'] is not None:
+            subject = f"u:{row['user_id']}"
+        else:
+            subject = f"s:{row['session_key'] or ''}"
+        for granularity in ModelUsageRollup.Granularity.values:
+            start = bucket_start(row['request_timestamp'], granularity)
+            for subj in (subject, ModelUsageRollup.ALL_SUBJECTS):
+                entry = acc.get((granularity, start, row['model_id'], subj))
+                if entry is None:
+                    entry = acc[(granularity, start, row['model_id'], subj)] = _empty()
+                    if subj != ModelUsageRollup.ALL_SUBJECTS:
+                        entry['user_id'] = row['user_id']
+                        entry['session_key'] = (row['session_key'] or '') if row['user_id'] is None else ''
+                entry['request_count'] += 1
+                entry['success_count' if row['success'] else 'failure_count'] += 1
+                entry['tokens_used'] += row['tokens_used'] or 0
+                if row['response_time_ms'] is not None:
+                    entry['latency_count'] += 1
+                    entry['latency_sum_ms'] += row['response_time_ms']
+                    entry['latency_histogram'][_latency_bucket(row['response_time_ms'])] += 1
+    return acc
+
+
+def _apply(acc: Dict[Key, Dict]) -> None:
+    """افزودن جمع‌های این تکه به ردیف‌های موجود و upsert دسته‌ای"""
+    existing = ModelUsageRollup.objects.filter(
+        granularity__in={k[0] for k in acc},
+        bucket_start__in={k[1] for k in acc},
+        model_id__in={k[2] for k in acc},
+        subject__in={k[3] for k in acc},
+    )
+    for row in existing:
+        entry = acc.get((row.granularity, row.bucket_start, row.model_id, row.subject))
+        if entry is None:
+            continue
+        for field in _COUNTERS:
+            entry[field] += getattr(row, field)
+        entry['latency_histogram'] = [a + b for a, b in zip(entry['latency_histogram'], row.latency_histogram)]
+
+    objs = [
+        ModelUsageRollup(
+            granularity=granularity, bucket_start=start, model_id=model_id, subject=subject,
+            user_id=entry.pop('user_id', None), session_key=entry.pop('session_key', ''), **entry,
+        )
+        for (granularity, start, model_id, subject), entry in acc.items()
+    ]
+    ModelUsageRollup.objects.bulk_create(
+        objs,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['granularity', 'bucket_start', 'model', 'subject'],
+        update_fields=[*_COUNTERS, 'latency_histogram'],
+    )
+
+
+def rollup_usage(chunk: int = 5000, max_chunks: int = 20) -> int:
+    """اعمال لاگ‌های جدید در rollupها؛ تعداد لاگ‌های پردازش‌شده"""
+    processed = 0
+    with distributed_lock(ROLLUP_LOCK, 300) as acquired:
+        if not acquired:
+            logger.info("⏭️ Usage rollup already running elsewhere; skipping")
+            return 0
+        for _ in range(max_chunks):
+            with transaction.atomic():
+                checkpoint, _created = UsageRollupCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+                rows = list(
+                    ModelUsageLog.objects.filter(id__gt=checkpoint.last_log_id).order_by('id').values(
+                        'id', 'model_id', 'user_id', 'session_key', 'tokens_used',
+                        'request_timestamp', 'response_time_ms', 'success',
+                    )[:chunk]
+                )
+                if not rows:
+                    break
+                _apply(_accumulate(rows))
+                checkpoint.last_log_id = rows[-1]['id']
+                checkpoint.save(update_fields=['last_log_id', 'updated_at'])
+            processed += len(rows)
+            if len(rows) < chunk:
+                break
+    if processed:
+        logger.info(f"📈 Rolled up {processed} usage logs")
+    return processed
+
+
+def _checkpoint_id() -> int:
+    return UsageRollupCheckpoint.objects.filter(name=CHECKPOINT).values_list('last_log_id', flat=True).first() or 0
+
+
+def usage_totals(model_pk: int, since: datetime, now: Optional[datetime] = None) -> Dict:
+    """
+    جمع استفادهٔ یک مدل از since تا اکنون. پنجره به ابتدای بازهٔ rollup (ساعت یا روز) گرد می‌شود؛
+    پنجره‌های کوتاه‌تر از عمر rollupهای ساعتی از آن‌ها و بلندترها از rollupهای روزانه خوانده می‌شوند.
+    """
+    now = now or timezone.now()
+    granularity = ModelUsageRollup.Granularity.HOUR
+    if now - since > timedelta(days=_retention_settings()['hourly_days']):
+        granularity = ModelUsageRollup.Granularity.DAY
+    last_id = _checkpoint_id()
+
+    totals = _empty()
+    rollups = ModelUsageRollup.objects.filter(
+        model_id=model_pk,
+        subject=ModelUsageRollup.ALL_SUBJECTS,
+        granularity=granularity,
+        bucket_start__gte=bucket_start(since, granularity),
+    ).values_list(*_COUNTERS, 'latency_histogram')
+    for *counters, histogram in rollups:
+        for field, value in zip(_COUNTERS, counters):
+            totals[field] += value
+        totals['latency_histogram'] = [a + b for a, b in zip(totals['latency_histogram'], histogram)]
+
+    # لاگ‌هایی که هنوز به rollup نرسیده‌اند (چند ثانیه تا یک دقیقهٔ اخیر)
+    tail = ModelUsageLog.objects.filter(
+        model_id=model_pk, id__gt=last_id, request_timestamp__gte=since,
+    ).aggregate(
+        requests=Count('id'),
+        successes=Count('id', filter=Q(success=True)),
+        tokens=Sum('tokens_used'),
+        latency_count=Count('response_time_ms'),
+        latency_sum=Sum('response_time_ms'),
+    )
+    totals['request_count'] += tail['requests']
+    totals['success_count'] += tail['successes']
+    totals['failure_count'] += tail['requests'] - tail['successes']
+    totals['tokens_used'] += tail['tokens'] or 0
+    totals['latency_count'] += tail['latency_count']
+    totals['latency_sum_ms'] += tail['latency_sum'] or 0
+    return totals
+
+
+def _delete_in_chunks(queryset, chunk: int, max_chunks: int) -> int:
+    deleted = 0
+    for _ in range(max_chunks):
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk])
+        if not ids:
+            break
+        deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < chunk:
+            break
+    return deleted
+
+
+def prune_usage(max_chunks: int = 100) -> Dict[str, int]:
+    """حذف تکه‌ای (هر تکه یک تراکنش کوتاه) لاگ‌های خام و rollupهای ساعتی قدیمی"""
+    config = _retention_settings()
+    now = timezone.now()
+    raw = _delete_in_chunks(
+        ModelUsageLog.objects.filter(
+            id__lte=_checkpoint_id(), request_timestamp__lt=now - timedelta(days=config['raw_days']),
+        ),
+        config['chunk'], max_chunks,
+    )
+    hourly = _delete_in_chunks(
+        ModelUsageRollup.objects.filter(
+            granularity=ModelUsageRollup.Granularity.HOUR,
+            bucket_start__lt=now - timedelta(days=config['hourly_days']),
+        ),
+        config['chunk'], max_chunks,
+    )
+    if raw or hourly:
+        logger.info(f"🧹 Pruned {raw} raw usage logs and {hourly} hourly rollups")
+    return {'raw_logs': raw, 'hourly_rollups': hourly}
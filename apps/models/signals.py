@@ -0,0 +1,40 @@
+# apps/models/signals.py
+"""
+ویرایش/حذف مدل‌ها و providerها (ادمین، shell) نسخهٔ کاتالوگ را افزایش می‌دهد تا اسنپ‌شات
+پروسه‌ها بازسازی شود؛ تغییر مجوزها نسخهٔ entitlement همان کاربر را. عملیات دسته‌ای (update/bulk_create در sync و اکشن‌های ادمین) سیگنال
+ندارند و خودشان bump_catalog_version() را صدا می‌زنند.
+
+بافر ModelUsageLog هر پروسهٔ worker سلری هم قبل از خروج flush می‌شود (atexit در فرزندهای prefork
+اجرا نمی‌شود).
+"""
+from celery.signals import worker_process_shutdown
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AIModel, ModelProvider, UserModelPermission
+from .services.catalog import bump_catalog_version
+from .services.entitlements import bump_user_entitlements
+from .services.usage import shutdown_usage_recorder
+
+
+@receiver(post_save, sender=AIModel)
+@receiver(post_delete, sender=AIModel)
+@receiver(post_save, sender=ModelProvider)
+@receiver(post_delete, sender=ModelProvider)
+def catalog_changed(sender, raw=False, **kwargs):
+    # کلید مجموعه‌های entitlement هم شامل نسخهٔ کاتالوگ است و با همین bump باطل می‌شود
+    if not raw:
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=UserModelPermission)
+@receiver(post_delete, sender=UserModelPermission)
+def entitlements_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: bump_user_entitlements(instance.user_id))
+
+
+@worker_process_shutdown.connect
+def flush_usage_on_shutdown(**kwargs):
+    shutdown_usage_recorder()
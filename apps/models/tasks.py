@@ -0,0 +1,124 @@
+# apps/models/tasks.py
+import logging
+import random
+import time
+from typing import Optional
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.queueapp.redis_client import distributed_lock, get_redis
+from .services.avalai_service import avalai_service
+from .services.model_manager import model_manager
+
+log = logging.getLogger(__name__)
+
+REFRESH_LOCK = "avalai:catalog:refresh"
+LAST_SUCCESS_KEY = "avalai:catalog:last_success"
+
+
+def _model_settings() -> dict:
+    return getattr(settings, 'MODEL_SETTINGS', {})
+
+
+def get_last_success() -> Optional[float]:
+    """زمان (unix) آخرین refresh موفق؛ در Redis بدون انقضا نگه داشته می‌شود تا بین ری‌استارت‌ها بماند."""
+    client = get_redis()
+    try:
+        value = client.get(LAST_SUCCESS_KEY) if client is not None else cache.get(LAST_SUCCESS_KEY)
+    except Exception as e:
+        log.warning("Could not read catalog last-success marker: %s", e)
+        return None
+    return float(value) if value is not None else None
+
+
+def _mark_success() -> None:
+    now = time.time()
+    client = get_redis()
+    try:
+        if client is not None:
+            client.set(LAST_SUCCESS_KEY, str(now))
+        else:
+            cache.set(LAST_SUCCESS_KEY, now, None)
+    except Exception as e:
+        log.warning("Could not persist catalog last-success marker: %s", e)
+
+
+@shared_task
+def scheduled_catalog_sync():
+    """
+    ورودی Celery beat (هر SYNC_INTERVAL ثانیه). اگر refresh موفق اخیر وجود داشته باشد (مثلاً
+    sync دستی یا beat تکراری) کاری نمی‌کند؛ در غیر این صورت refresh را با jitter تصادفی صف
+    می‌کند تا چند محیط/نمونهٔ beat هم‌زمان به AvalAI نزنند.
+    """
+    interval = _model_settings().get('SYNC_INTERVAL', 3600)
+    last = get_last_success()
+    if last is not None and time.time() - last < interval * 0.9:
+        log.info("Catalog refreshed %.0fs ago; skipping scheduled sync", time.time() - last)
+        return {'skipped': True}
+    jitter = random.uniform(0, _model_settings().get('SYNC_JITTER', 60))
+    refresh_catalog_task.apply_async(kwargs={'force_sync': last is None}, countdown=jitter)
+    return {'scheduled_in': round(jitter, 1)}
+
+
+@shared_task
+def refresh_catalog_task(force_sync: bool = False):
+    """
+    بازاعتبارسنجی کاتالوگ AvalAI (درخواست شرطی) و همگام‌سازی جدول مدل‌ها در صورت تغییر.
+    فقط یک پروسه در هر لحظه این کار را می‌کند؛ بقیه بدون انتظار برمی‌گردند.
+    """
+    timeout = _model_settings().get('REFRESH_LOCK_TIMEOUT', 120)
+    with distributed_lock(REFRESH_LOCK, timeout) as acquired:
+        if not acquired:
+            log.info("Catalog refresh already running elsewhere; skipping")
+            return {'skipped': True}
+        try:
+            models, changed = avalai_service.revalidate()
+            if not models:
+                return {'changed': False, 'synced': False}
+            if not (changed or force_sync):
+                _mark_success()
+                return {'changed': False, 'synced': False}
+            stats = model_manager.sync_catalog(models)
+            _mark_success()
+            log.info("Catalog refreshed: %s", stats)
+            return {'changed': changed, 'synced': True, 'stats': stats}
+        finally:
+            # فقط بعد از پایان کار اجازهٔ زمان‌بندی دوباره داده می‌شود
+            avalai_service.clear_revalidate_flag()
+
+
+@shared_task
+def drain_usage_logs():
+    """ورودی beat: رکوردهای ModelUsageLog صف‌شده در Redis را دسته‌ای در DB می‌نویسد."""
+    from .services.usage import drain_pending
+
+    written = drain_pending()
+    if written:
+        log.info("Usage log drain wrote %d records", written)
+    return {'written': written}
+
+
+@shared_task
+def rollup_usage_logs():
+    """ورودی beat: اعمال افزایشی لاگ‌های جدید در rollupهای ساعتی/روزانه."""
+    from .services.usage_rollup import rollup_usage
+
+    return {'processed': rollup_usage()}
+
+
+@shared_task
+def prune_usage_logs():
+    """ورودی beat: حذف تکه‌ای لاگ خام و rollupهای ساعتی خارج از پنجرهٔ نگهداری."""
+    from .services.usage_rollup import prune_usage
+
+    return prune_usage()
+
+
+@shared_task
+def persist_quota_counters():
+    """ورودی beat: پشتیبان‌گیری شمارنده‌های سهمیهٔ تغییرکرده از Redis در TokenQuotaUsage."""
+    from .services.quotas import persist_counters
+
+    return {'written': persist_counters()}
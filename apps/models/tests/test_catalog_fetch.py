@@ -0,0 +1,73 @@
+import time
+
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+from apps.models.services.avalai_service import avalai_service
+
+CATALOG = {"object": "list", "data": [{"id": "gpt-4o-mini", "owned_by": "openai"}]}
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_conditional_revalidation_uses_etag():
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=CATALOG, headers={"ETag": '"v1"'})
+
+    transport = httpx.MockTransport(handler)
+    models, changed = async_to_sync(avalai_service.arevalidate)(transport)
+    assert changed and models == CATALOG["data"]
+
+    models, changed = async_to_sync(avalai_service.arevalidate)(transport)
+    assert not changed and models == CATALOG["data"]
+    assert seen == [None, '"v1"']
+
+    # خطای upstream دادهٔ کهنه را حفظ می‌کند
+    failing = httpx.MockTransport(lambda request: httpx.Response(502))
+    assert async_to_sync(avalai_service.arevalidate)(failing) == (CATALOG["data"], False)
+
+
+def test_stale_catalog_is_served_while_revalidating(monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(avalai_service, "revalidate", lambda: pytest.fail("request path must not block on upstream"))
+    monkeypatch.setattr("apps.models.tasks.refresh_catalog_task.delay", lambda **kw: scheduled.append(kw))
+
+    cache.set(avalai_service.cache_key, {
+        "models": CATALOG["data"], "etag": '"v1"', "last_modified": None,
+        "fetched_at": time.time() - avalai_service.cache_timeout - 1,
+    })
+    assert avalai_service.fetch_models() == CATALOG["data"]
+    assert avalai_service.fetch_models() == CATALOG["data"]
+    assert scheduled == [{"force_sync": False}]  # درخواست‌های هم‌زمان فقط یک تسک صف می‌کنند
+
+
+@pytest.mark.django_db
+def test_scheduled_sync_jitters_and_respects_last_success(settings, monkeypatch):
+    from apps.models import tasks
+
+    settings.REDIS_URL = None
+    queued = []
+    monkeypatch.setattr(tasks.refresh_catalog_task, "apply_async", lambda **kw: queued.append(kw))
+    monkeypatch.setattr(avalai_service, "revalidate", lambda: (CATALOG["data"], True))
+
+    result = tasks.scheduled_catalog_sync()
+    assert queued[0]["kwargs"] == {"force_sync": True}
+    assert 0 <= queued[0]["countdown"] <= settings.MODEL_SETTINGS["SYNC_JITTER"]
+    assert "scheduled_in" in result
+
+    assert tasks.refresh_catalog_task(force_sync=True)["synced"]
+    assert tasks.get_last_success() is not None
+    assert tasks.scheduled_catalog_sync() == {"skipped": True}
+    assert len(queued) == 1
@@ -0,0 +1,65 @@
+import pytest
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+from apps.models.models import AIModel, ModelProvider
+from apps.models.services import catalog
+from apps.models.services.catalog import CAP_FUNCTION_CALLING, CAP_VISION, get_catalog
+
+
+@pytest.fixture(autouse=True)
+def _fresh_snapshot(settings):
+    settings.REDIS_URL = None
+    cache.clear()
+    catalog.invalidate_local()
+    yield
+    catalog.invalidate_local()
+
+
+def _model(provider, model_id, tier="free", **caps):
+    return AIModel.objects.create(model_id=model_id, display_name=model_id, provider=provider, tier=tier, **caps)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_snapshot_indexes_and_version_bump(django_assert_num_queries):
+    openai = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    google = ModelProvider.objects.create(name="google", display_name="Google")
+    _model(openai, "gpt-4o-mini", supports_vision=True, supports_function_calling=True)
+    _model(openai, "gpt-4o", tier="premium", supports_vision=True)
+    _model(google, "gemini-flash", supports_function_calling=True)
+
+    snapshot = get_catalog()
+    assert [m.model_id for m in snapshot.models] == ["gemini-flash", "gpt-4o", "gpt-4o-mini"]
+    assert [m.model_id for m in snapshot.by_tier["free"]] == ["gemini-flash", "gpt-4o-mini"]
+    assert [m.model_id for m in snapshot.filter(capabilities=CAP_VISION | CAP_FUNCTION_CALLING)] == ["gpt-4o-mini"]
+    assert [m.model_id for m in snapshot.filter(provider="openai", tier="premium")] == ["gpt-4o"]
+
+    # خواندن داغ: بدون هیچ کوئری
+    with django_assert_num_queries(0):
+        for _ in range(100):
+            assert get_catalog().get("gpt-4o").is_premium
+
+    # ویرایش ادمین (post_save) نسخه را بالا می‌برد و اسنپ‌شات بازسازی می‌شود
+    AIModel.objects.filter(model_id="gpt-4o").update(is_active=False)
+    assert get_catalog() is snapshot
+    AIModel.objects.get(model_id="gemini-flash").save()
+    assert get_catalog().get("gpt-4o") is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_model_list_view_reads_snapshot(django_assert_num_queries):
+    openai = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    _model(openai, "gpt-4o-mini", supports_vision=True)
+    _model(openai, "gpt-3.5-turbo")
+    _model(openai, "gpt-4o", tier="premium", supports_vision=True)
+    get_catalog()
+
+    client = APIClient()
+    with django_assert_num_queries(0):
+        response = client.get("/api/models/models/", {"vision": "true"})
+    assert response.status_code == 200
+    assert [m["model_id"] for m in response.json()["models"]] == ["gpt-4o-mini"]
+    assert response.json()["models"][0]["provider"]["name"] == "openai"
+
+    assert client.get("/api/models/models/gpt-4o/").status_code == 404
+    assert client.get("/api/models/models/gpt-3.5-turbo/").json()["model"]["max_tokens"] == 4096
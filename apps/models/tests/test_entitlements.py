@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.models.models import AIModel, ModelProvider, UserModelPermission
+from apps.models.services import catalog, entitlements
+from apps.models.services.entitlements import get_entitlements, has_model_access
+from apps.models.services.model_manager import model_manager
+
+
+@pytest.fixture(autouse=True)
+def _fresh_snapshot(settings):
+    settings.REDIS_URL = None
+    cache.clear()
+    catalog.invalidate_local()
+    yield
+    catalog.invalidate_local()
+
+
+@pytest.fixture
+def models():
+    provider = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    free = AIModel.objects.create(model_id="gpt-4o-mini", display_name="mini", provider=provider, tier="free")
+    premium = AIModel.objects.create(model_id="gpt-4o", display_name="4o", provider=provider, tier="premium")
+    return free, premium
+
+
+@pytest.mark.django_db(transaction=True)
+def test_grant_revoke_and_cached_lookup(models, django_user_model, django_assert_num_queries):
+    free, premium = models
+    user = django_user_model.objects.create_user(email="u1@example.com", password="x")
+
+    assert get_entitlements(None) == {free.id}
+    assert not has_model_access(user, "gpt-4o")
+
+    # مسیر داغ بعد از اولین محاسبه بدون کوئری است
+    with django_assert_num_queries(0):
+        for _ in range(50):
+            assert has_model_access(user, "gpt-4o-mini")
+
+    permission = UserModelPermission.objects.create(user=user, model=premium)
+    assert has_model_access(user, "gpt-4o")
+    assert [m.model_id for m in model_manager.available_models(user)] == ["gpt-4o", "gpt-4o-mini"]
+    assert set(model_manager.get_available_models_for_user(user).values_list("model_id", flat=True)) == {
+        "gpt-4o", "gpt-4o-mini",
+    }
+
+    permission.delete()
+    assert not has_model_access(user, "gpt-4o")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_expired_and_inactive_grants(models, django_user_model):
+    _, premium = models
+    user = django_user_model.objects.create_user(email="u2@example.com", password="x")
+    admin = django_user_model.objects.create_superuser(email="root@example.com", password="x")
+
+    UserModelPermission.objects.create(user=user, model=premium, expires_at=timezone.now() - timedelta(minutes=1))
+    assert not has_model_access(user, "gpt-4o")
+
+    UserModelPermission.objects.filter(user=user).update(expires_at=None, is_active=False)
+    assert not has_model_access(user, "gpt-4o")
+
+    assert has_model_access(admin, "gpt-4o")
+    # مدل غیرفعال از کاتالوگ (و در نتیجه از همهٔ مجموعه‌ها) خارج می‌شود
+    premium.is_active = False
+    premium.save()
+    assert not has_model_access(admin, "gpt-4o")
+
+
+class _FakeRedis:
+    """شمارنده‌های مشترک بین «پروسه‌ها» (cache محلی هر پروسه جدا پاک می‌شود)"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self
+
+    def expire(self, key, seconds):
+        return self
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_user_version_is_shared_through_redis(models, django_user_model, monkeypatch):
+    _, premium = models
+    fake = _FakeRedis()
+    monkeypatch.setattr(entitlements, "get_redis", lambda: fake)
+    user = django_user_model.objects.create_user(email="u3@example.com", password="x")
+
+    assert not has_model_access(user, "gpt-4o")  # مجموعه در cache همین پروسه
+    UserModelPermission.objects.create(user=user, model=premium)
+
+    assert fake.values == {f"model_entitlements_version:{user.pk}": 1}
+    assert cache.get(f"model_entitlements_version:{user.pk}") is None
+    assert has_model_access(user, "gpt-4o")
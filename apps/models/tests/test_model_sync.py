@@ -0,0 +1,55 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.models.models import AIModel, ModelProvider
+from apps.models.services.model_manager import model_manager
+
+
+def _entry(model_id, owner="openai", **extra):
+    return {"id": model_id, "owned_by": owner, "max_tokens": 8192, "pricing": {"input": 0.0001}, **extra}
+
+
+@pytest.mark.django_db
+def test_sync_catalog_upserts_skips_unchanged_and_deactivates_missing():
+    catalog = [_entry(f"m-{i}", owner="openai" if i % 2 else "google") for i in range(50)]
+    stats = model_manager.sync_catalog(catalog)
+    assert (stats["created"], stats["updated"], stats["unchanged"]) == (50, 0, 0)
+    assert ModelProvider.objects.count() == 2
+
+    # اجرای دوم بدون تغییر: تعداد کوئری ثابت و مستقل از اندازهٔ کاتالوگ
+    with CaptureQueriesContext(connection) as ctx:
+        stats = model_manager.sync_catalog(catalog)
+    assert stats["unchanged"] == 50 and stats["updated"] == 0
+    assert len(ctx.captured_queries) <= 6
+
+    catalog[0] = _entry("m-0", owner="google", max_tokens=32000, supports_vision=True)
+    stats = model_manager.sync_catalog(catalog[:40])
+    assert (stats["updated"], stats["unchanged"], stats["deactivated"]) == (1, 39, 10)
+
+    m0 = AIModel.objects.get(model_id="m-0")
+    assert m0.max_tokens == 32000 and m0.supports_vision and m0.is_active
+    assert AIModel.objects.filter(is_active=False).count() == 10
+
+    # مدل غیرفعال‌شده با بازگشت به کاتالوگ دوباره فعال می‌شود
+    stats = model_manager.sync_catalog(catalog)
+    assert stats["updated"] == 10
+    assert not AIModel.objects.filter(is_active=False).exists()
+
+
+@pytest.mark.django_db
+def test_sync_keeps_admin_deactivation():
+    catalog = [_entry("m-1"), _entry("m-2")]
+    model_manager.sync_catalog(catalog)
+    AIModel.objects.filter(model_id="m-1").update(is_active=False)  # اکشن ادمین
+
+    stats = model_manager.sync_catalog(catalog)
+    assert stats["unchanged"] == 2
+    # تغییر محتوای کاتالوگ هم وضعیت انتخابی ادمین را برنمی‌گرداند
+    stats = model_manager.sync_catalog([_entry("m-1", max_tokens=1024), _entry("m-2")])
+    assert stats["updated"] == 1
+    m1 = AIModel.objects.get(model_id="m-1")
+    assert m1.max_tokens == 1024 and not m1.is_active
+    stats = model_manager.sync_catalog(catalog, force=True)
+    assert not AIModel.objects.get(model_id="m-1").is_active
+    assert AIModel.objects.get(model_id="m-2").is_active
@@ -0,0 +1,142 @@
+from datetime import date
+
+import pytest
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+from apps.chat.models import Conversation, Message
+from apps.models.models import AIModel, ModelProvider, TokenQuotaUsage, UserModelPermission
+from apps.models.services import catalog, quotas
+from apps.models.services.entitlements import bump_user_entitlements
+from apps.models.services.quotas import (
+    QuotaExceeded, hold_for_message, persist_counters, reserve_tokens, settle_for_message, settle_tokens,
+)
+
+
+@pytest.fixture(autouse=True)
+def _no_redis(settings):
+    settings.REDIS_URL = None
+    settings.CELERY_TASK_ALWAYS_EAGER = False
+    cache.clear()
+    catalog.invalidate_local()
+    yield
+    catalog.invalidate_local()
+
+
+@pytest.fixture
+def limited(django_user_model):
+    provider = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    model = AIModel.objects.create(model_id="gpt-4o", display_name="4o", provider=provider, tier="premium")
+    user = django_user_model.objects.create_user(email="quota@example.com", password="x")
+    UserModelPermission.objects.create(user=user, model=model, daily_limit=100, monthly_limit=1000)
+    return user, model
+
+
+@pytest.mark.django_db
+def test_reserve_reconcile_and_reject_when_exhausted(limited, django_assert_num_queries):
+    user, _model = limited
+    first = reserve_tokens(user, "gpt-4o", 80)
+    assert reserve_tokens(user, "gpt-4o-mini", 80) is None  # بدون سقف
+
+    settle_tokens(first, 30)  # مصرف واقعی کمتر از تخمین بود
+    with django_assert_num_queries(0):  # سقف‌ها از cache
+        second = reserve_tokens(user, "gpt-4o", 70)
+    assert cache.get(second.day_key) == 100
+
+    with pytest.raises(QuotaExceeded):  # تخمین هم باید زیر سقف جا شود
+        reserve_tokens(user, "gpt-4o", 80)
+    settle_tokens(second, 60)
+
+    with pytest.raises(QuotaExceeded) as exc:
+        reserve_tokens(user, "gpt-4o", 11)
+    assert exc.value.kind == "daily"
+
+    # update() سیگنال ندارد؛ با bump نسخهٔ entitlement سقف جدید بلافاصله دیده می‌شود
+    UserModelPermission.objects.filter(user=user).update(daily_limit=500)
+    bump_user_entitlements(user.pk)
+    assert reserve_tokens(user, "gpt-4o", 1) is not None
+
+
+@pytest.mark.django_db
+def test_rate_limit_and_held_reservation(limited):
+    user, model = limited
+    UserModelPermission.objects.filter(user=user).update(custom_rate_limit=2, daily_limit=None)
+    bump_user_entitlements(user.pk)
+
+    held = reserve_tokens(user, "gpt-4o", 500)
+    reserve_tokens(user, "gpt-4o", 10)
+    with pytest.raises(QuotaExceeded) as exc:
+        reserve_tokens(user, "gpt-4o", 10)
+    assert exc.value.kind == "rate"
+
+    hold_for_message(42, held)
+    settle_for_message(42, 20)
+    settle_for_message(42, 20)  # تحویل دوباره؛ رزرو قبلاً تسویه شده
+    assert cache.get(held.month_key) == 30
+
+
+@pytest.mark.django_db
+def test_stream_view_rejects_with_429(limited):
+    user, _model = limited
+    client = APIClient()
+    client.force_login(user)
+    reserve_tokens(user, "gpt-4o", 100)
+
+    response = client.post("/api/v1/messages/stream/", {"content": "hi", "model": "gpt-4o"}, format="json")
+    assert response.status_code == 429
+    assert response.json()["quota"] == "daily"
+
+
+@pytest.mark.django_db
+def test_failed_requests_do_not_consume_quota(limited, monkeypatch, settings):
+    user, _model = limited
+    settings.QUOTA_OUTPUT_ESTIMATE = 10
+    client = APIClient(raise_request_exception=False)
+    client.force_login(user)
+    foreign = Conversation.objects.create()
+    day_key = reserve_tokens(user, "gpt-4o", 0).day_key
+
+    body = {"content": "hi", "model": "gpt-4o", "conversation_id": foreign.id}
+    assert client.post("/api/v1/messages/stream/", body, format="json").status_code == 404
+
+    def broker_down(message_id):
+        raise ConnectionError("broker down")
+
+    monkeypatch.setattr("apps.chat.api.views.run_generation_task.delay", broker_down)
+    assert client.post("/api/v1/messages/stream/", {"content": "hi", "model": "gpt-4o"}, format="json").status_code == 500
+
+    assert cache.get(day_key) == 0
+    assert Message.objects.get(role=Message.Role.USER).status == Message.Status.FAILED
+
+
+class _FakeRedisSet:
+    def __init__(self, values):
+        self.values = values
+        self.dirty = set(values)
+
+    def spop(self, key, count):
+        return [self.dirty.pop() for _ in range(min(count, len(self.dirty)))]
+
+    def mget(self, keys):
+        return [self.values.get(k) for k in keys]
+
+    def sadd(self, key, *members):
+        self.dirty.update(members)
+
+
+@pytest.mark.django_db
+def test_counters_are_persisted_for_restart_recovery(limited, monkeypatch):
+    user, model = limited
+    fake = _FakeRedisSet({
+        f"quota:{user.pk}:gpt-4o:day:20261019".encode(): b"120",
+        f"quota:{user.pk}:gpt-4o:month:202610".encode(): b"900",
+    })
+    monkeypatch.setattr(quotas, "get_redis", lambda: fake)
+
+    assert persist_counters() == 2
+    fake.values[f"quota:{user.pk}:gpt-4o:day:20261019".encode()] = b"150"
+    fake.dirty.add(f"quota:{user.pk}:gpt-4o:day:20261019".encode())
+    persist_counters()
+
+    stored = dict(TokenQuotaUsage.objects.filter(user=user, model=model).values_list("period_start", "tokens_used"))
+    assert stored == {date(2026, 10, 19): 150, date(2026, 10, 1): 900}
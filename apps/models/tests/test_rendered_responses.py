@@ -0,0 +1,67 @@
+import pytest
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from apps.models.models import AIModel, ModelProvider, UserModelPermission
+from apps.models.services import catalog
+
+
+@pytest.fixture(autouse=True)
+def _fresh_snapshot(settings):
+    settings.REDIS_URL = None
+    cache.clear()
+    catalog.invalidate_local()
+    yield
+    catalog.invalidate_local()
+
+
+@pytest.fixture
+def premium():
+    openai = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    AIModel.objects.create(model_id="gpt-4o-mini", display_name="mini", provider=openai, tier="free")
+    return AIModel.objects.create(model_id="gpt-4o", display_name="4o", provider=openai, tier="premium")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_model_list_is_rendered_once_and_revalidated_with_etag(premium, monkeypatch, django_assert_num_queries):
+    renders = []
+    original = JSONRenderer.render
+    monkeypatch.setattr(JSONRenderer, "render", lambda self, data, *a, **kw: renders.append(1) or original(self, data, *a, **kw))
+    client = APIClient()
+
+    first = client.get("/api/models/models/")
+    assert first.status_code == 200
+    assert [m["model_id"] for m in first.json()["models"]] == ["gpt-4o-mini"]
+    etag = first["ETag"]
+    assert "no-cache" in first["Cache-Control"]
+
+    with django_assert_num_queries(0):
+        again = client.get("/api/models/models/", HTTP_IF_NONE_MATCH=etag)
+    assert again.status_code == 304 and not again.content
+    assert again["ETag"] == etag
+    assert client.get("/api/models/models/", {"tier": "free"}).status_code == 200
+    assert len(renders) == 2  # یک بار برای هر ترکیب فیلتر
+
+    # bump نسخهٔ کاتالوگ بدنه (و ETag) را عوض می‌کند
+    premium.tier = "free"
+    premium.save()
+    changed = client.get("/api/models/models/", HTTP_IF_NONE_MATCH=etag)
+    assert changed.status_code == 200 and changed["ETag"] != etag
+    assert changed.json()["count"] == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_model_stats_are_per_entitlement_class(premium, django_user_model):
+    user = django_user_model.objects.create_user(email="stats@example.com", password="x")
+    UserModelPermission.objects.create(user=user, model=premium)
+
+    guest = APIClient().get("/api/models/stats/").json()["stats"]
+    client = APIClient()
+    client.force_authenticate(user)
+    member = client.get("/api/models/stats/").json()["stats"]
+
+    assert guest["user_accessible_models"] == 1
+    assert member["user_accessible_models"] == 2
+    assert guest["total_models"] == member["total_models"] == 2
+    assert guest["premium_models"] == 1 and guest["providers_count"] == 1
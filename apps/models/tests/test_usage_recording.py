@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from apps.chat import services
+from apps.chat.models import Conversation, Message
+from apps.models.models import AIModel, ModelProvider, ModelUsageLog
+from apps.models.services import usage
+from apps.models.services.model_manager import model_manager
+from apps.models.services.usage import UsageRecorder, drain_pending, record_usage
+
+
+@pytest.fixture
+def recorder(settings, monkeypatch):
+    settings.REDIS_URL = None
+    monkeypatch.setattr(usage, "get_redis", lambda: None)
+    rec = UsageRecorder(batch_size=3, buffer_max=5, autostart=False)
+    monkeypatch.setattr(usage, "_recorder", rec)
+    monkeypatch.setattr(usage, "_recorder_pid", os.getpid())
+    return rec
+
+
+@pytest.fixture
+def mini():
+    provider = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    return AIModel.objects.create(model_id="gpt-4o-mini", display_name="mini", provider=provider)
+
+
+@pytest.mark.django_db
+def test_buffer_is_flushed_in_one_batch_and_feeds_stats(recorder, mini, django_user_model, django_assert_num_queries):
+    user = django_user_model.objects.create_user(email="usage@example.com", password="x")
+    record_usage("gpt-4o-mini", user_id=user.pk, tokens=120, latency_ms=800)
+    record_usage("gpt-4o-mini", session_key="guest-1", tokens=30, latency_ms=400, success=False, error="timeout:ttft")
+    record_usage("fake-model", tokens=5)  # خارج از کاتالوگ؛ کنار گذاشته می‌شود
+    assert recorder._wake.is_set()  # رسیدن به batch_size thread را بیدار می‌کند
+
+    with django_assert_num_queries(2):  # یک lookup مدل + یک INSERT
+        assert recorder.flush() == 3
+    assert recorder.pending() == 0
+
+    logs = ModelUsageLog.objects.order_by("id")
+    assert [(log.user_id, log.session_key, log.tokens_used, log.success) for log in logs] == [
+        (user.pk, None, 120, True), (None, "guest-1", 30, False),
+    ]
+    stats = model_manager.get_model_usage_stats("gpt-4o-mini")
+    assert stats["total_requests"] == 2 and stats["failed_requests"] == 1
+    assert stats["total_tokens_used"] == 150
+
+
+@pytest.mark.django_db
+def test_generation_records_usage(recorder, mini, settings, monkeypatch):
+    monkeypatch.setenv("DEFAULT_PROVIDER", "fake")
+    monkeypatch.setattr(services, "_group_send", lambda group, payload, flush=False: None)
+    monkeypatch.setattr(services, "request_smart_title", lambda *a, **kw: None)
+    conv = Conversation.objects.create()
+    msg = Message.objects.create(
+        conversation=conv, role=Message.Role.USER, content="hi", status=Message.Status.QUEUED,
+        provider="fake", model_name="gpt-4o-mini",
+    )
+
+    services.run_generation(msg.id)
+    recorder.flush()
+
+    log = ModelUsageLog.objects.get()
+    answer = Message.objects.get(conversation=conv, role=Message.Role.ASSISTANT)
+    assert log.success and log.tokens_used == 2 + len(answer.content)
+    assert log.response_time_ms is not None
+
+
+class _FakeRedisList:
+    def __init__(self):
+        self.items = []
+        self._ops = []
+
+    def rpush(self, key, *values):
+        self.items.extend(values)
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.items.insert(0, value)
+
+    def pipeline(self):
+        self._ops = []
+        return self
+
+    def lrange(self, key, start, end):
+        self._ops.append(lambda: list(self.items[start:end + 1]))
+
+    def ltrim(self, key, start, end):
+        def trim():
+            del self.items[:start]
+            return True
+        self._ops.append(trim)
+
+    def execute(self):
+        return [op() for op in self._ops]
+
+
+@pytest.mark.django_db
+def test_records_cross_processes_through_redis(recorder, mini, monkeypatch):
+    fake = _FakeRedisList()
+    monkeypatch.setattr(usage, "get_redis", lambda: fake)
+    for _ in range(4):
+        record_usage("gpt-4o-mini", tokens=10)
+
+    recorder.flush()
+    assert len(fake.items) == 4 and not ModelUsageLog.objects.exists()
+
+    assert drain_pending() == 4
+    assert fake.items == [] and ModelUsageLog.objects.count() == 4
+
+
+def test_overflow_and_shutdown_losses_are_counted(recorder, monkeypatch):
+    def unavailable(batch):
+        raise ConnectionError("db down")
+
+    monkeypatch.setattr(usage, "_ship", unavailable)
+    for i in range(7):
+        record_usage("gpt-4o-mini", tokens=i)
+
+    assert recorder.flush() == 0
+    assert [r["tokens"] for r in recorder._buffer] == [2, 3, 4, 5, 6]  # دو رکورد قدیمی‌تر drop شدند
+    assert recorder.close() == 5
+    assert recorder.close() == 0
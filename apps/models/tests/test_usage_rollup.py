@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.models.models import AIModel, ModelProvider, ModelUsageLog, ModelUsageRollup
+from apps.models.services import catalog
+from apps.models.services.model_manager import model_manager
+from apps.models.services.usage_rollup import prune_usage, rollup_usage, usage_totals
+
+T0 = datetime(2026, 10, 18, 9, 15, tzinfo=dt_timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def _no_redis(settings):
+    settings.REDIS_URL = None
+    cache.clear()
+    catalog.invalidate_local()
+    yield
+    catalog.invalidate_local()
+
+
+@pytest.fixture
+def mini():
+    provider = ModelProvider.objects.create(name="openai", display_name="OpenAI")
+    return AIModel.objects.create(model_id="gpt-4o-mini", display_name="mini", provider=provider)
+
+
+def _log(model, at, **kwargs):
+    return ModelUsageLog.objects.create(model=model, request_timestamp=at, **kwargs)
+
+
+@pytest.mark.django_db
+def test_rollups_are_incremental_per_subject_and_bucket(mini, django_user_model):
+    user = django_user_model.objects.create_user(email="roll@example.com", password="x")
+    _log(mini, T0, user=user, tokens_used=100, response_time_ms=300)
+    _log(mini, T0 + timedelta(minutes=10), session_key="guest", tokens_used=20, response_time_ms=80, success=False)
+    _log(mini, T0 + timedelta(hours=1), user=user, tokens_used=50)
+
+    assert rollup_usage(chunk=2) == 3
+    assert rollup_usage() == 0  # checkpoint جابه‌جا شده؛ دوباره شمرده نمی‌شود
+
+    hour = ModelUsageRollup.objects.get(granularity="hour", bucket_start=T0.replace(minute=0), subject="*")
+    assert (hour.request_count, hour.success_count, hour.failure_count, hour.tokens_used) == (2, 1, 1, 120)
+    assert hour.latency_sum_ms == 380 and hour.latency_histogram[:3] == [1, 0, 1]
+
+    _log(mini, T0 + timedelta(hours=2), user=user, tokens_used=5, response_time_ms=1200)
+    rollup_usage()
+    day_user = ModelUsageRollup.objects.get(granularity="day", subject=f"u:{user.pk}")
+    assert (day_user.user_id, day_user.request_count, day_user.tokens_used, day_user.latency_count) == (user.pk, 3, 155, 2)
+    assert ModelUsageRollup.objects.get(granularity="day", subject="s:guest").session_key == "guest"
+
+
+@pytest.mark.django_db
+def test_stats_read_rollups_plus_unrolled_tail(mini, django_assert_num_queries):
+    now = timezone.now()
+    for minutes in (5, 50, 70):
+        _log(mini, now - timedelta(minutes=minutes), tokens_used=10, response_time_ms=200)
+    _log(mini, now - timedelta(days=30), tokens_used=999)  # بیرون از پنجره
+    rollup_usage()
+    _log(mini, now, tokens_used=1, success=False)  # هنوز rollup نشده
+
+    with django_assert_num_queries(3):  # checkpoint + rollupها + دنبالهٔ خام
+        totals = usage_totals(mini.id, now - timedelta(days=7))
+    assert totals["request_count"] == 4 and totals["failure_count"] == 1
+    assert totals["tokens_used"] == 31
+
+    stats = model_manager.get_model_usage_stats("gpt-4o-mini", days=30 + 1)  # rollupهای روزانه
+    assert stats["total_requests"] == 5 and stats["total_tokens_used"] == 1030
+    assert stats["average_response_time_ms"] == 200
+    assert stats["response_time_histogram_ms"]["<=250"] == 3
+
+
+@pytest.mark.django_db
+def test_prune_deletes_only_rolled_up_logs_in_chunks(mini, settings):
+    settings.USAGE_PRUNE_CHUNK = 2
+    old = timezone.now() - timedelta(days=settings.USAGE_RAW_RETENTION_DAYS + 1)
+    for _ in range(5):
+        _log(mini, old)
+    rollup_usage()
+    late = _log(mini, old)  # قدیمی ولی هنوز در rollup نیامده
+    recent = _log(mini, timezone.now())
+
+    assert prune_usage() == {"raw_logs": 5, "hourly_rollups": 2}
+    assert set(ModelUsageLog.objects.values_list("id", flat=True)) == {late.id, recent.id}
+    assert ModelUsageRollup.objects.get(granularity="day", subject="*").request_count == 5
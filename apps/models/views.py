@@ -4,11 +4,12 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 
-from .models import AIModel, ModelProvider
+from .models import ModelProvider
 from .serializers import (
     AIModelListSerializer, AIModelDetailSerializer, 
     ModelProviderSerializer, UserModelSelectionSerializer,
@@ -16,73 +17,45 @@ from .serializers import (
 )
 from .services.model_manager import model_manager
 from .services.avalai_service import avalai_service
+from .services.catalog import get_catalog
+from .services import rendered
 
 User = get_user_model()
 logger = logging.getLogger(__name__) # <<<<<<<<<<<<<<< [جدید] تعریف لاگر
 
+
+def _etag_response(request, etag: str, body: bytes) -> HttpResponse:
+    """
+    بدنهٔ از پیش رندرشده با ETag قوی؛ If-None-Match برابر → 304 بدون بدنه.
+    no-cache: مرورگر پاسخ را نگه می‌دارد ولی هر بار با If-None-Match اعتبارسنجی می‌کند.
+    """
+    response = get_conditional_response(request, etag=etag) or HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
 class ModelListView(generics.ListAPIView):
     """لیست مدل‌های قابل دسترس برای کاربر"""
     serializer_class = AIModelListSerializer
     permission_classes = [AllowAny]
     
-    def get_queryset(self):
+    def list(self, request, *args, **kwargs):
         """
-        این متد برای دریافت لیست مدل‌ها بهینه شده است.
-        1. ابتدا مدل‌های موجود را با بهینه‌سازی کوئری (select_related) دریافت می‌کند.
-        2. اگر هیچ مدلی یافت نشد (Lazy Refresh)، یک همگام‌سازی فوری و همزمان (synchronous) انجام می‌دهد.
-        3. در نهایت، لیست به‌روز شده را برمی‌گرداند.
+        مدل‌های در دسترس کاربر از اسنپ‌شات کاتالوگ در حافظه (بدون کوئری روی AIModel).
+        اگر کاتالوگ خالی باشد، همگام‌سازی در پس‌زمینه زمان‌بندی می‌شود (درخواست کاربر هرگز
+        منتظر AvalAI نمی‌ماند؛ درخواست‌های هم‌زمان هم فقط یک تسک صف می‌کنند).
         """
-        user = self.request.user if self.request.user.is_authenticated else None
-        
-        # بهینه‌سازی برای جلوگیری از N+1 Query هنگام سریالایز کردن provider
-        queryset = model_manager.get_available_models_for_user(user).select_related('provider')
-        
-        # <<<<<<<<<<<<<<< [منطق جدید] Lazy Refresh در اینجا شروع می‌شود >>>>>>>>>>>>>>>
-        if not queryset.exists():
-            logger.warning("Model list is empty. Triggering an immediate lazy refresh from AvalAI...")
-            try:
-                # یک همگام‌سازی فوری انجام می‌دهیم تا این درخواست کاربر بی‌پاسخ نماند
-                model_manager.sync_models_from_avalai(force_refresh=True)
-                
-                # پس از همگام‌سازی، کوئری را مجدداً اجرا می‌کنیم
-                queryset = model_manager.get_available_models_for_user(user).select_related('provider')
-                logger.info("✅ Lazy refresh completed. Models are now populated.")
-            except Exception as e:
-                # اگر همگام‌سازی با خطا مواجه شد، لاگ می‌کنیم و یک کوئری ست خالی برمی‌گردانیم تا برنامه کرش نکند
-                logger.error(f"❌ Lazy refresh failed during API call: {str(e)}")
-        # <<<<<<<<<<<<<<< [منطق جدید] پایان Lazy Refresh >>>>>>>>>>>>>>>
-        
-        return queryset
-    
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        
-        # فیلتر بر اساس tier
-        tier = request.query_params.get('tier')
-        if tier:
-            queryset = queryset.filter(tier=tier)
-        
-        # فیلتر بر اساس provider
-        provider = request.query_params.get('provider')
-        if provider:
-            queryset = queryset.filter(provider__name=provider)
+        catalog = get_catalog()
+        if not catalog.models:
+            logger.warning("Model list is empty. Scheduling a background catalog sync from AvalAI...")
+            avalai_service.schedule_revalidate(force_sync=True)
         
-        # فیلتر بر اساس قابلیت‌ها
-        if request.query_params.get('vision') == 'true':
-            queryset = queryset.filter(supports_vision=True)
-        
-        if request.query_params.get('function_calling') == 'true':
-            queryset = queryset.filter(supports_function_calling=True)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        
-        return Response({
-            'success': True,
-            'count': len(serializer.data),
-            'models': serializer.data,
-            'user_authenticated': request.user.is_authenticated,
-            'user_tier': 'admin' if request.user.is_authenticated and request.user.is_superuser else 'guest'
-        })
+        # بدنهٔ JSON برای هر (نسخهٔ کاتالوگ، کلاس entitlement، فیلترها) یک بار سریالایز می‌شود
+        user = request.user if request.user.is_authenticated else None
+        etag, body = rendered.model_list(catalog, user, request.query_params)
+        return _etag_response(request, etag, body)
 
 class ModelDetailView(generics.RetrieveAPIView):
     """جزئیات یک مدل خاص"""
@@ -90,32 +63,23 @@ class ModelDetailView(generics.RetrieveAPIView):
     permission_classes = [AllowAny]
     lookup_field = 'model_id'
     
-    def get_queryset(self):
-        user = self.request.user if self.request.user.is_authenticated else None
-        # <<<<<<<<<<<<<<< [بهینه‌سازی] افزودن select_related برای جزئیات مدل >>>>>>>>>>>>>>>
-        return model_manager.get_available_models_for_user(user).select_related('provider')
-    
     def retrieve(self, request, *args, **kwargs):
-        try:
-            instance = self.get_object()
-            serializer = self.get_serializer(instance)
-            
-            # بررسی دسترسی کاربر
-            has_access = model_manager.check_user_model_access(
-                request.user if request.user.is_authenticated else None,
-                instance.model_id
-            )
-            
-            return Response({
-                'success': True,
-                'model': serializer.data,
-                'user_has_access': has_access
-            })
-        except: # تغییر برای پوشش موارد بیشتر مانند نبود مدل پس از Lazy Refresh
+        user = request.user if request.user.is_authenticated else None
+        model_id = kwargs.get(self.lookup_field)
+        instance = next((m for m in model_manager.available_models(user) if m.model_id == model_id), None)
+        if instance is None:
             return Response({
                 'success': False,
                 'error': 'مدل یافت نشد یا به آن دسترسی ندارید.'
             }, status=status.HTTP_404_NOT_FOUND)
+        
+        serializer = self.get_serializer(instance)
+        return Response({
+            'success': True,
+            'model': serializer.data,
+            # مدل از میان مدل‌های در دسترس کاربر انتخاب شده است
+            'user_has_access': True
+        })
 
 @method_decorator(cache_page(60 * 5), name='get')  # کش 5 دقیقه‌ای
 class ProviderListView(generics.ListAPIView):
@@ -145,20 +109,18 @@ def select_model(request):
             pass
         
         # دریافت اطلاعات مدل
-        try:
-            model = AIModel.objects.get(model_id=model_id, is_active=True)
-            model_data = AIModelListSerializer(model).data
-            
-            return Response({
-                'success': True,
-                'message': f'مدل {model.display_name} انتخاب شد.',
-                'selected_model': model_data
-            })
-        except AIModel.DoesNotExist:
+        model = model_manager.get_model_by_id(model_id)
+        if model is None:
             return Response({
                 'success': False,
                 'error': 'مدل یافت نشد.'
             }, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({
+            'success': True,
+            'message': f'مدل {model.display_name} انتخاب شد.',
+            'selected_model': AIModelListSerializer(model).data
+        })
     
     return Response({
         'success': False,
@@ -179,15 +141,16 @@ def get_selected_model(request):
     
     # اگر هنوز مدلی نیست، اولین مدل رایگان را بده
     if not selected_model_id:
-        free_models = model_manager.get_available_models_for_user(None)
-        if free_models.exists(): # <<<<<<<<<<<<<<< [بهینه‌سازی] استفاده از exists
-            selected_model_id = free_models.first().model_id
+        free_models = model_manager.available_models(None)
+        if free_models:
+            selected_model_id = free_models[0].model_id
             request.session['selected_model'] = selected_model_id
     
     if selected_model_id:
-        try:
-            model = AIModel.objects.get(model_id=selected_model_id, is_active=True)
-            
+        model = model_manager.get_model_by_id(selected_model_id)
+        if model is None:
+            request.session.pop('selected_model', None)
+        else:
             # بررسی دسترسی
             has_access = model_manager.check_user_model_access(
                 request.user if request.user.is_authenticated else None,
@@ -204,9 +167,6 @@ def get_selected_model(request):
                 # اگر دسترسی نداشت، مدل را پاک کن و مدل رایگان بده
                 request.session.pop('selected_model', None)
                 return get_selected_model(request)  # تکرار برای گرفتن مدل جدید
-                
-        except AIModel.DoesNotExist:
-            request.session.pop('selected_model', None)
     
     # اگر هیچ مدلی پیدا نشد، یک پاسخ مناسب برگردان
     return Response({
@@ -217,38 +177,10 @@ def get_selected_model(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def model_stats(request):
-    """آمار کلی مدل‌ها"""
-    cache_key = 'model_stats'
-    cached_stats = cache.get(cache_key)
-    
-    if cached_stats:
-        return Response(cached_stats)
-    
-    # محاسبه آمار
-    all_active_models = AIModel.objects.filter(is_active=True)
-    total_models = all_active_models.count()
-    free_models = all_active_models.filter(tier='free').count()
-    premium_models = total_models - free_models
-    providers_count = ModelProvider.objects.filter(is_active=True).count()
-    
+    """آمار کلی مدل‌ها (رندرشده برای هر نسخهٔ کاتالوگ و کلاس entitlement؛ نه یک کلید سراسری)"""
     user = request.user if request.user.is_authenticated else None
-    user_accessible_models = model_manager.get_available_models_for_user(user).count() # <<<<<<<<<<<<< [بهینه‌سازی]
-    
-    stats_data = {
-        'success': True,
-        'stats': {
-            'total_models': total_models,
-            'free_models': free_models,
-            'premium_models': premium_models,
-            'user_accessible_models': user_accessible_models,
-            'providers_count': providers_count
-        }
-    }
-    
-    # کش برای 10 دقیقه
-    cache.set(cache_key, stats_data, 600)
-    
-    return Response(stats_data)
+    etag, body = rendered.model_stats(get_catalog(), user)
+    return _etag_response(request, etag, body)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -263,11 +195,9 @@ def sync_models(request):
     force_refresh = request.data.get('force_refresh', False)
     
     try:
+        # sync نسخهٔ کاتالوگ را بالا می‌برد؛ پاسخ‌های رندرشدهٔ لیست/آمار خودبه‌خود کلید جدید می‌گیرند
         result = model_manager.sync_models_from_avalai(force_refresh)
         
-        # پاک کردن کش‌های مربوطه
-        cache.delete('model_stats')
-        
         return Response({
             'success': True,
             'message': 'همگام‌سازی با موفقیت انجام شد',
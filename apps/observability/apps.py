@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ObservabilityConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "apps.observability"
+
+    def ready(self):
+        # اتصال سیگنال‌های Celery برای زمان اجرای تسک و تأخیر صف
+        import apps.observability.signals  # noqa
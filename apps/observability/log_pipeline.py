@@ -0,0 +1,89 @@
+# apps/observability/log_pipeline.py
+"""
+پایپ‌لاین لاگ کم‌هزینه برای مسیرهای داغ (استریم WS و workerها).
+
+- QueuedStreamHandler: رکورد را فقط در یک صف حافظه‌ای می‌گذارد؛ قالب‌بندی JSON و نوشتن روی
+  stream در thread جداگانهٔ QueueListener انجام می‌شود و event loop معطل I/O نمی‌شود.
+- قالب‌بندی تنبل است: msg % args هم در thread listener ساخته می‌شود. بنابراین args نباید بعد
+  از فراخوانی لاگ تغییر داده شوند (در کد ما همه immutable یا موقتی‌اند).
+- RateLimitFilter: برای هر logger یک token bucket؛ رکوردهای زیر WARNING بیش از نرخ مجاز
+  دور ریخته می‌شوند و تعدادشان روی رکورد بعدی (sampled_dropped) گزارش می‌شود.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class QueuedStreamHandler(QueueHandler):
+    def __init__(self, stream=None, maxsize: int = 10000):
+        self.target = logging.StreamHandler(stream)
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        super().__init__(queue.Queue(maxsize))
+        self._start_listener()
+
+    def _start_listener(self):
+        # بعد از fork (مثلاً workerهای prefork سلری) thread listener به پروسهٔ فرزند منتقل نمی‌شود؛
+        # پس با یک صف تازه دوباره راه‌اندازی می‌شود.
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def setFormatter(self, fmt):
+        # formatter روی handler مقصد ست می‌شود تا فقط در thread listener اجرا شود
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # ترجیح می‌دهیم لاگ از دست برود تا اینکه event loop بلاک شود
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+        self.target.close()
+        super().close()
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float = 20.0, burst: int = 50, min_level: str = "WARNING"):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_level = logging.getLevelName(min_level) if isinstance(min_level, str) else int(min_level)
+        self._buckets: dict[str, list] = {}  # name -> [tokens, last_ts, dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.min_level or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1.0
+            if bucket[2]:
+                record.sampled_dropped = bucket[2]
+                bucket[2] = 0
+        return True
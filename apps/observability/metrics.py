@@ -0,0 +1,134 @@
+# apps/observability/metrics.py
+"""
+تعریف متریک‌های Prometheus برای HTTP، WebSocket، Celery و providerها.
+
+- Counter/Histogram های prometheus_client هزینهٔ بسیار کمی دارند (یک قفل + جمع).
+- اگر متغیر محیطی PROMETHEUS_MULTIPROC_DIR ست باشد، مقادیر در فایل‌های mmap هر پروسه
+  نوشته می‌شوند و endpoint `/metrics` آن‌ها را تجمیع می‌کند؛ بنابراین Daphne و workerهای
+  Celery (prefork) اعداد یکسان و قابل جمع گزارش می‌دهند.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# باکت‌های زمانی: از چند میلی‌ثانیه (DB/inter-token) تا چند دقیقه (استریم طولانی)
+_FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_STREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# ---------- HTTP (DRF / Django views) ----------
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per view",
+    ["view", "method", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+HTTP_DB_SECONDS = Histogram(
+    "http_request_db_seconds",
+    "Total time spent in DB queries per HTTP request",
+    ["view"],
+    buckets=_FAST_BUCKETS,
+)
+HTTP_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Number of DB queries per HTTP request",
+    ["view"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+
+# ---------- WebSocket / streaming ----------
+WS_CONNECTIONS = Gauge(
+    "ws_open_connections",
+    "Open WebSocket connections",
+    ["consumer"],
+    multiprocess_mode="livesum",
+)
+WS_CONNECTIONS_TOTAL = Counter(
+    "ws_connections_total",
+    "WebSocket connections accepted",
+    ["consumer"],
+)
+STREAMS_IN_FLIGHT = Gauge(
+    "chat_streams_in_flight",
+    "Chat generations currently streaming",
+    ["path"],
+    multiprocess_mode="livesum",
+)
+STREAM_TTFT_SECONDS = Histogram(
+    "chat_stream_ttft_seconds",
+    "Time to first token as seen by the client",
+    ["model", "path"],
+    buckets=_LATENCY_BUCKETS,
+)
+STREAM_UPSTREAM_TTFT_SECONDS = Histogram(
+    "chat_stream_upstream_ttft_seconds",
+    "Time from upstream request start to first upstream token",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+STREAM_INTER_TOKEN_SECONDS = Histogram(
+    "chat_stream_inter_token_seconds",
+    "Gap between consecutive upstream tokens",
+    ["model"],
+    buckets=_FAST_BUCKETS,
+)
+STREAM_DURATION_SECONDS = Histogram(
+    "chat_stream_duration_seconds",
+    "Total generation duration",
+    ["model", "path", "outcome"],
+    buckets=_STREAM_BUCKETS,
+)
+STREAM_TIMEOUTS_TOTAL = Counter(
+    "chat_stream_timeouts_total",
+    "Generations aborted by a stream deadline",
+    ["model", "path", "kind"],
+)
+STREAM_PUBLISH_BATCH_SIZE = Histogram(
+    "chat_stream_publish_batch_events",
+    "Events per channel-layer flush from generation workers",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+STREAM_PERSIST_SECONDS = Histogram(
+    "chat_stream_persist_seconds",
+    "Time spent persisting a chat turn",
+    ["stage"],
+    buckets=_FAST_BUCKETS,
+)
+
+# ---------- Upstream providers ----------
+UPSTREAM_RESPONSES_TOTAL = Counter(
+    "upstream_responses_total",
+    "Upstream provider HTTP responses by status code",
+    ["provider", "status"],
+)
+UPSTREAM_ERRORS_TOTAL = Counter(
+    "upstream_errors_total",
+    "Upstream provider transport errors",
+    ["provider", "kind"],
+)
+
+# ---------- Smart titles ----------
+SMART_TITLES_TOTAL = Counter(
+    "chat_smart_titles_total",
+    "Smart titles produced per source (extractive = local, llm = provider call)",
+    ["source"],
+)
+
+# ---------- Model usage log ----------
+USAGE_RECORDS_TOTAL = Counter(
+    "model_usage_records_total",
+    "ModelUsageLog records by pipeline stage (queued, written, unknown_model, dropped, lost)",
+    ["outcome"],
+)
+
+# ---------- Celery ----------
+CELERY_TASK_SECONDS = Histogram(
+    "celery_task_duration_seconds",
+    "Celery task run time",
+    ["task", "state"],
+    buckets=_STREAM_BUCKETS,
+)
+CELERY_QUEUE_LAG_SECONDS = Histogram(
+    "celery_task_queue_lag_seconds",
+    "Time between task publish and worker start",
+    ["task"],
+    buckets=_LATENCY_BUCKETS,
+)
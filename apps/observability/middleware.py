@@ -0,0 +1,74 @@
+# apps/observability/middleware.py
+import time
+
+from django.db import connections
+
+from .metrics import HTTP_REQUEST_SECONDS, HTTP_DB_SECONDS, HTTP_DB_QUERIES
+
+
+class _QueryTimer:
+    """execute_wrapper ساده که زمان و تعداد کوئری‌های یک درخواست را جمع می‌زند."""
+
+    __slots__ = ("seconds", "count")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    latency هر view (بر اساس نام route و نه URL خام، تا cardinality محدود بماند)
+    و زمان DB هر درخواست را ثبت می‌کند.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        status = 500
+        try:
+            with _wrap_all_connections(timer):
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            view = _view_label(request)
+            HTTP_REQUEST_SECONDS.labels(view, request.method, str(status)).observe(time.perf_counter() - start)
+            HTTP_DB_SECONDS.labels(view).observe(timer.seconds)
+            HTTP_DB_QUERIES.labels(view).observe(timer.count)
+
+
+class _wrap_all_connections:
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self._stack = []
+
+    def __enter__(self):
+        for alias in connections:
+            cm = connections[alias].execute_wrapper(self.wrapper)
+            cm.__enter__()
+            self._stack.append(cm)
+        return self
+
+    def __exit__(self, *exc):
+        while self._stack:
+            self._stack.pop().__exit__(*exc)
+        return False
+
+
+def _view_label(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
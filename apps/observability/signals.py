@@ -0,0 +1,46 @@
+# apps/observability/signals.py
+import logging
+import os
+import time
+
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_process_shutdown
+
+from .metrics import CELERY_TASK_SECONDS, CELERY_QUEUE_LAG_SECONDS
+
+log = logging.getLogger(__name__)
+
+# زمان شروع تسک‌ها (کلید: task_id) — فقط داخل همان پروسهٔ worker معتبر است
+_started: dict[str, float] = {}
+
+
+@before_task_publish.connect
+def _stamp_published_at(headers=None, **kwargs):
+    # زمان انتشار در header پیام ذخیره می‌شود تا worker تأخیر صف را محاسبه کند
+    if headers is not None:
+        headers.setdefault("published_at", time.time())
+
+
+@task_prerun.connect
+def _on_task_prerun(task_id=None, task=None, **kwargs):
+    _started[task_id] = time.monotonic()
+    published_at = getattr(task.request, "published_at", None) if task else None
+    if published_at:
+        try:
+            CELERY_QUEUE_LAG_SECONDS.labels(task.name).observe(max(0.0, time.time() - float(published_at)))
+        except (TypeError, ValueError):
+            pass
+
+
+@task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    start = _started.pop(task_id, None)
+    if start is not None and task is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(time.monotonic() - start)
+
+
+@worker_process_shutdown.connect
+def _on_worker_process_shutdown(pid=None, **kwargs):
+    # در حالت multiprocess، gaugeهای livesum پروسهٔ مرده باید حذف شوند
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
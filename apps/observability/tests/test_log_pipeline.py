@@ -0,0 +1,36 @@
+import io
+import logging
+
+from apps.observability.log_pipeline import QueuedStreamHandler, RateLimitFilter
+
+
+def _record(name="hot", level=logging.INFO, msg="token %r", args=("x",)):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_filter_drops_over_burst_and_reports_count():
+    flt = RateLimitFilter(rate=0.0001, burst=2)
+    assert flt.filter(_record()) and flt.filter(_record())
+    assert not flt.filter(_record())
+    assert not flt.filter(_record())
+    # هشدارها هرگز نمونه‌برداری نمی‌شوند
+    assert flt.filter(_record(level=logging.WARNING))
+    # logger دیگر bucket جداگانه دارد
+    assert flt.filter(_record(name="other"))
+
+    flt._buckets["hot"][0] = 1.0
+    passed = _record()
+    assert flt.filter(passed)
+    assert passed.sampled_dropped == 2
+
+
+def test_queued_handler_formats_on_listener_thread():
+    stream = io.StringIO()
+    handler = QueuedStreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    record = _record()
+    handler.handle(record)
+    handler.close()
+    # msg % args فقط در thread listener ساخته می‌شود
+    assert record.args == ("x",)
+    assert stream.getvalue() == "INFO token 'x'\n"
@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_exposes_http_latency(client):
+    assert client.get("/healthz/").status_code == 200
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp["Content-Type"].startswith("text/plain")
+    body = resp.content.decode()
+    assert "http_request_duration_seconds_bucket" in body
+    assert 'view="' in body
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_requires_token_when_configured(client, settings):
+    settings.METRICS_AUTH_TOKEN = "s3cret"
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code == 200
@@ -0,0 +1,28 @@
+# apps/observability/views.py
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY, generate_latest
+
+
+@never_cache
+@require_GET
+def metrics(request):
+    """
+    خروجی متریک‌ها با فرمت Prometheus.
+    در حالت multiprocess (PROMETHEUS_MULTIPROC_DIR) مقادیر همهٔ پروسه‌ها (Daphne و workerها) تجمیع می‌شوند.
+    """
+    token = getattr(settings, "METRICS_AUTH_TOKEN", "")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,160 @@
+# apps/queueapp/generation_stream.py
+"""
+صف تولید پاسخ روی Redis Streams (جایگزین سبک run_generation_task برای CHAT_GENERATION_BACKEND=redis_stream).
+
+- view با XADD یک job (فقط message_id) اضافه می‌کند؛ بدون serialization و broker سلری.
+- `manage.py run_generation_worker` با XREADGROUP در یک consumer group می‌خواند و هر job را به
+  arun_generation روی همان event loop می‌دهد؛ هم‌زمانی با --concurrency محدود می‌شود.
+- XACK بعد از پایان (موفق یا ناموفق). job‌های بی‌پاسخ مصرف‌کننده‌های مرده بعد از claim_idle با
+  XAUTOCLAIM برداشته می‌شوند؛ هر worker برای jobهای در حال اجرای خودش با XCLAIM(JUSTID) و
+  Message.updated_at ضربان می‌فرستد تا استریم‌های طولانی اشتباهاً بازپس گرفته نشوند. job بازپس‌گرفته
+  فقط وقتی دوباره اجرا می‌شود که ضربان DB هم قدیمی باشد (_requeue_stale).
+"""
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from apps.chat.models import Message
+from apps.chat.publisher import StreamPublisher
+from apps.chat.services import arun_generation
+from apps.queueapp.redis_client import get_redis
+
+log = logging.getLogger(__name__)
+
+
+def _stream_key() -> str:
+    return getattr(settings, "CHAT_GENERATION_STREAM", "chat:generation")
+
+
+def _group() -> str:
+    return getattr(settings, "CHAT_GENERATION_GROUP", "generation")
+
+
+def enqueue_generation(message_id: int) -> None:
+    client = get_redis()
+    if client is None:
+        raise RuntimeError("CHAT_GENERATION_BACKEND=redis_stream requires REDIS_URL")
+    maxlen = getattr(settings, "CHAT_GENERATION_STREAM_MAXLEN", 100_000)
+    client.xadd(_stream_key(), {"message_id": str(message_id)}, maxlen=maxlen, approximate=True)
+
+
+def _requeue_stale(message_id: int, idle_ms: int) -> bool:
+    """
+    job بازپس‌گرفته با XAUTOCLAIM. پیام STREAMING فقط وقتی دوباره QUEUED می‌شود که ضربان DB آن
+    (updated_at) از idle_ms قدیمی‌تر باشد، یعنی worker صاحبش واقعاً مرده است؛ مثل _claim_message یک
+    UPDATE شرطی است تا دو بازپس‌گیرنده هم‌زمان هر دو موفق نشوند.
+    False یعنی صاحب پیام هنوز زنده است: job نه اجرا و نه ack می‌شود.
+    """
+    now = timezone.now()
+    requeued = Message.objects.filter(
+        id=message_id, status=Message.Status.STREAMING, updated_at__lt=now - timedelta(milliseconds=idle_ms),
+    ).update(status=Message.Status.QUEUED, updated_at=now)
+    if requeued:
+        return True
+    # QUEUED: مستقیماً claim می‌شود؛ پایان‌یافته/حذف‌شده: arun_generation رد می‌کند و ack می‌شود
+    return Message.objects.filter(id=message_id, status=Message.Status.STREAMING).first() is None
+
+
+def _touch_streaming(message_ids: List[int]) -> None:
+    """ضربان DB برای پیام‌های در حال تولید همین worker (کنار XCLAIM روی استریم)"""
+    Message.objects.filter(id__in=message_ids, status=Message.Status.STREAMING).update(updated_at=timezone.now())
+
+
+class GenerationStreamWorker:
+    def __init__(self, redis, consumer: str, concurrency: int = 200, block_ms: int = 5000,
+                 claim_idle_ms: int = 60_000, batch: int = 50):
+        self.redis = redis
+        self.consumer = consumer
+        self.concurrency = concurrency
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.batch = batch
+        self.key = _stream_key()
+        self.group = _group()
+        self.publisher = None
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+        self._message_ids: Dict[bytes, int] = {}
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(self.key, self.group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def run(self, stop: asyncio.Event) -> None:
+        await self.ensure_group()
+        self.publisher = StreamPublisher(loop=asyncio.get_running_loop())
+        housekeeping = asyncio.create_task(self._housekeeping(stop))
+        log.info("Generation worker %s consuming %s (group=%s, concurrency=%s)", self.consumer, self.key, self.group, self.concurrency)
+        try:
+            while not stop.is_set():
+                free = self.concurrency - len(self._inflight)
+                if free <= 0:
+                    await asyncio.wait(list(self._inflight.values()), return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                response = await self.redis.xreadgroup(
+                    self.group, self.consumer, {self.key: ">"}, count=min(free, self.batch), block=self.block_ms,
+                )
+                for _stream, entries in response or []:
+                    for entry_id, fields in entries:
+                        self._start(entry_id, fields)
+        finally:
+            housekeeping.cancel()
+            # خاموشی آرام: استریم‌های جاری تمام می‌شوند؛ jobهای ack نشده را worker دیگری برمی‌دارد
+            if self._inflight:
+                await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+    def _start(self, entry_id: bytes, fields, reclaimed: bool = False) -> None:
+        if entry_id in self._inflight:
+            return
+        task = asyncio.create_task(self._process(entry_id, fields, reclaimed))
+        self._inflight[entry_id] = task
+        task.add_done_callback(lambda _t: self._inflight.pop(entry_id, None))
+
+    async def _process(self, entry_id: bytes, fields, reclaimed: bool) -> None:
+        ack = True
+        try:
+            message_id = int((fields or {}).get(b"message_id", 0))
+            if message_id:
+                if reclaimed and not await sync_to_async(_requeue_stale)(message_id, self.claim_idle_ms):
+                    # worker اصلی فقط دیر ضربان زده؛ خودش ack می‌کند و اگر بمیرد job دوباره بازپس گرفته می‌شود
+                    log.info("Generation job %s (message %s) is still owned by a live worker", entry_id, message_id)
+                    ack = False
+                    return
+                self._message_ids[entry_id] = message_id
+                await arun_generation(message_id, self.publisher)
+        except Exception:
+            log.exception("Generation job %s failed", entry_id)
+        finally:
+            self._message_ids.pop(entry_id, None)
+            if ack:
+                await self.redis.xack(self.key, self.group, entry_id)
+
+    async def _housekeeping(self, stop: asyncio.Event) -> None:
+        interval = max(1.0, self.claim_idle_ms / 1000 / 3)
+        while not stop.is_set():
+            await asyncio.sleep(interval)
+            try:
+                if self._inflight:
+                    await self.redis.xclaim(self.key, self.group, self.consumer, 0, list(self._inflight), justid=True)
+                if self._message_ids:
+                    await sync_to_async(_touch_streaming)(list(self._message_ids.values()))
+                free = self.concurrency - len(self._inflight)
+                if free > 0:
+                    _next, entries, *_ = await self.redis.xautoclaim(
+                        self.key, self.group, self.consumer, min_idle_time=self.claim_idle_ms, start_id="0-0", count=free,
+                    )
+                    for entry_id, fields in entries:
+                        log.warning("Reclaimed stale generation job %s", entry_id)
+                        self._start(entry_id, fields, reclaimed=True)
+                # پروسهٔ طولانی‌عمر: اتصال‌های DB منقضی را مثل پایان request می‌بندیم
+                await sync_to_async(close_old_connections)()
+            except Exception:
+                log.exception("Generation worker housekeeping failed")
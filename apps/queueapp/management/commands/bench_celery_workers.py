@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pyamooz_ai.celery import app
+
+
+@app.task(name="bench.stream_task")
+def bench_stream_task(tokens: int, interval: float) -> int:
+    """
+    شبیه‌ساز یک تولید I/O-bound (بدون DB/provider). عمداً در tasks.py نیست تا در workerهای واقعی
+    ثبت نشود؛ worker بنچمارک این ماژول را با -I بارگذاری می‌کند.
+    """
+    for _ in range(tokens):
+        time.sleep(interval)
+    return tokens
+
+
+def _rss_kb(pid: int) -> int:
+    """RSS پروسه و همهٔ فرزندانش (لینوکس، از /proc)."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as fh:
+                pids.extend(int(p) for p in fh.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class Command(BaseCommand):
+    help = 'مقایسهٔ تراکم worker (prefork در برابر threads) برای تولیدهای I/O-bound؛ به broker واقعی نیاز دارد'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--streams', type=int, default=64, help='تعداد تولید هم‌زمان')
+        parser.add_argument('--tokens', type=int, default=100)
+        parser.add_argument('--interval-ms', type=float, default=20.0, help='فاصلهٔ توکن‌ها')
+        parser.add_argument('--prefork-concurrency', type=int, default=4)
+        parser.add_argument('--threads-concurrency', type=int, default=64)
+        parser.add_argument('--queue', default='bench')
+
+    def handle(self, *args, **options):
+        if settings.CELERY_BROKER_URL.startswith("memory://") or getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):
+            raise CommandError("این بنچمارک به broker واقعی نیاز دارد (CELERY_TASK_ALWAYS_EAGER=0 و REDIS_URL).")
+
+        for pool, concurrency in (("prefork", options['prefork_concurrency']), ("threads", options['threads_concurrency'])):
+            elapsed, rss = self._run(pool, concurrency, options)
+            ideal = options['tokens'] * options['interval_ms'] / 1000
+            self.stdout.write(
+                f"{pool:>8} -c {concurrency:<3}: {options['streams']} streams in {elapsed:.1f}s "
+                f"(ideal {ideal:.1f}s) → {options['streams'] / elapsed:.2f} streams/s, "
+                f"RSS {rss / 1024:.0f} MiB ({rss / 1024 / concurrency:.1f} MiB per slot)"
+            )
+
+    def _run(self, pool, concurrency, options):
+        app.control.purge()
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "celery", "-A", "pyamooz_ai", "worker", "-Q", options['queue'],
+             "-I", __name__,
+             "-P", pool, "-c", str(concurrency), "--prefetch-multiplier", "1",
+             "--without-gossip", "--without-mingle", "-n", f"bench-{pool}@%h", "-l", "WARNING"],
+            env=os.environ.copy(),
+        )
+        try:
+            time.sleep(5)  # راه‌اندازی worker
+            interval = options['interval_ms'] / 1000
+            start = time.monotonic()
+            results = [
+                bench_stream_task.apply_async((options['tokens'], interval), queue=options['queue'])
+                for _ in range(options['streams'])
+            ]
+            peak_rss = 0
+            while not all(r.ready() for r in results):
+                peak_rss = max(peak_rss, _rss_kb(worker.pid))
+                time.sleep(0.2)
+            return time.monotonic() - start, peak_rss
+        finally:
+            worker.terminate()
+            worker.wait(timeout=30)
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import signal
+import socket
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.queueapp.generation_stream import GenerationStreamWorker
+
+
+class Command(BaseCommand):
+    help = 'worker asyncio تولید پاسخ که از Redis Stream (CHAT_GENERATION_STREAM) می‌خواند'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200, help='حداکثر استریم هم‌زمان در این پروسه')
+        parser.add_argument('--consumer', default=f"{socket.gethostname()}-{os.getpid()}")
+        parser.add_argument('--block-ms', type=int, default=5000)
+        parser.add_argument('--claim-idle-ms', type=int, default=60_000, help='بعد از این مدت job مصرف‌کنندهٔ مرده بازپس گرفته می‌شود')
+
+    def handle(self, *args, **options):
+        url = getattr(settings, "REDIS_URL", None)
+        if not url:
+            raise CommandError("REDIS_URL تنظیم نشده است.")
+        asyncio.run(self._main(url, options))
+
+    async def _main(self, url, options):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        client = aioredis.Redis.from_url(url)
+        worker = GenerationStreamWorker(
+            client,
+            consumer=options['consumer'],
+            concurrency=options['concurrency'],
+            block_ms=options['block_ms'],
+            claim_idle_ms=options['claim_idle_ms'],
+        )
+        try:
+            await worker.run(stop)
+        finally:
+            await client.aclose()
@@ -0,0 +1,62 @@
+# apps/queueapp/redis_client.py
+"""
+کلاینت Redis مشترک برای هماهنگی بین پروسه‌ها (web، worker و consumerها).
+اگر REDIS_URL تنظیم نشده باشد None برمی‌گردد تا فراخوان‌ها به cache جنگو برگردند.
+"""
+import logging
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+log = logging.getLogger(__name__)
+
+_clients: dict = {}
+
+
+def get_redis() -> Optional[redis.Redis]:
+    url = getattr(settings, "REDIS_URL", None)
+    if not url:
+        return None
+    client = _clients.get(url)
+    if client is None:
+        # timeout کوتاه: این کلاینت در مسیر داغ استریم است و نباید worker را معطل کند
+        client = _clients[url] = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+    return client
+
+
+@contextmanager
+def distributed_lock(name: str, timeout: int) -> Iterator[bool]:
+    """
+    قفل غیرمسدودکننده بین پروسه‌ها؛ True اگر همین فراخوان قفل را گرفته باشد.
+    با Redis از Lock خود redis-py (توکن + آزادسازی اتمی با Lua) استفاده می‌شود؛ بدون Redis از
+    cache.add جنگو (فقط برای dev/تست‌ها). timeout سقف نگهداری قفل در صورت مرگ پروسه است.
+    """
+    client = get_redis()
+    if client is not None:
+        lock = client.lock(f"lock:{name}", timeout=timeout, blocking=False)
+        try:
+            acquired = lock.acquire()
+        except redis.RedisError as e:
+            log.warning("Could not acquire lock %s: %s", name, e)
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.RedisError as e:
+                    # قفل منقضی شده یا Redis در دسترس نیست؛ با timeout خودش آزاد می‌شود
+                    log.warning("Could not release lock %s: %s", name, e)
+        return
+
+    key = f"lock:{name}"
+    acquired = cache.add(key, 1, timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(key)
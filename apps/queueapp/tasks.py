@@ -1,9 +1,14 @@
 from celery import shared_task
-from apps.chat.services import run_generation
+from apps.chat.services import fail_stale_generations, run_generation
 
 @shared_task
 def ping():
     return "pong"
 @shared_task
 def run_generation_task(message_id: int):
-    run_generation(message_id)
\ No newline at end of file
+    run_generation(message_id)
+
+
+@shared_task
+def fail_stale_generations_task():
+    return fail_stale_generations()
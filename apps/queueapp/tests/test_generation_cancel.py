@@ -0,0 +1,39 @@
+import pytest
+
+from apps.chat import services
+from apps.chat.cancellation import is_cancelled, request_cancel
+from apps.chat.models import Conversation, Message
+
+
+@pytest.fixture(autouse=True)
+def _local_flags(settings, monkeypatch):
+    # بدون Redis پرچم لغو در cache محلی نگه داشته می‌شود
+    settings.REDIS_URL = None
+    settings.CHAT_CANCEL_CHECK_SECONDS = 0
+    monkeypatch.setattr(services, "request_smart_title", lambda *a, **kw: None)
+
+
+@pytest.mark.django_db
+def test_run_generation_stops_on_cancel_and_keeps_partial_answer(monkeypatch):
+    conv = Conversation.objects.create(title="t")
+    msg = Message.objects.create(
+        conversation=conv, role=Message.Role.USER, content="one two three four five",
+        status=Message.Status.QUEUED, provider="fake",
+    )
+    sent = []
+
+    def fake_send(group, payload, flush=False):
+        sent.append(payload)
+        if payload["type"] == "token" and len(sent) == 3:
+            request_cancel(msg.id)
+
+    monkeypatch.setattr(services, "_group_send", fake_send)
+    services.run_generation(msg.id)
+
+    msg.refresh_from_db()
+    assert msg.status == Message.Status.CANCELLED
+    assistant = Message.objects.get(conversation=conv, role=Message.Role.ASSISTANT)
+    assert assistant.status == Message.Status.CANCELLED
+    assert assistant.content == "echo: one "
+    assert sent[-1] == {"type": "done", "finish_reason": "cancelled"}
+    assert not is_cancelled(msg.id)
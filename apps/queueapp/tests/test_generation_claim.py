@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from apps.chat import services, tasks
+from apps.chat.models import Conversation, Message
+
+
+@pytest.fixture(autouse=True)
+def _quiet(settings, monkeypatch):
+    settings.REDIS_URL = None
+    settings.SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE = 1.1  # مسیر LLM
+    monkeypatch.setenv("DEFAULT_PROVIDER", "fake")
+    monkeypatch.setattr(services, "_group_send", lambda group, payload, flush=False: None)
+    monkeypatch.setattr(services, "request_smart_title", lambda *a, **kw: None)
+    monkeypatch.setattr(tasks, "_ws_emit", lambda *a, **kw: None)
+
+
+@pytest.mark.django_db
+def test_run_generation_is_claimed_once():
+    conv = Conversation.objects.create()
+    msg = Message.objects.create(conversation=conv, role=Message.Role.USER, content="hi", status=Message.Status.QUEUED, provider="fake")
+
+    services.run_generation(msg.id)
+    services.run_generation(msg.id)  # تحویل دوباره توسط broker
+
+    msg.refresh_from_db()
+    assert msg.status == Message.Status.DONE
+    assert msg.tokens_input == 2
+    assert Message.objects.filter(conversation=conv, role=Message.Role.ASSISTANT).count() == 1
+
+
+@pytest.mark.django_db
+def test_failure_after_claim_marks_message_failed(monkeypatch):
+    sent = []
+    monkeypatch.setattr(services, "_group_send", lambda group, payload, flush=False: sent.append(payload))
+
+    def unknown_provider(name):
+        raise ValueError(f"unknown provider {name}")
+
+    monkeypatch.setattr(services, "get_provider", unknown_provider)
+    conv = Conversation.objects.create()
+    msg = Message.objects.create(conversation=conv, role=Message.Role.USER, content="hi", status=Message.Status.QUEUED, provider="nope")
+
+    services.run_generation(msg.id)
+
+    msg.refresh_from_db()
+    assert msg.status == Message.Status.FAILED
+    assert [p["type"] for p in sent] == ["started", "error"]
+
+
+@pytest.mark.django_db
+def test_message_orphaned_by_dead_worker_is_failed(monkeypatch):
+    sent = []
+    monkeypatch.setattr(services, "_group_send", lambda group, payload, flush=False: sent.append((group, payload)))
+    conv = Conversation.objects.create()
+    orphan = Message.objects.create(conversation=conv, role=Message.Role.USER, content="hi", status=Message.Status.STREAMING)
+    alive = Message.objects.create(conversation=conv, role=Message.Role.USER, content="hi", status=Message.Status.STREAMING)
+    Message.objects.filter(id=orphan.id).update(updated_at=timezone.now() - timedelta(minutes=10))
+
+    assert services.fail_stale_generations() == 1
+    services.run_generation(orphan.id)  # تحویل دوبارهٔ acks_late چیزی را claim نمی‌کند
+
+    orphan.refresh_from_db()
+    alive.refresh_from_db()
+    assert (orphan.status, alive.status) == (Message.Status.FAILED, Message.Status.STREAMING)
+    assert sent == [(f"msg_{orphan.id}", {
+        "type": "error", "error": "worker_lost", "detail": "Generation worker stopped responding",
+    })]
+
+
+@pytest.mark.django_db
+def test_smart_title_does_not_overwrite_concurrent_user_edit(monkeypatch):
+    conv = Conversation.objects.create(title="hello world")
+    Message.objects.create(conversation=conv, role=Message.Role.USER, content="hello world")
+
+    def rename_during_call(provider, prompt):
+        Conversation.objects.filter(id=conv.id).update(title="my own title")
+        return "Generated title"
+
+    monkeypatch.setattr(tasks, "_collect_title_text", rename_during_call)
+    tasks.generate_and_save_smart_title_task(conv.id)
+
+    conv.refresh_from_db()
+    assert conv.title == "my own title"
+
+    monkeypatch.setattr(tasks, "_collect_title_text", lambda provider, prompt: "Generated title")
+    Conversation.objects.filter(id=conv.id).update(title="hello world")
+    tasks.generate_and_save_smart_title_task(conv.id)
+    conv.refresh_from_db()
+    assert conv.title == "Generated title"
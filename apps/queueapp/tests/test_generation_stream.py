@@ -0,0 +1,85 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from apps.chat import services
+from apps.chat.models import Conversation, Message
+from apps.chat.publisher import StreamPublisher
+from apps.queueapp.generation_stream import GenerationStreamWorker
+
+
+class _RecordingLayer:
+    def __init__(self):
+        self.events = []
+
+    async def group_send(self, group, message):
+        self.events.append(message["event"])
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.acked = []
+
+    async def xack(self, key, group, entry_id):
+        self.acked.append(entry_id)
+
+
+@pytest.fixture(autouse=True)
+def _isolated(settings, monkeypatch):
+    settings.REDIS_URL = None
+    monkeypatch.setattr(services, "request_smart_title", lambda *a, **kw: None)
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_stream_worker_runs_job_publishes_and_acks():
+    conv = await Conversation.objects.acreate(title="t")
+    msg = await Message.objects.acreate(
+        conversation=conv, role=Message.Role.USER, content="hello there",
+        status=Message.Status.QUEUED, provider="fake",
+    )
+    redis = _FakeRedis()
+    worker = GenerationStreamWorker(redis, consumer="test")
+    worker.publisher = StreamPublisher(loop=asyncio.get_running_loop())
+    layer = worker.publisher._layer = _RecordingLayer()
+
+    worker._start(b"1-0", {b"message_id": str(msg.id).encode()})
+    await asyncio.gather(*worker._inflight.values())
+
+    assert redis.acked == [b"1-0"]
+    assert not worker._inflight
+    types = [e["type"] for e in layer.events]
+    assert types[0] == "started" and types[-1] == "done"
+    assert "".join(e["delta"] for e in layer.events if e["type"] == "token") == "echo: hello there"
+    await msg.arefresh_from_db()
+    assert msg.status == Message.Status.DONE
+    assert await Message.objects.filter(conversation=conv, role=Message.Role.ASSISTANT).acount() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_reclaimed_job_is_not_rerun_while_owner_heartbeat_is_fresh():
+    conv = await Conversation.objects.acreate(title="t")
+    msg = await Message.objects.acreate(
+        conversation=conv, role=Message.Role.USER, content="hello there",
+        status=Message.Status.STREAMING, provider="fake",
+    )
+    redis = _FakeRedis()
+    worker = GenerationStreamWorker(redis, consumer="test", claim_idle_ms=60_000)
+    worker.publisher = StreamPublisher(loop=asyncio.get_running_loop())
+    worker.publisher._layer = _RecordingLayer()
+
+    # ضربان تازه: صاحب پیام زنده است؛ نه اجرا و نه ack
+    worker._start(b"1-0", {b"message_id": str(msg.id).encode()}, reclaimed=True)
+    await asyncio.gather(*worker._inflight.values())
+    assert redis.acked == []
+    await msg.arefresh_from_db()
+    assert msg.status == Message.Status.STREAMING
+
+    # ضربان قدیمی: worker صاحب مرده؛ پیام دوباره تولید و ack می‌شود
+    await Message.objects.filter(id=msg.id).aupdate(updated_at=timezone.now() - timedelta(minutes=5))
+    worker._start(b"1-0", {b"message_id": str(msg.id).encode()}, reclaimed=True)
+    await asyncio.gather(*worker._inflight.values())
+    assert redis.acked == [b"1-0"]
+    await msg.arefresh_from_db()
+    assert msg.status == Message.Status.DONE
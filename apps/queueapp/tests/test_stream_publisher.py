@@ -0,0 +1,31 @@
+from apps.chat.publisher import StreamPublisher
+
+
+class _RecordingLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message["event"]))
+
+
+def test_publisher_coalesces_tokens_and_keeps_order():
+    publisher = StreamPublisher(max_delay=10, max_batch=100)
+    layer = publisher._layer = _RecordingLayer()
+    try:
+        publisher.publish("msg_1", {"type": "started"})
+        for i, word in enumerate(["a ", "b ", "c"]):
+            publisher.publish("msg_1", {"type": "token", "delta": word, "seq": i})
+        publisher.publish("msg_2", {"type": "token", "delta": "x", "seq": 0})
+        publisher.publish("msg_1", {"type": "done", "finish_reason": "completed"}, flush=True)
+        publisher.publish("msg_2", {"type": "done", "finish_reason": "completed"}, flush=True)
+    finally:
+        publisher.close()
+
+    msg_1 = [event for group, event in layer.sent if group == "msg_1"]
+    assert msg_1 == [
+        {"type": "started"},
+        {"type": "token", "delta": "a b c", "seq": 0},
+        {"type": "done", "finish_reason": "completed"},
+    ]
+    assert [e["type"] for g, e in layer.sent if g == "msg_2"] == ["token", "done"]
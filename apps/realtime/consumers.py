@@ -2,21 +2,29 @@
 import json
 import logging
 import asyncio
-import re
 import uuid
 import time
 from typing import Any, Dict, Optional, Iterable
 
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from django.conf import settings as django_settings
-from django.db import transaction
+from django.db import close_old_connections
 from django.core.exceptions import FieldDoesNotExist
 
 from apps.gateway.service import get_provider
+from apps.gateway.deadlines import DeadlineTracker, StreamTimeout, aiter_sync, aiter_with_deadlines, get_deadlines
 from apps.chat.models import Conversation, Message
-from apps.chat.tasks import generate_and_save_smart_title_task
+from apps.chat.tasks import arequest_smart_title
 from apps.chat.services import _make_quick_title
+from apps.chat.cancellation import request_cancel
+from apps.chat.api.views import _can_access
+from apps.models.services.quotas import QuotaExceeded, estimate_tokens, reserve_tokens, settle_tokens
+from apps.models.services.usage import record_usage
+from apps.observability.metrics import (
+    WS_CONNECTIONS, WS_CONNECTIONS_TOTAL, STREAMS_IN_FLIGHT, STREAM_TTFT_SECONDS,
+    STREAM_UPSTREAM_TTFT_SECONDS, STREAM_INTER_TOKEN_SECONDS, STREAM_DURATION_SECONDS,
+    STREAM_PERSIST_SECONDS, STREAM_TIMEOUTS_TOTAL,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -55,17 +63,61 @@ class EchoConsumer(JsonSendMixin, AsyncWebsocketConsumer):
         await self.send_json({"type": "done", "finish_reason": "completed"})
 
 class MessageStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
+    """
+    رویدادهای تولید سلری (group msg_<id>) را به کلاینت می‌رساند.
+    قطع اتصال قبل از پایان تولید، یا پیام cancel، پرچم لغو را ثبت می‌کند تا worker متوقف شود.
+    """
     async def connect(self):
+        self.message_id = self.scope.get("url_route", {}).get("kwargs", {}).get("message_id")
+        self.group = None
+        self.finished = False
         await self.accept()
+        if self.message_id and not await self._authorized():
+            # شناسهٔ پیام‌ها ترتیبی است؛ بدون این بررسی هر کلاینتی استریم (و لغو) دیگران را در اختیار دارد
+            logger.warning("[MsgStream] access denied to message %s: %s", self.message_id, self.scope.get("client"))
+            await self.close(code=4403)
+            return
+        if self.message_id and self.channel_layer is not None:
+            self.group = f"msg_{self.message_id}"
+            await self.channel_layer.group_add(self.group, self.channel_name)
         await self.send_json({"type": "connected"})
         logger.info("[MsgStream] connected: %s", self.scope.get("client"))
     async def disconnect(self, code):
         logger.info("[MsgStream] disconnected: %s code=%s", self.scope.get("client"), code)
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+            if not self.finished:
+                await self._request_cancel()
+    async def _authorized(self) -> bool:
+        """همان قاعدهٔ مالک/سشن viewهای REST (_ensure_access_or_404) برای گفتگوی این پیام"""
+        row = await Message.objects.filter(id=int(self.message_id)).values_list(
+            "conversation_id", "conversation__owner_id"
+        ).afirst()
+        if row is None:
+            return False
+        session = self.scope.get("session")
+        sess_ids = await session.aget("guest_conversations", []) if session is not None else []
+        if not isinstance(sess_ids, list):
+            sess_ids = []
+        return _can_access(self.scope.get("user"), sess_ids, *row)
+    async def stream_message(self, event):
+        payload = event.get("event") or {}
+        if payload.get("type") in ("done", "error"):
+            self.finished = True
+        await self.send_json(payload)
+    async def _request_cancel(self):
+        # کلاینت Redis همگام است؛ روی thread جدا (نه executor حساس ORM) اجرا می‌شود
+        await sync_to_async(request_cancel, thread_sensitive=False)(int(self.message_id))
+        logger.info("[MsgStream] cancel requested for message %s", self.message_id)
     async def receive(self, text_data=None, bytes_data=None):
         try: data = json.loads(text_data or "{}")
         except Exception as e: await self._send_error(f"Bad JSON payload: {e}", error_type="bad_payload"); return
         msg_type = data.get("type")
         if msg_type == "ping": await self.send_json({"type": "pong"}); return
+        if msg_type == "cancel":
+            # فقط مشترک مجاز (که به group پیوسته) می‌تواند لغو کند
+            if self.group and not self.finished: await self._request_cancel()
+            return
         if msg_type != "chat_message": await self._send_error(f"Unknown message type: {msg_type}", error_type="unknown_type"); return
         content = (data.get("content") or "").strip()
         if not content: await self._send_error("Empty content.", error_type="input_validation"); return
@@ -92,6 +144,13 @@ def _enum_member(cls, enum_name: str, member: str, default):
     enum_cls = getattr(cls, enum_name, None)
     return getattr(enum_cls, member, default) if enum_cls else default
 
+# نشانگر پایان صف رویدادهای upstream
+_STREAM_END = object()
+
+
+class MalformedProviderEvent(Exception):
+    """رویداد upstream بدون type؛ نوبت failed ثبت می‌شود (نه completed)"""
+
 class ChatStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -99,15 +158,17 @@ class ChatStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
         self.inbox: Optional[asyncio.Queue] = None
         self.runner_task: Optional[asyncio.Task] = None
         self.current_stream_task: Optional[asyncio.Task] = None
-        self.max_stream_seconds = getattr(django_settings, "REALTIME_MAX_SECONDS", 120)
         self.message_counter = 0
         self.user = None
-        logger.info(f"[ChatStream {self.conn_id}] Consumer initialized with timeout={self.max_stream_seconds}s")
+        self._counted = False
+        logger.debug("[ChatStream %s] Consumer initialized", self.conn_id)
 
-    # ---------- ORM helpers ----------
-    @sync_to_async
-    def _create_conversation(self, user, model: Optional[str], initial_content: str = "") -> Optional[Conversation]:
-        """ایجاد گفتگو جدید به صورت اتمیک با عنوان سریع و مالک صحیح"""
+    # ---------- ORM helpers (Django async ORM) ----------
+    # این متدها مستقیماً از API ناهمگام ORM (acreate/aget) استفاده می‌کنند و دیگر با
+    # sync_to_async روی executor مشترک با viewهای DRF صف نمی‌شوند. هر کدام یک INSERT/SELECT
+    # تکی است و ذاتاً اتمیک است؛ بنابراین transaction.atomic (که در کانتکست async مجاز نیست) لازم نیست.
+    async def _create_conversation(self, user, model: Optional[str], initial_content: str = "") -> Optional[Conversation]:
+        """ایجاد گفتگو جدید با عنوان سریع و مالک صحیح"""
         start_time = time.monotonic()
         owner = user if getattr(user, "is_authenticated", False) else None
         
@@ -120,31 +181,28 @@ class ChatStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
         for fname in ("model_name", "model", "llm_model", "model_key", "model_slug"):
             if _has_field(Conversation, fname): kwargs[fname] = (model or ""); break
         try:
-            with transaction.atomic():
-                conv = Conversation.objects.create(**kwargs)
+            conv = await Conversation.objects.acreate(**kwargs)
             elapsed = time.monotonic() - start_time
-            logger.info(f"[ChatStream {self.conn_id}] Conversation created atomically id={conv.id} title='{conv.title}' owner={getattr(owner, 'id', None)} in {elapsed:.3f}s")
+            logger.debug("[ChatStream %s] Conversation created id=%s title='%s' owner=%s in %.3fs", self.conn_id, conv.id, conv.title, getattr(owner, 'id', None), elapsed)
             return conv
         except Exception as e:
             elapsed = time.monotonic() - start_time
-            logger.warning(f"[ChatStream {self.conn_id}] Could not create Conversation in {elapsed:.3f}s. Error: {e}")
+            logger.warning("[ChatStream %s] Could not create Conversation in %.3fs. Error: %s", self.conn_id, elapsed, e)
             return None
 
-    @sync_to_async
-    def _get_conversation(self, conv_id: int) -> Conversation:
+    async def _get_conversation(self, conv_id: int) -> Conversation:
         start_time = time.monotonic()
         try:
-            conv = Conversation.objects.get(id=conv_id)
+            conv = await Conversation.objects.aget(id=conv_id)
             elapsed = time.monotonic() - start_time
-            logger.info(f"[ChatStream {self.conn_id}] Retrieved conversation id={conv_id} title='{conv.title}' in {elapsed:.3f}s")
+            logger.debug("[ChatStream %s] Retrieved conversation id=%s title='%s' in %.3fs", self.conn_id, conv_id, conv.title, elapsed)
             return conv
         except Exception as e:
             elapsed = time.monotonic() - start_time
-            logger.error(f"[ChatStream {self.conn_id}] Failed to get conversation id={conv_id} in {elapsed:.3f}s. Error: {e}")
+            logger.error("[ChatStream %s] Failed to get conversation id=%s in %.3fs. Error: %s", self.conn_id, conv_id, elapsed, e)
             raise
 
-    @sync_to_async
-    def _create_user_message(self, conv: Conversation, content: str, provider: Optional[str], model: Optional[str]) -> Optional[Message]:
+    async def _create_user_message(self, conv: Conversation, content: str, provider: Optional[str], model: Optional[str]) -> Optional[Message]:
         if conv is None: return None
         start_time = time.monotonic()
         kwargs = {"conversation": conv}
@@ -156,81 +214,95 @@ class ChatStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
         for fname, val in [("tokens_input", len(content)), ("input_tokens", len(content))]:
             if _has_field(Message, fname): kwargs[fname] = val
         try:
-            with transaction.atomic():
-                msg = Message.objects.create(**kwargs)
+            msg = await Message.objects.acreate(**kwargs)
             elapsed = time.monotonic() - start_time
-            logger.info(f"[ChatStream {self.conn_id}] User message saved atomically id={getattr(msg, 'id', None)} conv={getattr(conv, 'id', None)} in {elapsed:.3f}s")
+            logger.debug("[ChatStream %s] User message saved id=%s conv=%s in %.3fs", self.conn_id, getattr(msg, 'id', None), getattr(conv, 'id', None), elapsed)
             return msg
         except Exception as e:
             elapsed = time.monotonic() - start_time
-            logger.warning(f"[ChatStream {self.conn_id}] Could not save user message in {elapsed:.3f}s. Error: {e}")
+            logger.warning("[ChatStream %s] Could not save user message in %.3fs. Error: %s", self.conn_id, elapsed, e)
             return None
 
-    @sync_to_async
-    def _create_assistant_message(self, conv: Conversation, text: str, provider: Optional[str], model: Optional[str], latency_ms: int) -> Optional[Message]:
+    async def _create_assistant_message(self, conv: Conversation, text: str, provider: Optional[str], model: Optional[str], latency_ms: int, status: str = "DONE") -> Optional[Message]:
         if conv is None: return None
         start_time = time.monotonic()
         kwargs = {"conversation": conv}
         if _has_field(Message, "role"): kwargs["role"] = _enum_member(Message, "Role", "ASSISTANT", "assistant")
         if _has_field(Message, "content"): kwargs["content"] = text
-        if _has_field(Message, "status"): kwargs["status"] = _enum_member(Message, "Status", "DONE", "done")
+        if _has_field(Message, "status"): kwargs["status"] = _enum_member(Message, "Status", status, status.lower())
         for fname, val in [("provider", provider), ("provider_name", provider), ("model_name", model), ("model", model), ("llm_model", model)]:
             if _has_field(Message, fname): kwargs[fname] = (val or "")
         for fname, val in [("tokens_output", len(text)), ("output_tokens", len(text)), ("latency_ms", latency_ms), ("latency", latency_ms)]:
             if _has_field(Message, fname): kwargs[fname] = val
         try:
-            with transaction.atomic():
-                msg = Message.objects.create(**kwargs)
+            msg = await Message.objects.acreate(**kwargs)
             elapsed = time.monotonic() - start_time
-            logger.info(f"[ChatStream {self.conn_id}] Assistant message saved atomically id={getattr(msg, 'id', None)} conv={getattr(conv, 'id', None)} text_len={len(text)} in {elapsed:.3f}s")
+            logger.debug("[ChatStream %s] Assistant message saved id=%s conv=%s text_len=%s in %.3fs", self.conn_id, getattr(msg, 'id', None), getattr(conv, 'id', None), len(text), elapsed)
             return msg
         except Exception as e:
             elapsed = time.monotonic() - start_time
-            logger.warning(f"[ChatStream {self.conn_id}] Could not save assistant message in {elapsed:.3f}s. Error: {e}")
+            logger.warning("[ChatStream %s] Could not save assistant message in %.3fs. Error: %s", self.conn_id, elapsed, e)
             return None
+
+    async def _close_stale_connections(self):
+        """
+        سوکت‌ها طولانی‌مدت‌اند و چرخهٔ request_started/finished جنگو برایشان اجرا نمی‌شود؛
+        پس بین نوبت‌ها اتصال‌های DB منقضی/خراب (طبق CONN_MAX_AGE) را خودمان می‌بندیم.
+        روی همان thread حساس ORM اجرا می‌شود تا به اتصال صحیح دسترسی داشته باشد.
+        """
+        try:
+            await sync_to_async(close_old_connections)()
+        except Exception as e:
+            logger.debug("[ChatStream %s] close_old_connections ignored: %s", self.conn_id, e)
             
     # ---------- Lifecycle ----------
     async def connect(self):
         self.user = self.scope.get("user")
-        logger.info(f"DEBUG_AUTH: User object from scope: {repr(self.user)}")
-        logger.info(f"DEBUG_AUTH: Is user authenticated? {getattr(self.user, 'is_authenticated', False)}")
+        logger.debug("DEBUG_AUTH: User object from scope: %r", self.user)
+        logger.debug("DEBUG_AUTH: Is user authenticated? %s", getattr(self.user, 'is_authenticated', False))
         await self.accept()
+        WS_CONNECTIONS.labels("chat").inc()
+        WS_CONNECTIONS_TOTAL.labels("chat").inc()
+        self._counted = True
         self.inbox = asyncio.Queue()
         self.runner_task = asyncio.create_task(self._runner())
         await self.send_json({"type": "connected"})
         if self.user and self.user.is_authenticated:
-            logger.info(f"[ChatStream {self.conn_id}] Authenticated user connected: {getattr(self.user, 'email', self.user.username)}. Client: {self.scope.get('client')}")
+            logger.info("[ChatStream %s] Authenticated user connected: %s. Client: %s", self.conn_id, getattr(self.user, 'email', self.user.username), self.scope.get('client'))
         else:
-            logger.info(f"[ChatStream {self.conn_id}] Anonymous user connected. Client: {self.scope.get('client')}")
+            logger.info("[ChatStream %s] Anonymous user connected. Client: %s", self.conn_id, self.scope.get('client'))
 
     async def disconnect(self, code):
-        logger.info(f"[ChatStream {self.conn_id}] Disconnect called (code={code}). Processed {self.message_counter} messages.")
+        logger.info("[ChatStream %s] Disconnect called (code=%s). Processed %s messages.", self.conn_id, code, self.message_counter)
+        if self._counted:
+            WS_CONNECTIONS.labels("chat").dec()
+            self._counted = False
         runner_status = "done" if self.runner_task and self.runner_task.done() else "running"
         stream_status = "done" if self.current_stream_task and self.current_stream_task.done() else "running"
-        logger.info(f"[ChatStream {self.conn_id}] Tasks status before cancel: runner={runner_status}, stream={stream_status}")
+        logger.debug("[ChatStream %s] Tasks status before cancel: runner=%s, stream=%s", self.conn_id, runner_status, stream_status)
         if self.runner_task and not self.runner_task.done(): self.runner_task.cancel()
         if self.current_stream_task and not self.current_stream_task.done(): self.current_stream_task.cancel()
-        logger.info(f"[ChatStream {self.conn_id}] Disconnected. All tasks cancelled.")
+        logger.debug("[ChatStream %s] Disconnected. All tasks cancelled.", self.conn_id)
 
     async def receive(self, text_data=None, bytes_data=None):
         receive_time = time.monotonic()
         try: data = json.loads(text_data or "{}")
         except Exception as e:
-            logger.error(f"[ChatStream {self.conn_id}] Bad JSON payload: {e}")
+            logger.error("[ChatStream %s] Bad JSON payload: %s", self.conn_id, e)
             await self._send_error(f"Bad JSON payload: {e}", error_type="bad_payload")
             return
         msg_type = data.get("type")
         if msg_type == "ping":
             await self.send_json({"type": "pong"})
-            logger.debug(f"[ChatStream {self.conn_id}] Ping-pong")
+            logger.debug("[ChatStream %s] Ping-pong", self.conn_id)
             return
         if msg_type == "cancel":
             if self.current_stream_task and not self.current_stream_task.done():
                 self.current_stream_task.cancel()
-                logger.info(f"[ChatStream {self.conn_id}] Client requested stream cancellation.")
+                logger.info("[ChatStream %s] Client requested stream cancellation.", self.conn_id)
             return
         if msg_type != "chat_message":
-            logger.warning(f"[ChatStream {self.conn_id}] Unknown message type: {msg_type}")
+            logger.warning("[ChatStream %s] Unknown message type: %s", self.conn_id, msg_type)
             await self._send_error(f"Unknown message type: {msg_type}", error_type="unknown_type")
             return
         self.message_counter += 1
@@ -238,46 +310,51 @@ class ChatStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
         data['req_id'] = req_id
         data['receive_time'] = receive_time
         queue_size = self.inbox.qsize()
-        logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Received chat message. Queue size: {queue_size}")
+        logger.debug("[ChatStream %s] [%s] Received chat message. Queue size: %s", self.conn_id, req_id, queue_size)
         await self.inbox.put(data)
-        logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Message enqueued successfully.")
+        logger.debug("[ChatStream %s] [%s] Message enqueued successfully.", self.conn_id, req_id)
 
     async def _runner(self):
-        logger.info(f"[ChatStream {self.conn_id}] Runner task started.")
+        logger.debug("[ChatStream %s] Runner task started.", self.conn_id)
         try:
             while True:
-                logger.debug(f"[ChatStream {self.conn_id}] Runner waiting for next message...")
+                logger.debug("[ChatStream %s] Runner waiting for next message...", self.conn_id)
                 data = await self.inbox.get()
                 req_id = data.get('req_id', 'no-id')
                 receive_time = data.get('receive_time', time.monotonic())
                 dequeue_time = time.monotonic()
                 queue_wait = dequeue_time - receive_time
-                logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Message dequeued after {queue_wait:.3f}s wait. Starting handler...")
+                logger.debug("[ChatStream %s] [%s] Message dequeued after %.3fs wait. Starting handler...", self.conn_id, req_id, queue_wait)
+                data['dequeue_time'] = dequeue_time
+                # معادل request_started برای هر نوبت: اتصال منقضی را قبل از اولین کوئری کنار می‌گذاریم
+                await self._close_stale_connections()
                 self.current_stream_task = asyncio.create_task(self._handle_chat_message(data))
                 try:
                     await self.current_stream_task
                     handler_time = time.monotonic() - dequeue_time
-                    logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Handler completed successfully in {handler_time:.3f}s.")
+                    logger.debug("[ChatStream %s] [%s] Handler completed successfully in %.3fs.", self.conn_id, req_id, handler_time)
                 except Exception as e:
                     handler_time = time.monotonic() - dequeue_time
-                    logger.exception(f"[ChatStream {self.conn_id}] [{req_id}] Handler failed after {handler_time:.3f}s: {e}")
+                    logger.exception("[ChatStream %s] [%s] Handler failed after %.3fs: %s", self.conn_id, req_id, handler_time, e)
                 finally:
                     self.current_stream_task = None
                     self.inbox.task_done()
+                    await self._close_stale_connections()
                     total_time = time.monotonic() - receive_time
-                    logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Total processing time: {total_time:.3f}s. Runner ready for next message.")
+                    logger.debug("[ChatStream %s] [%s] Total processing time: %.3fs. Runner ready for next message.", self.conn_id, req_id, total_time)
         except asyncio.CancelledError:
-            logger.info(f"[ChatStream {self.conn_id}] Runner task is shutting down.")
+            logger.debug("[ChatStream %s] Runner task is shutting down.", self.conn_id)
         except Exception:
-            logger.exception(f"[ChatStream {self.conn_id}] Unhandled exception in runner task.")
+            logger.exception("[ChatStream %s] Unhandled exception in runner task.", self.conn_id)
             
     # ---------- Handler ----------
     async def _handle_chat_message(self, data: Dict[str, Any]):
         req_id = data.get('req_id', 'no-id')
-        handler_start = time.monotonic()
+        receive_time = data.get('receive_time', time.monotonic())
+        marks: Dict[str, float] = {"received": receive_time, "dequeued": data.get('dequeue_time', time.monotonic())}
         content = (data.get("content") or "").strip()
         model, params, provider_name, conversation_id = data.get("model"), data.get("params", {}), data.get("provider"), data.get("conversation_id")
-        logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Processing: model={model}, provider={provider_name}, conv_id={conversation_id}, content_len={len(content)}")
+        logger.debug("[ChatStream %s] [%s] Processing: model=%s, provider=%s, conv_id=%s, content_len=%s", self.conn_id, req_id, model, provider_name, conversation_id, len(content))
         
         if not content:
             await self._send_error("Empty content.", error_type="input_validation")
@@ -286,129 +363,258 @@ class ChatStreamConsumer(JsonSendMixin, AsyncWebsocketConsumer):
             await self._send_error("No model selected.", error_type="input_validation")
             return
 
+        # ساخت provider هیچ I/O ندارد؛ مستقیم روی event loop اجرا می‌شود تا رفت‌وبرگشت thread حذف شود
         try:
-            provider = await sync_to_async(get_provider)(provider_name)
+            provider = get_provider(provider_name)
         except Exception as e:
             await self._send_error(f"Provider init failed: {e}", error_type="provider_init")
             return
-            
-        conv: Optional[Conversation] = None
+
+        # رزرو سهمیهٔ توکن کاربران لاگین‌شده (یک EVALSHA؛ سقف‌ها در cache) پیش از باز شدن upstream
+        reservation = None
+        if self.user and self.user.is_authenticated:
+            try:
+                reservation = await sync_to_async(reserve_tokens)(self.user, model, estimate_tokens(content))
+            except QuotaExceeded as e:
+                await self._send_error(str(e), error_type="quota_exceeded")
+                return
+
+        # ✨ Pipeline حدسی: درخواست upstream بلافاصله بعد از اعتبارسنجی شروع می‌شود و
+        # هم‌زمان با ذخیره‌سازی در DB جلو می‌رود؛ رویدادها تا مشخص شدن conversation در صف می‌مانند.
+        messages = [{"role": "user", "content": content}]
+        events: asyncio.Queue = asyncio.Queue()
+        upstream_task = asyncio.create_task(self._pump_upstream(provider, messages, model, params, events, marks, req_id))
+        outcome = "failed"
+        parts: list[str] = []
+        turn: Dict[str, Any] = {"provider": provider_name, "conversation_id": conversation_id, "new_conversation": not conversation_id}
+        conv = None
+        STREAMS_IN_FLIGHT.labels("ws").inc()
+        try:
+            conv = await self._persist_user_turn(conversation_id, content, provider_name, model, req_id)
+            marks["persisted"] = time.monotonic()
+            STREAM_PERSIST_SECONDS.labels("user_turn").observe(marks["persisted"] - marks["dequeued"])
+            if conv is None:
+                # ذخیره‌سازی شکست خورد؛ استریم upstream را لغو می‌کنیم
+                logger.debug("[ChatStream %s] [%s] Persistence failed; cancelling upstream stream.", self.conn_id, req_id)
+                return
+
+            # مهلت‌ها (connect/ttft/idle/total) در _pump_upstream اعمال می‌شوند، نه یک wait_for کلی
+            try:
+                await self._stream_and_save_response(events, model, conv, provider_name, req_id, marks, turn, parts)
+                outcome = "completed"
+            except StreamTimeout as e:
+                outcome = "timeout"
+                turn["timeout"] = e.kind
+                STREAM_TIMEOUTS_TOTAL.labels(model, "ws", e.kind).inc()
+                await self._send_error(str(e), e.error_type)
+            except MalformedProviderEvent as e:
+                turn["error"] = "event_format"
+                await self._send_error(str(e), error_type="event_format")
+            except Exception as e:
+                logger.exception("[ChatStream %s] [%s] Upstream stream failed", self.conn_id, req_id)
+                await self._send_error(f"Provider error: {e}", "provider_error")
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                # اول stream upstream بسته می‌شود، بعد پاسخ ناقص ذخیره می‌شود
+                upstream_task.cancel()
+                await self._send_error("Request was cancelled.", "cancelled")
+                await self._save_partial_response(conv, parts, provider_name, model, marks, req_id)
+        finally:
+            STREAMS_IN_FLIGHT.labels("ws").dec()
+            STREAM_DURATION_SECONDS.labels(model, "ws", outcome).observe(time.monotonic() - marks["dequeued"])
+            if not upstream_task.done():
+                upstream_task.cancel()
+            await asyncio.gather(upstream_task, return_exceptions=True)
+            turn["outcome"] = outcome
+            self._log_turn_summary(req_id, model, marks, turn)
+            used = len(content) + turn.get("chars", sum(len(p) for p in parts))
+            if "upstream_start" in marks:
+                self._record_usage(model, marks, outcome, used, turn.get("timeout"))
+            if reservation is not None:
+                # گفتگوی نیافته/ذخیره‌نشده: استریم حدسی upstream به حساب سهمیهٔ کاربر گذاشته نمی‌شود
+                charged = used if conv is not None and "upstream_start" in marks else 0
+                await sync_to_async(settle_tokens, thread_sensitive=False)(reservation, charged)
+
+    async def _persist_user_turn(self, conversation_id, content: str, provider_name: Optional[str], model: str, req_id: str) -> Optional[Conversation]:
+        """گفتگو را پیدا/ایجاد و پیام کاربر را ذخیره می‌کند. در صورت خطا پیام خطا را می‌فرستد و None برمی‌گرداند."""
         if conversation_id:
             try:
                 conv = await self._get_conversation(int(conversation_id))
-            except Exception as e:
+            except Exception:
                 await self._send_error("Conversation not found.", error_type="not_found")
-                return
+                return None
             await self._create_user_message(conv, content, provider_name, model)
-        else:
-            logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Creating new conversation...")
-            
-            conv = await self._create_conversation(user=self.user, model=model, initial_content=content)
-            
-            if conv is None:
-                await self._send_error("Failed to create conversation.", error_type="db_error")
-                return
-            
-            user_message = await self._create_user_message(conv, content, provider_name, model)
-            if user_message is None:
-                await self._send_error("Failed to save initial message.", error_type="db_error")
-                return
+            return conv
 
-            await self.send_json({
-                "type": "ConversationCreated",
-                "conversation_id": conv.id,
-                "title": conv.title
-            })
-            logger.info(f"[ChatStream {self.conn_id}] [{req_id}] New conversation id={conv.id} title='{conv.title}' and first message saved atomically. Notified client.")
+        logger.debug("[ChatStream %s] [%s] Creating new conversation...", self.conn_id, req_id)
+        conv = await self._create_conversation(user=self.user, model=model, initial_content=content)
+        if conv is None:
+            await self._send_error("Failed to create conversation.", error_type="db_error")
+            return None
 
-        messages = [{"role": "user", "content": content}]
-        try:
-            await asyncio.wait_for(
-                self._stream_and_save_response(provider, messages, model, params, conv, provider_name, req_id),
-                timeout=self.max_stream_seconds
-            )
-        except asyncio.TimeoutError:
-            await self._send_error("Streaming timed out.", "timeout")
-        except asyncio.CancelledError:
-            await self._send_error("Request was cancelled.", "cancelled")
-            
-    # ✨ تغییر اصلی: متد _stream_and_save_response برای async generator
-    async def _stream_and_save_response(self, provider, messages, model: str, params: Dict[str, Any], conv: Optional[Conversation], provider_name: Optional[str], req_id: str):
-        buffer_parts: list[str] = []
-        await self.send_json({"type": "started"})
-        stream_start = time.monotonic()
+        user_message = await self._create_user_message(conv, content, provider_name, model)
+        if user_message is None:
+            await self._send_error("Failed to save initial message.", error_type="db_error")
+            return None
+
+        await self.send_json({
+            "type": "ConversationCreated",
+            "conversation_id": conv.id,
+            "title": conv.title
+        })
+        logger.debug("[ChatStream %s] [%s] New conversation id=%s title='%s' and first message saved. Notified client.", self.conn_id, req_id, conv.id, conv.title)
+        return conv
+
+    async def _pump_upstream(self, provider, messages, model: str, params: Dict[str, Any], events: asyncio.Queue, marks: Dict[str, float], req_id: str):
+        """رویدادهای provider را (async یا sync generator) در صف می‌ریزد. خطا به‌صورت exception در صف قرار می‌گیرد."""
         gen = None
-        token_count = 0
         try:
-            logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Initializing provider stream...")
-            gen_start = time.monotonic()
-            
-            # ✨ تغییر ۱: حذف asyncio.to_thread - حالا provider.generate مستقیماً async است
+            marks["upstream_start"] = time.monotonic()
+            inter_token = STREAM_INTER_TOKEN_SECONDS.labels(model)
+            last_token_at = None
             gen = provider.generate(messages=messages, model=model, params=params, stream=True)
-            
-            gen_init_time = time.monotonic() - gen_start
-            logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Provider stream initialized in {gen_init_time:.3f}s")
-            first_token_time = None
-            
-            # ✨ تغییر ۲: استفاده از async for به جای while True + next
-            async for event in gen:
-                if first_token_time is None:
-                    first_token_time = time.monotonic()
-                    ttft = first_token_time - stream_start
-                    logger.info(f"[ChatStream {self.conn_id}] [{req_id}] First token received in {ttft:.3f}s")
-                
-                if not isinstance(event, dict) or "type" not in event:
-                    logger.error(f"[ChatStream {self.conn_id}] [{req_id}] Malformed event from provider: {event}")
-                    await self._send_error("Malformed event from provider.", error_type="event_format")
-                    return
-                
-                if event["type"] == "token":
-                    delta = event.get("delta") or ""
-                    buffer_parts.append(str(delta))
-                    event["delta"] = str(delta)
-                    token_count += 1
-                
-                await self.send_json(event)
-            
-            stream_end = time.monotonic()
-            stream_duration = stream_end - stream_start
-            final_text = "".join(buffer_parts)
-            latency_ms = int(stream_duration * 1000)
-            logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Stream finished: {token_count} tokens, {len(final_text)} chars in {stream_duration:.3f}s")
-            
-            if conv is not None:
-                save_start = time.monotonic()
-                try:
-                    await self._create_assistant_message(conv, final_text, provider_name, model, latency_ms)
-                    save_time = time.monotonic() - save_start
-                    logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Assistant message saved in {save_time:.3f}s")
-                    celery_start = time.monotonic()
-                    try:
-                        generate_and_save_smart_title_task.delay(conv.id)
-                        celery_time = time.monotonic() - celery_start
-                        logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Celery task queued in {celery_time:.3f}s")
-                    except Exception as e:
-                        celery_time = time.monotonic() - celery_start
-                        logger.warning(f"[ChatStream {self.conn_id}] [{req_id}] Could not queue smart title in {celery_time:.3f}s: {e}")
-                except Exception as e:
-                    save_time = time.monotonic() - save_start
-                    logger.warning(f"[ChatStream {self.conn_id}] [{req_id}] Assistant message save failed in {save_time:.3f}s: {e}")
-            
-            await self.send_json({"type": "done", "finish_reason": "completed"})
-            logger.info(f"[ChatStream {self.conn_id}] [{req_id}] Response completed and sent to client.")
-            
+            iterator = gen if hasattr(gen, "__aiter__") else aiter_sync(gen)
+            tracker = DeadlineTracker(get_deadlines(model))
+            async for event in aiter_with_deadlines(iterator, tracker):
+                if isinstance(event, dict) and event.get("type") == "token":
+                    now = time.monotonic()
+                    if last_token_at is None:
+                        marks["upstream_first_token"] = now
+                    else:
+                        inter_token.observe(now - last_token_at)
+                    last_token_at = now
+                events.put_nowait(event)
+        except asyncio.CancelledError:
+            logger.debug("[ChatStream %s] [%s] Upstream stream cancelled.", self.conn_id, req_id)
+            raise
+        except Exception as e:
+            events.put_nowait(e)
         finally:
             close_start = time.monotonic()
             try:
-                # ✨ تغییر ۳: مدیریت بستن async generator
-                if gen and hasattr(gen, "aclose"):
+                if gen is not None and hasattr(gen, "aclose"):
                     await gen.aclose()
-                    close_time = time.monotonic() - close_start
-                    logger.debug(f"[ChatStream {self.conn_id}] [{req_id}] Async generator closed in {close_time:.3f}s")
-                elif gen and hasattr(gen, "close"):
+                elif gen is not None and hasattr(gen, "close"):
                     gen.close()
-                    close_time = time.monotonic() - close_start
-                    logger.debug(f"[ChatStream {self.conn_id}] [{req_id}] Generator closed in {close_time:.3f}s")
+                logger.debug("[ChatStream %s] [%s] Provider generator closed in %.3fs", self.conn_id, req_id, time.monotonic() - close_start)
             except Exception as e:
-                close_time = time.monotonic() - close_start
-                logger.debug(f"[ChatStream {self.conn_id}] [{req_id}] Generator close ignored in {close_time:.3f}s: {e}")
\ No newline at end of file
+                logger.debug("[ChatStream %s] [%s] Generator close ignored in %.3fs: %s", self.conn_id, req_id, time.monotonic() - close_start, e)
+            events.put_nowait(_STREAM_END)
+
+    async def _save_partial_response(self, conv: Conversation, parts: list[str], provider_name: Optional[str], model: str, marks: Dict[str, float], req_id: str):
+        """پاسخ ناقص نوبت لغوشده را با وضعیت cancelled ذخیره می‌کند (حتی اگر سوکت بسته شده باشد)."""
+        if not parts:
+            return
+        latency_ms = int((time.monotonic() - marks.get("upstream_start", marks["dequeued"])) * 1000)
+        try:
+            await self._create_assistant_message(conv, "".join(parts), provider_name, model, latency_ms, status="CANCELLED")
+        except asyncio.CancelledError:
+            logger.warning("[ChatStream %s] [%s] Partial response save interrupted.", self.conn_id, req_id)
+
+    async def _stream_and_save_response(self, events: asyncio.Queue, model: str, conv: Optional[Conversation], provider_name: Optional[str], req_id: str, marks: Dict[str, float], turn: Dict[str, Any], buffer_parts: list[str]):
+        await self.send_json({"type": "started"})
+        stream_start = time.monotonic()
+        token_count = 0
+        buffered = events.qsize()
+        if buffered:
+            logger.debug("[ChatStream %s] [%s] Flushing %s upstream events buffered during persistence", self.conn_id, req_id, buffered)
+
+        while True:
+            event = await events.get()
+            if event is _STREAM_END:
+                break
+            if isinstance(event, BaseException):
+                raise event
+
+            if not isinstance(event, dict) or "type" not in event:
+                logger.error("[ChatStream %s] [%s] Malformed event from provider: %s", self.conn_id, req_id, event)
+                raise MalformedProviderEvent("Malformed event from provider.")
+
+            if event["type"] == "token":
+                delta = event.get("delta") or ""
+                buffer_parts.append(str(delta))
+                event["delta"] = str(delta)
+                token_count += 1
+                if "client_first_token" not in marks:
+                    marks["client_first_token"] = time.monotonic()
+
+            await self.send_json(event)
+
+        stream_end = time.monotonic()
+        stream_duration = stream_end - stream_start
+        final_text = "".join(buffer_parts)
+        # از اینجا پاسخ کامل ذخیره می‌شود؛ لغو در حین ذخیره نباید نسخهٔ ناقص دوم بسازد
+        buffer_parts.clear()
+        # latency از لحظهٔ شروع upstream محاسبه می‌شود، نه از لحظهٔ تخلیهٔ بافر
+        latency_ms = int((stream_end - marks.get("upstream_start", stream_start)) * 1000)
+        logger.debug("[ChatStream %s] [%s] Stream finished: %s tokens, %s chars in %.3fs", self.conn_id, req_id, token_count, len(final_text), stream_duration)
+        turn.update(conversation_id=getattr(conv, "id", None), tokens=token_count, chars=len(final_text), stream_ms=int(stream_duration * 1000))
+
+        if conv is not None:
+            save_start = time.monotonic()
+            try:
+                await self._create_assistant_message(conv, final_text, provider_name, model, latency_ms)
+                save_time = time.monotonic() - save_start
+                turn["save_ms"] = int(save_time * 1000)
+                STREAM_PERSIST_SECONDS.labels("assistant").observe(save_time)
+                logger.debug("[ChatStream %s] [%s] Assistant message saved in %.3fs", self.conn_id, req_id, save_time)
+                celery_start = time.monotonic()
+                try:
+                    await arequest_smart_title(conv.id)
+                    celery_time = time.monotonic() - celery_start
+                    logger.debug("[ChatStream %s] [%s] Celery task queued in %.3fs", self.conn_id, req_id, celery_time)
+                except Exception as e:
+                    celery_time = time.monotonic() - celery_start
+                    logger.warning("[ChatStream %s] [%s] Could not queue smart title in %.3fs: %s", self.conn_id, req_id, celery_time, e)
+            except Exception as e:
+                save_time = time.monotonic() - save_start
+                logger.warning("[ChatStream %s] [%s] Assistant message save failed in %.3fs: %s", self.conn_id, req_id, save_time, e)
+
+        await self.send_json({"type": "done", "finish_reason": "completed"})
+        logger.debug("[ChatStream %s] [%s] Response completed and sent to client.", self.conn_id, req_id)
+
+    def _record_usage(self, model: str, marks: Dict[str, float], outcome: str, tokens: int, timeout_kind: Optional[str]):
+        """ثبت ModelUsageLog نوبت (فقط افزودن به بافر؛ بدون I/O روی event loop)"""
+        authenticated = bool(self.user and self.user.is_authenticated)
+        session = self.scope.get("session")
+        success = outcome in ("completed", "cancelled")
+        record_usage(
+            model,
+            user_id=self.user.pk if authenticated else None,
+            session_key=None if authenticated else getattr(session, "session_key", None),
+            tokens=tokens,
+            latency_ms=int((time.monotonic() - marks["upstream_start"]) * 1000),
+            success=success,
+            error="" if success else (f"timeout:{timeout_kind}" if timeout_kind else outcome),
+        )
+
+    def _log_turn_summary(self, req_id: str, model: Optional[str], marks: Dict[str, float], turn: Dict[str, Any]):
+        """
+        یک رکورد ساخت‌یافته برای کل نوبت (به‌جای لاگ‌های مرحله‌به‌مرحله) شامل تفکیک TTFT:
+        چه مقدار از زمان اولین توکن صرف صف، DB و upstream شده است.
+        """
+        def _ms(end: str, start: str) -> Optional[int]:
+            if end in marks and start in marks:
+                return int((marks[end] - marks[start]) * 1000)
+            return None
+
+        breakdown = {
+            "conn_id": self.conn_id,
+            "req_id": req_id,
+            "model": model,
+            "queue_wait_ms": _ms("dequeued", "received"),
+            "upstream_start_ms": _ms("upstream_start", "received"),
+            "persist_ms": _ms("persisted", "dequeued"),
+            "upstream_ttft_ms": _ms("upstream_first_token", "upstream_start"),
+            "client_ttft_ms": _ms("client_first_token", "received"),
+            "total_ms": int((time.monotonic() - marks["received"]) * 1000),
+            **turn,
+        }
+        # اگر توکن اول قبل از پایان ذخیره‌سازی رسیده باشد، این مقدار زمان انتظارش در بافر است
+        if "upstream_first_token" in marks and "persisted" in marks:
+            breakdown["buffered_ms"] = max(0, int((marks["persisted"] - marks["upstream_first_token"]) * 1000))
+        if breakdown["client_ttft_ms"] is not None:
+            STREAM_TTFT_SECONDS.labels(model or "", "ws").observe(breakdown["client_ttft_ms"] / 1000)
+        if breakdown["upstream_ttft_ms"] is not None:
+            STREAM_UPSTREAM_TTFT_SECONDS.labels(model or "").observe(breakdown["upstream_ttft_ms"] / 1000)
+        logger.info("CHAT_TURN", extra=breakdown)
@@ -0,0 +1,81 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+
+from apps.realtime.consumers import ChatStreamConsumer
+
+
+class Command(BaseCommand):
+    help = 'بنچمارک توان عملیاتی ChatStreamConsumer وقتی thread pool همگام اشباع است'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=20, help='تعداد سوکت هم‌زمان')
+        parser.add_argument('--turns', type=int, default=5, help='تعداد پیام در هر سوکت')
+        parser.add_argument('--noise', type=int, default=8, help='تعداد کار sync هم‌زمان (شبیه view های DRF)')
+        parser.add_argument('--noise-ms', type=int, default=50, help='مدت هر کار sync بر حسب میلی‌ثانیه')
+
+    def handle(self, *args, **options):
+        # گفتگو و پیام‌ها در دیتابیس تست (مثل test runner) نوشته می‌شوند و در پایان حذف می‌شوند؛
+        # ORM async در threadهای جدا اجرا می‌شود، پس یک تراکنش rollback‌شده روی همین اتصال کافی نیست.
+        # provider ساختگی و channel layer حافظه‌ای
+        settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        channel_layers.backends = {}
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            latencies, elapsed = asyncio.run(self._run(options))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        total = len(latencies)
+        latencies.sort()
+        p95 = latencies[max(0, int(total * 0.95) - 1)] if total else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {total} turns in {elapsed:.2f}s → {total / elapsed:.1f} turns/s\n"
+            f"   latency p50={statistics.median(latencies) * 1000:.1f}ms p95={p95 * 1000:.1f}ms "
+            f"(sessions={options['sessions']}, noise={options['noise']}x{options['noise_ms']}ms)"
+        ))
+
+    async def _run(self, options):
+        stop = asyncio.Event()
+        blocking = sync_to_async(time.sleep)  # thread_sensitive=True مثل viewهای sync زیر Daphne
+
+        async def noise_worker():
+            while not stop.is_set():
+                await blocking(options['noise_ms'] / 1000)
+
+        async def session():
+            comm = WebsocketCommunicator(ChatStreamConsumer.as_asgi(), "/ws/chat/")
+            await comm.connect()
+            await comm.receive_json_from()
+            conv_id = None
+            out = []
+            for i in range(options['turns']):
+                payload = {"type": "chat_message", "content": f"bench {i}", "model": "fake-1", "provider": "fake"}
+                if conv_id:
+                    payload["conversation_id"] = conv_id
+                t0 = time.monotonic()
+                await comm.send_json_to(payload)
+                while True:
+                    ev = await comm.receive_json_from(timeout=60)
+                    if ev["type"] == "ConversationCreated":
+                        conv_id = ev["conversation_id"]
+                    if ev["type"] in ("done", "error"):
+                        break
+                out.append(time.monotonic() - t0)
+            await comm.disconnect()
+            return out
+
+        noise = [asyncio.create_task(noise_worker()) for _ in range(options['noise'])]
+        start = time.monotonic()
+        results = await asyncio.gather(*(session() for _ in range(options['sessions'])))
+        elapsed = time.monotonic() - start
+        stop.set()
+        await asyncio.gather(*noise)
+        return [lat for r in results for lat in r], elapsed
@@ -0,0 +1,59 @@
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from apps.chat.publisher import StreamPublisher
+
+
+class _CountingLayer:
+    """channel layer ساختگی: فقط تعداد group_send (معادل رفت‌وبرگشت Redis) را می‌شمارد."""
+
+    def __init__(self):
+        self.ops = 0
+
+    async def group_send(self, group, message):
+        self.ops += 1
+
+
+class Command(BaseCommand):
+    help = 'مقایسهٔ group_send به ازای هر توکن با StreamPublisher دسته‌ای (تعداد عملیات و CPU)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generations', type=int, default=50)
+        parser.add_argument('--tokens', type=int, default=400, help='توکن در هر تولید')
+        parser.add_argument('--token-interval-ms', type=float, default=5.0, help='فاصلهٔ توکن‌های upstream')
+
+    def handle(self, *args, **options):
+        for label, runner in (("per-token async_to_sync", self._per_token), ("batched publisher", self._batched)):
+            layer = _CountingLayer()
+            cpu0, wall0 = time.process_time(), time.monotonic()
+            runner(layer, options)
+            cpu, wall = time.process_time() - cpu0, time.monotonic() - wall0
+            self.stdout.write(
+                f"{label:>24}: ops/generation={layer.ops / options['generations']:.1f} "
+                f"cpu={cpu * 1000:.0f}ms wall={wall:.2f}s"
+            )
+
+    def _events(self, options):
+        interval = options['token_interval_ms'] / 1000
+        for g in range(options['generations']):
+            group = f"msg_{g}"
+            yield group, {"type": "started"}, False
+            for i in range(options['tokens']):
+                time.sleep(interval)
+                yield group, {"type": "token", "delta": "x ", "seq": i}, False
+            yield group, {"type": "done", "finish_reason": "completed"}, True
+
+    def _per_token(self, layer, options):
+        for group, event, _ in self._events(options):
+            async_to_sync(layer.group_send)(group, {"type": "stream.message", "event": event})
+
+    def _batched(self, layer, options):
+        publisher = StreamPublisher()
+        publisher._layer = layer
+        try:
+            for group, event, flush in self._events(options):
+                publisher.publish(group, event, flush=flush)
+        finally:
+            publisher.close()
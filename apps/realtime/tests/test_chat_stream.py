@@ -0,0 +1,121 @@
+import pytest
+from channels.testing import WebsocketCommunicator
+
+from apps.chat.models import Conversation, Message
+from apps.realtime import consumers
+from apps.realtime.consumers import ChatStreamConsumer, MessageStreamConsumer
+
+
+@pytest.fixture(autouse=True)
+def _isolated(settings, monkeypatch):
+    settings.CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+    # تسک عنوان هوشمند به broker نیاز دارد؛ در این تست‌ها فقط مسیر استریم بررسی می‌شود
+    async def _noop(*a, **kw):
+        return None
+
+    monkeypatch.setattr(consumers, "arequest_smart_title", _noop)
+
+
+async def _collect_until(comm, terminal=("done", "error")):
+    events = []
+    while True:
+        ev = await comm.receive_json_from(timeout=5)
+        events.append(ev)
+        if ev.get("type") in terminal:
+            return events
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_chat_stream_new_conversation_fake_provider():
+    comm = WebsocketCommunicator(ChatStreamConsumer.as_asgi(), "/ws/chat/")
+    connected, _ = await comm.connect()
+    assert connected
+    assert (await comm.receive_json_from())["type"] == "connected"
+
+    await comm.send_json_to({"type": "chat_message", "content": "سلام دنیا", "model": "fake-1", "provider": "fake"})
+    events = await _collect_until(comm)
+    await comm.disconnect()
+
+    types = [e["type"] for e in events]
+    # رویداد ایجاد گفتگو باید قبل از هر توکنی برسد
+    assert types[0] == "ConversationCreated"
+    assert types.index("ConversationCreated") < types.index("token")
+    assert types[-1] == "done"
+
+    conv_id = events[0]["conversation_id"]
+    text = "".join(e["delta"] for e in events if e["type"] == "token")
+    roles = [m.role async for m in Message.objects.filter(conversation_id=conv_id).order_by("id")]
+    assert roles == [Message.Role.USER, Message.Role.ASSISTANT]
+    assistant = await Message.objects.filter(conversation_id=conv_id, role=Message.Role.ASSISTANT).aget()
+    assert assistant.content == text
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_chat_stream_missing_conversation_cancels_upstream():
+    comm = WebsocketCommunicator(ChatStreamConsumer.as_asgi(), "/ws/chat/")
+    await comm.connect()
+    await comm.receive_json_from()
+
+    await comm.send_json_to({"type": "chat_message", "content": "hi", "model": "fake-1", "provider": "fake", "conversation_id": 999999})
+    events = await _collect_until(comm)
+    await comm.disconnect()
+
+    assert [e["type"] for e in events] == ["error"]
+    assert events[0]["error_type"] == "not_found"
+    assert not await Conversation.objects.aexists()
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_message_stream_rejects_foreign_subscribers(monkeypatch, django_user_model):
+    cancelled = []
+    monkeypatch.setattr(consumers, "request_cancel", cancelled.append)
+    owner = await django_user_model.objects.acreate(email="owner@example.com")
+    other = await django_user_model.objects.acreate(email="other@example.com")
+    conv = await Conversation.objects.acreate(owner=owner, title="t")
+    msg = await Message.objects.acreate(conversation=conv, role=Message.Role.ASSISTANT, content="")
+
+    def communicator(user):
+        comm = WebsocketCommunicator(MessageStreamConsumer.as_asgi(), f"/ws/messages/{msg.id}/stream/")
+        comm.scope["url_route"] = {"kwargs": {"message_id": str(msg.id)}}
+        comm.scope["user"] = user
+        return comm
+
+    intruder = communicator(other)
+    await intruder.connect()
+    assert await intruder.receive_output() == {"type": "websocket.close", "code": 4403}
+    await intruder.disconnect()
+    assert cancelled == []
+
+    comm = communicator(owner)
+    await comm.connect()
+    assert (await comm.receive_json_from())["type"] == "connected"
+    await comm.send_json_to({"type": "cancel"})
+    await comm.disconnect()
+    assert cancelled[0] == msg.id
+
+
+class _MalformedProvider:
+    name = "malformed"
+    default_model = "fake-1"
+
+    def generate(self, messages, model=None, stream=True, **kwargs):
+        yield {"type": "token", "delta": "hi"}
+        yield "not-an-event"
+
+
+@pytest.mark.django_db(transaction=True)
+async def test_malformed_provider_event_fails_the_turn(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(consumers, "get_provider", lambda name=None: _MalformedProvider())
+    monkeypatch.setattr(consumers, "record_usage", lambda model, **kw: recorded.append(kw))
+    comm = WebsocketCommunicator(ChatStreamConsumer.as_asgi(), "/ws/chat/")
+    await comm.connect()
+    await comm.receive_json_from()
+
+    await comm.send_json_to({"type": "chat_message", "content": "hi", "model": "fake-1", "provider": "malformed"})
+    events = await _collect_until(comm)
+    await comm.disconnect()
+
+    assert events[-1]["error_type"] == "event_format"
+    assert [e["type"] for e in events].count("error") == 1
+    assert recorded and recorded[0]["success"] is False
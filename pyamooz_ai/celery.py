@@ -14,11 +14,16 @@ app = Celery("pyamooz_ai")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
-# (اختیاریِ پیشنهادی)
-# app.conf.update(
-#     task_acks_late=True,
-#     worker_max_tasks_per_child=1000,
-#     broker_connection_retry_on_startup=True,
-#     task_time_limit=60*5,
-#     task_soft_time_limit=60*4,
-# )
+# تنظیمات صف/اولویت/acks_late در settings (CELERY_*) تعریف شده‌اند. هر صف worker جدا با pool و
+# prefetch متناسب خودش دارد:
+#
+#   # تولید پاسخ: I/O-bound؛ یک پروسه ده‌ها استریم هم‌زمان را با thread نگه می‌دارد
+#   celery -A pyamooz_ai worker -Q generation -P threads -c 64 --prefetch-multiplier 1 -n gen@%h
+#
+#   # عنوان/خلاصه و فهرست مدل‌ها: کوتاه و کم‌اهمیت‌تر؛ prefork با prefetch بیشتر
+#   celery -A pyamooz_ai worker -Q background,catalog,default -P prefork -c 2 --prefetch-multiplier 4 -n bg@%h
+#
+#   # زمان‌بند دوره‌ای (CELERY_BEAT_SCHEDULE، مثلاً همگام‌سازی کاتالوگ مدل‌ها)؛ فقط یک نمونه
+#   celery -A pyamooz_ai beat
+#
+# برای مقایسهٔ تراکم workerها: `python manage.py bench_celery_workers`.
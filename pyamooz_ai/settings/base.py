@@ -1,4 +1,5 @@
 # pyamooz_ai/settings/base.py
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -45,10 +46,12 @@ INSTALLED_APPS = [
     "apps.frontend",
     "apps.accounts",
     "apps.models",
+    "apps.observability",
 ]
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "apps.observability.middleware.MetricsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -115,6 +118,49 @@ CELERY_BROKER_URL = "memory://"
 CELERY_RESULT_BACKEND = "cache+memory://"
 CELERY_TIMEZONE = TIME_ZONE
 
+# --- صف‌ها و مسیریابی تسک‌ها ---
+# generation: تولید پاسخ تعاملی (I/O-bound؛ worker با pool=threads و هم‌زمانی بالا)
+# background: عنوان هوشمند/خلاصه‌ها (prefork، prefetch بیشتر)
+# catalog:    همگام‌سازی فهرست مدل‌ها (کم‌تکرار و کند)
+# در Redis عدد کمتر یعنی اولویت بالاتر (priority_steps).
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_QUEUES = {
+    "generation": {},
+    "background": {},
+    "catalog": {},
+    "default": {},
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_TASK_ROUTES = {
+    "apps.queueapp.tasks.run_generation_task": {"queue": "generation", "priority": 0},
+    "apps.chat.tasks.*": {"queue": "background", "priority": 3},
+    "apps.models.tasks.*": {"queue": "catalog", "priority": 7},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+    # با acks_late، پیام تا ack نشدن در Redis می‌ماند؛ باید از طولانی‌ترین تسک بیشتر باشد
+    "visibility_timeout": 3600,
+}
+# پیام فقط بعد از اتمام تسک ack می‌شود؛ با مرگ worker دوباره تحویل داده می‌شود و claim شرطی
+# در run_generation از پردازش دوباره جلوگیری می‌کند. پیامی که وسط استریم رها شده (STREAMING بدون
+# ضربان) را fail_stale_generations_task به FAILED می‌برد؛ تحویل دوباره آن را claim نمی‌کند.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", "1"))
+CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+CELERY_WORKER_MAX_TASKS_PER_CHILD = 1000
+# سقف‌های زمانی فقط در pool=prefork اعمال می‌شوند؛ در pool=threads مهلت total استریم
+# (STREAM_DEADLINES) تولید را محدود می‌کند.
+CELERY_TASK_SOFT_TIME_LIMIT = 60 * 4
+CELERY_TASK_TIME_LIMIT = 60 * 5
+CELERY_TASK_ANNOTATIONS = {
+    "apps.queueapp.tasks.run_generation_task": {"soft_time_limit": 60 * 11, "time_limit": 60 * 12},
+    "apps.chat.tasks.generate_and_save_smart_title_task": {"soft_time_limit": 60, "time_limit": 90},
+    "apps.chat.tasks.flush_smart_titles_task": {"soft_time_limit": 120, "time_limit": 150},
+}
+
 # --- DRF (تنظیمات پایه) ---
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
@@ -139,12 +185,134 @@ REST_FRAMEWORK = {
 MAX_PROMPT_CHARS = int(os.getenv("MAX_PROMPT_CHARS", "4000"))
 MODEL_SETTINGS = {
     'AVALAI_API_URL': 'https://api.avalai.ir/public/models',
-    'CACHE_TIMEOUT': 300,
-    'SYNC_INTERVAL': 3600,
+    'CACHE_TIMEOUT': 300,  # تازگی کاتالوگ؛ بعد از آن دادهٔ کهنه سرو و در پس‌زمینه بازاعتبارسنجی می‌شود
+    'STALE_TTL': 86400,  # حداکثر عمر دادهٔ کهنه در کش
+    'FETCH_TIMEOUT': 10,
+    'REFRESH_LOCK_TIMEOUT': 120,
+    'SYNC_INTERVAL': 3600,  # دورهٔ Celery beat برای scheduled_catalog_sync
+    'SYNC_JITTER': 60,  # تأخیر تصادفی حداکثر (ثانیه) قبل از refresh
     'DEFAULT_GUEST_MODELS': ['gpt-3.5-turbo', 'gpt-4o-mini'],
     'RATE_LIMIT_WINDOW': 60,
 }
 
+# --- اسنپ‌شات کاتالوگ مدل‌ها در حافظهٔ هر پروسه (apps/models/services/catalog.py) ---
+# فاصلهٔ بررسی شمارندهٔ نسخه در Redis و سقف عمر اسنپ‌شات وقتی نسخه در دسترس نیست (بدون Redis)
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "1.0"))
+CATALOG_SNAPSHOT_MAX_AGE = int(os.getenv("CATALOG_SNAPSHOT_MAX_AGE", "300"))
+
+# --- مجموعهٔ مدل‌های مجاز هر کاربر (apps/models/services/entitlements.py) ---
+# سقف عمر مجموعه در cache؛ با نزدیک‌ترین expires_at مجوزها کوتاه‌تر می‌شود
+MODEL_ENTITLEMENTS_TTL = int(os.getenv("MODEL_ENTITLEMENTS_TTL", "300"))
+
+# --- پاسخ‌های رندرشدهٔ لیست/آمار مدل‌ها (apps/models/services/rendered.py) ---
+# کلیدها نسخه‌دارند؛ TTL فقط نسخه‌های قدیمی را جمع می‌کند
+MODEL_RESPONSE_CACHE_TTL = int(os.getenv("MODEL_RESPONSE_CACHE_TTL", "600"))
+
+# --- ثبت دسته‌ای ModelUsageLog (apps/models/services/usage.py) ---
+# بافر هر پروسه با رسیدن به USAGE_BATCH_SIZE یا هر USAGE_FLUSH_INTERVAL ثانیه به Redis (یا مستقیم DB)
+# فرستاده می‌شود؛ USAGE_BUFFER_MAX سقف حافظه وقتی مقصد در دسترس نیست.
+USAGE_LOGGING_ENABLED = os.getenv("USAGE_LOGGING_ENABLED", "1") == "1"
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "2"))
+USAGE_BUFFER_MAX = int(os.getenv("USAGE_BUFFER_MAX", "10000"))
+USAGE_DRAIN_INTERVAL = int(os.getenv("USAGE_DRAIN_INTERVAL", "10"))
+
+# --- rollup و نگهداری ModelUsageLog (apps/models/services/usage_rollup.py) ---
+# لاگ خام فقط بعد از rollup و گذشت USAGE_RAW_RETENTION_DAYS حذف می‌شود؛ rollupهای روزانه ماندگارند.
+USAGE_ROLLUP_INTERVAL = int(os.getenv("USAGE_ROLLUP_INTERVAL", "60"))
+USAGE_RAW_RETENTION_DAYS = int(os.getenv("USAGE_RAW_RETENTION_DAYS", "30"))
+USAGE_HOURLY_ROLLUP_RETENTION_DAYS = int(os.getenv("USAGE_HOURLY_ROLLUP_RETENTION_DAYS", "14"))
+USAGE_PRUNE_CHUNK = int(os.getenv("USAGE_PRUNE_CHUNK", "5000"))
+
+# --- سهمیهٔ توکن UserModelPermission (apps/models/services/quotas.py) ---
+# رزرو هر نوبت = طول ورودی + QUOTA_OUTPUT_ESTIMATE و بعد از پاسخ با مصرف واقعی تسویه می‌شود.
+# نوبتی که مصرف فعلی + رزروش از سقف بگذرد رد می‌شود؛ سقف روزانهٔ کمتر از این مقدار هیچ نوبتی را نمی‌پذیرد.
+# شمارنده‌های Redis هر QUOTA_PERSIST_INTERVAL ثانیه در DB نوشته می‌شوند (سقف از دست رفتن با ری‌استارت Redis).
+QUOTA_OUTPUT_ESTIMATE = int(os.getenv("QUOTA_OUTPUT_ESTIMATE", "1000"))
+QUOTA_PERSIST_INTERVAL = int(os.getenv("QUOTA_PERSIST_INTERVAL", "30"))
+
+# --- Celery beat ---
+# همگام‌سازی دوره‌ای کاتالوگ مدل‌ها (به‌جای thread راه‌اندازی در هر پروسه). اجرای تکراری به‌خاطر
+# نشانگر آخرین موفقیت و قفل توزیع‌شده بی‌اثر است.
+CELERY_BEAT_SCHEDULE = {
+    "sync-model-catalog": {
+        "task": "apps.models.tasks.scheduled_catalog_sync",
+        "schedule": MODEL_SETTINGS["SYNC_INTERVAL"],
+        "options": {"expires": MODEL_SETTINGS["SYNC_INTERVAL"] / 2},
+    },
+    "drain-usage-logs": {
+        "task": "apps.models.tasks.drain_usage_logs",
+        "schedule": USAGE_DRAIN_INTERVAL,
+        "options": {"expires": USAGE_DRAIN_INTERVAL},
+    },
+    "rollup-usage-logs": {
+        "task": "apps.models.tasks.rollup_usage_logs",
+        "schedule": USAGE_ROLLUP_INTERVAL,
+        "options": {"expires": USAGE_ROLLUP_INTERVAL},
+    },
+    "persist-quota-counters": {
+        "task": "apps.models.tasks.persist_quota_counters",
+        "schedule": QUOTA_PERSIST_INTERVAL,
+        "options": {"expires": QUOTA_PERSIST_INTERVAL},
+    },
+    "fail-stale-generations": {
+        "task": "apps.queueapp.tasks.fail_stale_generations_task",
+        "schedule": 60,
+        "options": {"expires": 60},
+    },
+    "prune-usage-logs": {
+        "task": "apps.models.tasks.prune_usage_logs",
+        "schedule": 3600,
+        "options": {"expires": 1800},
+    },
+}
+
+# --- مهلت‌های استریم upstream (ثانیه) ---
+# connect/ttft/idle/total برای هر مدل؛ کلید غیر default پیشوند نام مدل است (مثلاً «o1» برای مدل‌های
+# reasoning با TTFT طولانی). مقادیر زیر دستی انتخاب شده‌اند و هنوز اندازه‌گیری نشده‌اند؛ تا وقتی
+# `manage.py suggest_stream_deadlines` روی هیستوگرام‌های production اجرا نشده فقط جای‌نگهدارند.
+# خروجی JSON آن دستور را در STREAM_DEADLINES_JSON بگذارید.
+STREAM_DEADLINES = {
+    "default": {"connect": 5, "ttft": 30, "idle": 20, "total": 600},
+    "o1": {"ttft": 120, "idle": 60},
+    "o3": {"ttft": 120, "idle": 60},
+    **json.loads(os.getenv("STREAM_DEADLINES_JSON", "{}")),
+}
+
+# --- مسیر اجرای تولید پاسخ برای MessageCreateStreamView ---
+# celery: run_generation_task روی صف generation
+# redis_stream: XADD به CHAT_GENERATION_STREAM و مصرف با `manage.py run_generation_worker` (asyncio)
+CHAT_GENERATION_BACKEND = os.getenv("CHAT_GENERATION_BACKEND", "celery")
+CHAT_GENERATION_STREAM = "chat:generation"
+CHAT_GENERATION_GROUP = "generation"
+# ضربان updated_at پیام STREAMING در مسیر سلری (ثانیه) و سنی که بعد از آن پیام رهاشده FAILED می‌شود.
+# GENERATION_STALE_AFTER باید از بلندترین ttft/idle در STREAM_DEADLINES و claim_idle worker استریم
+# (۶۰ ثانیه) بیشتر باشد تا استریم زنده یا job قابل بازپس‌گیری FAILED نشود.
+GENERATION_HEARTBEAT_INTERVAL = int(os.getenv("GENERATION_HEARTBEAT_INTERVAL", "15"))
+GENERATION_STALE_AFTER = int(os.getenv("GENERATION_STALE_AFTER", "300"))
+
+# --- انتشار دسته‌ای رویدادهای استریم از workerها به channel layer ---
+# سقف تأخیر اضافهٔ هر توکن (میلی‌ثانیه) و حداکثر رویداد در هر flush
+STREAM_PUBLISH_MAX_DELAY_MS = int(os.getenv("STREAM_PUBLISH_MAX_DELAY_MS", "50"))
+STREAM_PUBLISH_MAX_BATCH = int(os.getenv("STREAM_PUBLISH_MAX_BATCH", "32"))
+
+# --- عنوان‌گذاری هوشمند دسته‌ای ---
+# گفتگوهای نیازمند عنوان در این پنجره (ثانیه) جمع و با یک درخواست LLM (حداکثر SMART_TITLE_BATCH_MAX
+# گفتگو) عنوان‌گذاری می‌شوند.
+SMART_TITLE_BATCH_WINDOW_SECONDS = int(os.getenv("SMART_TITLE_BATCH_WINDOW_SECONDS", "10"))
+SMART_TITLE_BATCH_MAX = int(os.getenv("SMART_TITLE_BATCH_MAX", "20"))
+# تعداد پیام‌های user/assistant که بعد از آن‌ها عنوان تولید/ارتقا داده می‌شود (از Conversation.message_count)
+SMART_TITLE_AT_MESSAGE_COUNTS = (1, 2, 5)
+# عنوان‌ساز استخراجی محلی (apps/chat/titler.py)؛ LLM فقط وقتی اطمینان کمتر از این مقدار باشد صدا زده می‌شود.
+# جدول idf با `manage.py build_title_idf` ساخته می‌شود؛ بدون آن اطمینان‌ها عمداً پایین‌اند.
+SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE = float(os.getenv("SMART_TITLE_EXTRACTIVE_MIN_CONFIDENCE", "0.7"))
+SMART_TITLE_IDF_PATH = os.getenv("SMART_TITLE_IDF_PATH", str(BASE_DIR / "var" / "title_idf.json"))
+
+# --- متریک‌ها (Prometheus) ---
+# اگر ست شود، endpoint /metrics فقط با هدر «Authorization: Bearer <token>» پاسخ می‌دهد.
+# برای تجمیع بین پروسه‌ها (Daphne + Celery) متغیر محیطی PROMETHEUS_MULTIPROC_DIR را ست کنید.
+METRICS_AUTH_TOKEN = os.getenv("METRICS_AUTH_TOKEN", "")
+
 # --- allauth (تنظیمات مشترک) ---
 ACCOUNT_LOGIN_METHODS = {"email"}
 ACCOUNT_SIGNUP_FIELDS = ["email*", "password1*", "password2*"]
@@ -177,7 +345,21 @@ LOGGING = {
             "format": "%(asctime)s %(levelname)s %(name)s %(message)s",
         }
     },
-    "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "json"}},
+    # فرمت JSON و I/O در thread جداگانه (QueueListener) انجام می‌شود، نه روی event loop
+    "filters": {
+        "rate_limit": {
+            "()": "apps.observability.log_pipeline.RateLimitFilter",
+            "rate": float(os.getenv("LOG_RATE_PER_LOGGER", "20")),
+            "burst": int(os.getenv("LOG_BURST_PER_LOGGER", "50")),
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "apps.observability.log_pipeline.QueuedStreamHandler",
+            "formatter": "json",
+            "filters": ["rate_limit"],
+        },
+    },
     "root": {"handlers": ["console"], "level": LOG_LEVEL},
 }
 
@@ -10,6 +10,8 @@ from django.views.decorators.cache import never_cache
 from django.db import connections
 from django.db.utils import OperationalError
 
+from apps.observability.views import metrics
+
 
 @never_cache
 @require_GET
@@ -55,6 +57,7 @@ urlpatterns = [
     # Health/Ready
     path("healthz/", healthz),
     path("readyz/", readyz),
+    path("metrics", metrics),
 
     # Admin
     path("admin/", admin.site.urls),